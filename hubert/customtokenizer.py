@@ -1,11 +1,16 @@
 import json
 import os.path
+import time
 from zipfile import ZipFile
 
 import numpy
 import torch
 from torch import nn, optim
+from torch.nn.utils.rnn import pack_sequence, pad_packed_sequence, pad_sequence
 from torch.serialization import MAP_LOCATION
+from torch.utils.data import Dataset, DataLoader
+
+ignore_index = -100  # Target value for padding, ignored by the loss
 
 
 class CustomTokenizer(nn.Module):
@@ -23,19 +28,26 @@ class CustomTokenizer(nn.Module):
         self.fc = nn.Linear(next_size, output_size)
         self.softmax = nn.LogSoftmax(dim=1)
         self.optimizer: optim.Optimizer = None
-        self.lossfunc = nn.CrossEntropyLoss()
+        self.lossfunc = nn.CrossEntropyLoss(ignore_index=ignore_index)
         self.input_size = input_size
         self.hidden_size = hidden_size
         self.output_size = output_size
         self.version = version
 
     def forward(self, x):
+        x = self.logits(x)
+        x = self.softmax(x)
+        return x
+
+    def logits(self, x):
+        """Forward without the softmax, which doesn't change the argmax."""
         x, _ = self.lstm(x)
+        return self._head(x)
+
+    def _head(self, x):
         if self.version == 1:
             x = self.intermediate(x)
-        x = self.fc(x)
-        x = self.softmax(x)
-        return x
+        return self.fc(x)
 
     @torch.no_grad()
     def get_token(self, x):
@@ -44,39 +56,55 @@ class CustomTokenizer(nn.Module):
         :param x: An array with shape (N, input_size) where N is a whole number greater or equal to 1, and input_size is the input size used when creating the model.
         :return: An array with shape (N,) where N is the same as N from the input. Every number in the array is a whole number in range 0...output_size - 1 where output_size is the output size used when creating the model.
         """
-        return torch.argmax(self(x), dim=1)
+        return torch.argmax(self.logits(x), dim=-1)
+
+    @torch.no_grad()
+    def get_tokens(self, xs: list[torch.Tensor]) -> list[torch.Tensor]:
+        """
+        Batched get_token, runs sequences of different lengths through the lstm at once as a packed sequence.
+        :param xs: A list of arrays with shape (N_i, input_size).
+        :return: A list of arrays with shape (N_i,).
+        """
+        lengths = [len(x) for x in xs]
+        packed = pack_sequence(xs, enforce_sorted=False)
+        out, _ = self.lstm(packed)
+        out, _ = pad_packed_sequence(out, batch_first=True)
+        tokens = torch.argmax(self._head(out), dim=-1)
+        return [tokens[i, :length] for i, length in enumerate(lengths)]
+
+    def quantized(self):
+        """
+        A copy with dynamically quantized int8 LSTM and Linear layers, for faster inference on cpu.
+        Tokens can differ slightly from the full precision model.
+        """
+        import copy
+        model = copy.deepcopy(self).cpu().eval()
+        model.optimizer = None
+        return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
 
     def prepare_training(self):
         self.optimizer = optim.Adam(self.parameters(), 0.001)
 
     def train_step(self, x_train, y_train, log_loss=False):
-        # y_train = y_train[:-1]
-        # y_train = y_train[1:]
-
+        """
+        :param x_train: Features, (N, input_size) or a padded batch (B, N, input_size).
+        :param y_train: Token indices, (N,) or a padded batch (B, N) with ignore_index as padding.
+        :return: The loss.
+        """
         optimizer = self.optimizer
         lossfunc = self.lossfunc
         # Zero the gradients
         self.zero_grad()
 
-        # Forward pass
-        y_pred = self(x_train)
-
-        y_train_len = len(y_train)
-        y_pred_len = y_pred.shape[0]
-
-        if y_train_len > y_pred_len:
-            diff = y_train_len - y_pred_len
-            y_train = y_train[diff:]
-        elif y_train_len < y_pred_len:
-            diff = y_pred_len - y_train_len
-            y_pred = y_pred[:-diff, :]
+        if x_train.dim() == 2:
+            x_train, y_train = align_pair(x_train, y_train)
+            x_train, y_train = x_train[None], y_train[None]
 
-        y_train_hot = torch.zeros(len(y_train), self.output_size)
-        y_train_hot[range(len(y_train)), y_train] = 1
-        y_train_hot = y_train_hot.to('cuda')
+        # Forward pass, CrossEntropyLoss applies the softmax itself
+        y_pred = self.logits(x_train)
 
         # Calculate the loss
-        loss = lossfunc(y_pred, y_train_hot)
+        loss = lossfunc(y_pred.flatten(0, 1), y_train.flatten().long())
 
         # Print loss
         if log_loss:
@@ -87,6 +115,7 @@ class CustomTokenizer(nn.Module):
 
         # Update the weights
         optimizer.step()
+        return loss.detach()
 
     def save(self, path):
         info_path = os.path.basename(path) + '/.info'
@@ -114,7 +143,6 @@ class CustomTokenizer(nn.Module):
         return model
 
 
-
 class Data:
     input_size: int
     hidden_size: int
@@ -142,41 +170,116 @@ class Data:
         return json.dumps(data)
 
 
-def auto_train(data_path, save_path='model.pth', load_model: str | None = None, save_epochs=1):
-    data_x, data_y = [], []
+def align_pair(x, y):
+    """Lines up features and tokens of different lengths, extra tokens are dropped from the start, extra features from the end."""
+    if len(y) > len(x):
+        y = y[len(y) - len(x):]
+    elif len(y) < len(x):
+        x = x[:len(y)]
+    return x, y
+
+
+class SemanticDataset(Dataset):
+    """
+    Pairs of (features, tokens) from a directory with `name_semantic_features.npy` and `name_semantic.npy` files.
+    Files are memory mapped, only the pairs in the current batch are read.
+    """
+    sem_string = '_semantic.npy'
+    feat_string = '_semantic_features.npy'
+
+    def __init__(self, path):
+        files = set(os.listdir(path))
+        names = sorted(f[:-len(self.feat_string)] for f in files if f.endswith(self.feat_string))
+        missing = [name for name in names if name + self.sem_string not in files]
+        if missing:
+            print(f'Skipping {len(missing)} feature files without matching semantics, like {missing[0]}')
+        self.pairs = [(os.path.join(path, name + self.feat_string), os.path.join(path, name + self.sem_string))
+                      for name in names if name not in missing]
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __getitem__(self, index):
+        feat_path, sem_path = self.pairs[index]
+        x, y = align_pair(numpy.load(feat_path, mmap_mode='r'), numpy.load(sem_path, mmap_mode='r'))
+        return torch.from_numpy(numpy.array(x, dtype=numpy.float32)), torch.from_numpy(numpy.array(y, dtype=numpy.int64))
+
+    @staticmethod
+    def collate(batch):
+        xs, ys = zip(*batch)
+        return pad_sequence(xs, batch_first=True), pad_sequence(ys, batch_first=True, padding_value=ignore_index)
+
+
+def auto_train(data_path, save_path='model.pth', load_model: str | None = None, save_epochs=1, batch_size=8, num_workers=2, device=None):
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
 
     if load_model and os.path.isfile(load_model):
         print('Loading model from', load_model)
-        model_training = CustomTokenizer.load_from_checkpoint(load_model, 'cuda')
+        model_training = CustomTokenizer.load_from_checkpoint(load_model, device).to(device)
     else:
         print('Creating new model.')
-        model_training = CustomTokenizer(version=1).to('cuda')  # Settings for the model to run without lstm
+        model_training = CustomTokenizer(version=1).to(device)  # Settings for the model to run without lstm
     save_path = os.path.join(data_path, save_path)
     base_save_path = '.'.join(save_path.split('.')[:-1])
 
-    sem_string = '_semantic.npy'
-    feat_string = '_semantic_features.npy'
-
-    ready = os.path.join(data_path, 'ready')
-    for input_file in os.listdir(ready):
-        full_path = os.path.join(ready, input_file)
-        if input_file.endswith(sem_string):
-            data_y.append(numpy.load(full_path))
-        elif input_file.endswith(feat_string):
-            data_x.append(numpy.load(full_path))
+    dataset = SemanticDataset(os.path.join(data_path, 'ready'))
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, collate_fn=SemanticDataset.collate,
+                        num_workers=num_workers, pin_memory=device.startswith('cuda'),
+                        prefetch_factor=2 if num_workers > 0 else None, persistent_workers=num_workers > 0)
+    print(f'Training on {len(dataset)} samples, on {device}')
     model_training.prepare_training()
+    model_training.train()
 
     epoch = 1
 
     while 1:
         for i in range(save_epochs):
-            j = 0
-            for x, y in zip(data_x, data_y):
-                model_training.train_step(torch.tensor(x).to('cuda'), torch.tensor(y).to('cuda'), j % 50 == 0)  # Print loss every 50 steps
-                j += 1
+            start = time.time()
+            samples = 0
+            for j, (x, y) in enumerate(loader):
+                x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
+                log = j % 50 == 0
+                model_training.train_step(x, y, log)  # Print loss every 50 steps
+                samples += len(x)
+                if log:
+                    print(f'{samples / (time.time() - start):.1f} samples/s')
+            print(f'Epoch throughput: {samples / (time.time() - start):.1f} samples/s')
         save_p = save_path
         save_p_2 = f'{base_save_path}_epoch_{epoch}.pth'
         model_training.save(save_p)
         model_training.save(save_p_2)
         print(f'Epoch {epoch} completed')
         epoch += 1
+
+
+def benchmark(model: CustomTokenizer, seconds=60, batch_size=8, repeats=3):
+    """Prints tokenizer throughput in frames per second for get_token, get_tokens, and the quantized model on cpu."""
+    frames = seconds * 50  # HuBERT runs at 50 frames per second
+    device = next(model.parameters()).device
+    xs = [torch.randn(frames - i * 10, model.input_size, device=device) for i in range(batch_size)]
+    total = sum(len(x) for x in xs)
+
+    def timed(name, fn):
+        fn()  # Warmup
+        start = time.time()
+        for _ in range(repeats):
+            fn()
+        took = (time.time() - start) / repeats
+        print(f'{name}: {total / took:.0f} frames/s')
+
+    model.eval()
+    timed('forward + softmax', lambda: [torch.argmax(model(x), dim=1) for x in xs])
+    timed('get_token', lambda: [model.get_token(x) for x in xs])
+    timed('get_tokens (packed)', lambda: model.get_tokens(xs))
+    identical = all(torch.equal(a, torch.argmax(model(x), dim=1)) for a, x in zip(model.get_tokens(xs), xs))
+    print('get_tokens identical to forward argmax:', identical)
+    if device.type == 'cpu':
+        quantized = model.quantized()
+        timed('get_tokens (int8)', lambda: quantized.get_tokens(xs))
+        agreement = torch.cat([a == b for a, b in zip(quantized.get_tokens(xs), model.get_tokens(xs))]).float().mean()
+        print(f'int8 token agreement: {agreement * 100:.2f}%')
+
+
+if __name__ == '__main__':
+    import sys
+    benchmark(CustomTokenizer.load_from_checkpoint(sys.argv[1], 'cpu') if len(sys.argv) > 1 else CustomTokenizer(version=1))
@@ -35,36 +35,82 @@ class CustomHubert(nn.Module):
         checkpoint_path,
         target_sample_hz=16000,
         seq_len_multiple_of=None,
-        output_layer=9
+        output_layer=9,
+        device=None,
+        half=False,
+        chunk_seconds=None,
+        compile=False
     ):
+        """
+        :param device: The device to run HuBERT on, defaults to cpu.
+        :param half: Run in float16, only recommended on cuda.
+        :param chunk_seconds: Process long audio in chunks of this many seconds (with context on both sides), keeps memory usage bounded.
+        :param compile: Use torch.compile on the model.
+        """
         super().__init__()
         self.target_sample_hz = target_sample_hz
         self.seq_len_multiple_of = seq_len_multiple_of
         self.output_layer = output_layer
+        self.chunk_seconds = chunk_seconds
 
         model_path = Path(checkpoint_path)
 
         assert model_path.exists(), f'path {checkpoint_path} does not exist'
 
-        checkpoint = torch.load(checkpoint_path)
+        checkpoint = torch.load(checkpoint_path, map_location='cpu')
         load_model_input = {checkpoint_path: checkpoint}
         model, *_ = fairseq.checkpoint_utils.load_model_ensemble_and_task(load_model_input)
 
         self.model = model[0]
         self.model.eval()
+        self.model.to(device or 'cpu')
+        if half:
+            self.model.half()
+        self.extract = torch.compile(self._extract) if compile else self._extract
 
     @property
     def groups(self):
         return 1
 
-    @torch.no_grad()
+    @property
+    def device(self):
+        return next(self.model.parameters()).device
+
+    @property
+    def dtype(self):
+        return next(self.model.parameters()).dtype
+
+    def _extract(self, wav_input):
+        return self.model(
+            wav_input,
+            features_only=True,
+            mask=False,  # thanks to @maitycyrus for noticing that mask is defaulted to True in the fairseq code
+            output_layer=self.output_layer
+        )['x']
+
+    def _extract_chunked(self, wav_input):
+        hop = 320  # HuBERT produces one frame per 320 samples
+        context = hop * 50  # 1 second of context on both sides of every chunk
+        chunk = max(hop, int(self.chunk_seconds * self.target_sample_hz) // hop * hop)
+        length = wav_input.shape[-1]
+        n_frames = (length - 400) // hop + 1
+        outputs = []
+        for start in range(0, length, chunk):
+            pad_start = min(start, context)
+            segment = wav_input[..., start - pad_start:start + chunk + context]
+            embed = self.extract(segment)
+            first = pad_start // hop
+            outputs.append(embed[:, first:first + chunk // hop])
+        return torch.cat(outputs, dim=1)[:, :n_frames]
+
+    @torch.inference_mode()
     def forward(
         self,
         wav_input,
         flatten=True,
         input_sample_hz=None
     ):
-        device = wav_input.device
+        wav_input = wav_input.to(self.device)
 
         if exists(input_sample_hz):
             wav_input = resample(wav_input, input_sample_hz, self.target_sample_hz)
@@ -72,21 +118,51 @@ class CustomHubert(nn.Module):
         if exists(self.seq_len_multiple_of):
             wav_input = curtail_to_multiple(wav_input, self.seq_len_multiple_of)
 
-        embed = self.model(
-            wav_input,
-            features_only=True,
-            mask=False,  # thanks to @maitycyrus for noticing that mask is defaulted to True in the fairseq code
-            output_layer=self.output_layer
-        )
+        wav_input = wav_input.to(self.dtype)
 
-        embed, packed_shape = pack([embed['x']], '* d')
+        if exists(self.chunk_seconds) and wav_input.shape[-1] > self.chunk_seconds * self.target_sample_hz:
+            embed = self._extract_chunked(wav_input)
+        else:
+            embed = self.extract(wav_input)
+
+        embed, packed_shape = pack([embed.float()], '* d')
 
         # codebook_indices = self.kmeans.predict(embed.cpu().detach().numpy())
 
-        codebook_indices = torch.from_numpy(embed.cpu().detach().numpy()).to(device)  # .long()
+        codebook_indices = embed  # .long()
 
         if flatten:
             return codebook_indices
 
         codebook_indices, = unpack(codebook_indices, packed_shape, '*')
         return codebook_indices
+
+
+def benchmark(checkpoint_path, seconds=60, repeats=3):
+    """Times feature extraction on a random clip in every mode that's available on this machine."""
+    import time
+    wav = torch.randn(1, seconds * 16000) * 0.1
+    modes = [('cpu fp32', {'device': 'cpu'}), ('cpu fp32 chunked', {'device': 'cpu', 'chunk_seconds': 10})]
+    if torch.cuda.is_available():
+        modes += [('cuda fp32', {'device': 'cuda'}), ('cuda fp16', {'device': 'cuda', 'half': True}),
+                  ('cuda fp16 chunked', {'device': 'cuda', 'half': True, 'chunk_seconds': 10})]
+    for name, kwargs in modes:
+        hubert = CustomHubert(checkpoint_path, **kwargs)
+        hubert(wav)  # Warmup
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        start = time.time()
+        for _ in range(repeats):
+            hubert(wav)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        took = (time.time() - start) / repeats
+        vram = f', peak vram {torch.cuda.max_memory_allocated() / 1024 ** 2:.0f}MB' if torch.cuda.is_available() else ''
+        print(f'{name}: {took:.2f}s for {seconds}s of audio ({seconds / took:.1f}x realtime){vram}')
+        del hubert
+
+
+if __name__ == '__main__':
+    from hubert.hubert_manager import HuBERTManager
+    benchmark(HuBERTManager.make_sure_hubert_installed())
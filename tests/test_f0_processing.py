@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from webui.modules.implementations.rvc import f0_processing
+from webui.modules.implementations.rvc.f0_processing import interpolate_f0, resize_f0, round_f0, pad_f0, f0_to_coarse
+
+# Without gaps between voiced frames interpolate_f0 matches the previous implementation. Inside gaps that one reached the
+# next voiced value a frame early (and a voiced last frame was overwritten), so gaps are tested against exact values.
+same_as_previous = {
+    'empty': np.zeros(0),
+    'all unvoiced': np.zeros(10),
+    'all voiced': np.linspace(100, 200, 10),
+    'single voiced frame': np.array([0, 0, 150., 0, 0]),
+    'leading and trailing zeros': np.array([0, 0, 100., 120, 0, 0]),
+    'negative': np.array([-1, -5, 130., 0]),
+    'length 1 unvoiced': np.zeros(1),
+    'length 1 voiced': np.array([220.]),
+}
+
+
+@pytest.mark.parametrize('f0', same_as_previous.values(), ids=same_as_previous.keys())
+def test_interpolate_f0_matches_previous(f0):
+    original = f0.copy()
+    result, uv = interpolate_f0(f0)
+    expected, expected_uv = f0_processing._interpolate_f0_loop(f0.copy())
+    assert np.array_equal(f0, original), 'The input was modified'
+    assert np.allclose(result, expected)
+    assert np.array_equal(uv, expected_uv)
+
+
+gaps = {
+    'gap': (np.array([0, 100., 0, 0, 200., 0]), [100, 100, 400 / 3, 500 / 3, 200, 200]),
+    'gap before the last frame': (np.array([100., 0, 0, 200.]), [100, 400 / 3, 500 / 3, 200]),
+    'long gap': (np.concatenate([[100.], np.zeros(4999), [600.]]), np.linspace(100, 600, 5001)),
+}
+
+
+@pytest.mark.parametrize('f0, expected', gaps.values(), ids=gaps.keys())
+def test_interpolate_f0_gaps(f0, expected):
+    result, uv = interpolate_f0(f0)
+    assert np.allclose(result, expected)
+    assert np.array_equal(uv, f0 > 0)
+
+
+def test_interpolate_f0_all_unvoiced_stays_zero():
+    result, uv = interpolate_f0(np.zeros(7, dtype=np.float32))
+    assert result.dtype == np.float32
+    assert not result.any() and not uv.any()
+
+
+def test_interpolate_f0_single_voiced_frame_fills_everything():
+    result, uv = interpolate_f0(np.array([0, 0, 150., 0]))
+    assert np.array_equal(result, [150] * 4)
+    assert np.array_equal(uv, [0, 0, 1, 0])
+
+
+def test_resize_f0():
+    assert np.array_equal(resize_f0(np.zeros(0), 0), np.zeros(0))
+    assert np.array_equal(resize_f0(np.zeros(0), 3), np.zeros(3))
+    resized = resize_f0(np.array([100., 100, 0, 0]), 8)
+    assert np.allclose(resized[:3], 100) and np.all(resized[3:] == 0)
+
+
+def test_resize_f0_all_unvoiced():
+    assert np.array_equal(resize_f0(np.zeros(5), 9), np.zeros(9))
+
+
+@pytest.mark.parametrize('value', [0., 150.])
+def test_resize_f0_length_1(value):
+    assert np.array_equal(resize_f0(np.array([value]), 4), [value] * 4)
+
+
+def test_f0_to_coarse():
+    assert np.array_equal(f0_to_coarse(np.array([0., f0_processing.f0_min, f0_processing.f0_max, 5000])), [1, 1, 255, 255])
+    assert np.array_equal(f0_to_coarse(np.zeros(3)), [1, 1, 1])
+    assert np.array_equal(f0_to_coarse(np.array([f0_processing.f0_max])), [255])
+
+
+def test_pad_f0():
+    assert np.array_equal(pad_f0(np.ones(5), 8), [0, 0, 1, 1, 1, 1, 1, 0])
+    assert np.array_equal(pad_f0(np.ones(1), 2), [0, 1])
+    assert np.array_equal(pad_f0(np.ones(3), 3), [1, 1, 1])
+
+
+def test_round_f0():
+    assert np.array_equal(round_f0(np.array([100.04, 100.06])), [100., 100.1])
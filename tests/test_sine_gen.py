@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from webui.modules.implementations.rvc.infer_pack import models
+
+
+def _sine_reference(gen, f0, upp):
+    """The previous SineGen.forward, upsamples before accumulating the phase."""
+    f0 = f0[:, None].transpose(1, 2)
+    f0_buf = torch.zeros(f0.shape[0], f0.shape[1], gen.dim, device=f0.device)
+    f0_buf[:, :, 0] = f0[:, :, 0]
+    for idx in np.arange(gen.harmonic_num):
+        f0_buf[:, :, idx + 1] = f0_buf[:, :, 0] * (idx + 2)
+    rad_values = (f0_buf / gen.sampling_rate) % 1
+    rand_ini = torch.rand(f0_buf.shape[0], f0_buf.shape[2], device=f0_buf.device)
+    rand_ini[:, 0] = 0
+    rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
+    tmp_over_one = torch.cumsum(rad_values, 1)
+    tmp_over_one *= upp
+    tmp_over_one = F.interpolate(tmp_over_one.transpose(2, 1), scale_factor=upp, mode="linear",
+                                 align_corners=True).transpose(2, 1)
+    rad_values = F.interpolate(rad_values.transpose(2, 1), scale_factor=upp, mode="nearest").transpose(2, 1)
+    tmp_over_one %= 1
+    tmp_over_one_idx = (tmp_over_one[:, 1:, :] - tmp_over_one[:, :-1, :]) < 0
+    cumsum_shift = torch.zeros_like(rad_values)
+    cumsum_shift[:, 1:, :] = tmp_over_one_idx * -1.0
+    sine_waves = torch.sin(torch.cumsum(rad_values + cumsum_shift, dim=1) * 2 * np.pi)
+    sine_waves = sine_waves * gen.sine_amp
+    uv = gen._f02uv(f0)
+    uv = F.interpolate(uv.transpose(2, 1), scale_factor=upp, mode="nearest").transpose(2, 1)
+    noise_amp = uv * gen.noise_std + (1 - uv) * gen.sine_amp / 3
+    noise = noise_amp * torch.randn_like(sine_waves)
+    sine_waves = sine_waves * uv + noise
+    return sine_waves, uv, noise
+
+
+@pytest.mark.parametrize('harmonic_num, sr, upp', [(0, 40000, 400), (2, 40000, 400), (2, 48000, 480), (1, 32000, 320)])
+def test_sine_gen_matches_previous(harmonic_num, sr, upp):
+    """SineGen against the previous implementation on a random f0 curve with unvoiced parts, with the same seed."""
+    gen = models.SineGen(sr, harmonic_num)
+    frames = 2 * sr // upp
+    torch.manual_seed(1)
+    f0 = torch.rand(2, frames) * 300 + 80
+    f0[:, frames // 4: frames // 3] = 0
+    with torch.no_grad():
+        torch.manual_seed(0)
+        expected = _sine_reference(gen, f0, upp)
+        torch.manual_seed(0)
+        result = gen(f0, upp)
+    for a, b in zip(expected, result):
+        assert a.shape == b.shape
+    difference = (expected[0] - result[0]).abs().max().item()
+    assert difference < 1e-3, f'SineGen differs from the previous implementation by {difference}'
+    assert torch.equal(expected[1], result[1])
@@ -13,6 +13,29 @@ parser.add_argument('--bark-low-vram', action='store_true', help='Use low vram m
 parser.add_argument('--bark-cpu-offload', action='store_true', help='Use cpu offloading for lower vram usage on bark')
 parser.add_argument('--bark-use-cpu', action='store_true', help='Use cpu on bark')
 parser.add_argument('--bark-cloning-large-model', action='store_true', help='Use the larger voice cloning model for bark')
+parser.add_argument('--bark-cloning-int8', action='store_true', help='Use an int8 quantized voice cloning tokenizer when running on cpu')
+parser.add_argument('--bark-precision', type=str, choices=['fp32', 'bf16', 'int8'], default='fp32', help='Precision of the bark gpt models, int8 only works on cpu')
+parser.add_argument('--bark-codec-precision', type=str, choices=['fp32', 'bf16', 'fp16'], default='fp32', help='Precision of the bark Encodec decoder, fp16 only works on gpu')
+
+# AudioLDM
+parser.add_argument('--audioldm-low-mem', action='store_true', help='Load CLAP only when ranking, offload AudioLDM submodules between uses on gpu')
+parser.add_argument('--audioldm-bf16', action='store_true', help='Run AudioLDM in bfloat16, for lower memory usage on cpu')
+
+# RVC
+parser.add_argument('--rvc-graph', type=str, choices=['none', 'torchscript', 'compile'], default='none', help='Run the rvc decoder as a TorchScript graph cached per model, or with torch.compile')
+parser.add_argument('--rvc-crepe-batch-size', type=int, default=512, help='Frames per crepe forward pass')
+parser.add_argument('--rvc-crepe-threads', type=int, default=0, help='Cpu threads for crepe, 0 keeps the default. Applies to the whole process while crepe runs')
+parser.add_argument('--rvc-crepe-decoder', type=str, choices=['viterbi', 'weighted argmax', 'argmax'], default='viterbi', help='How crepe picks the pitch from its probabilities')
+
+# Separation
+parser.add_argument('--separation-backend', type=str, choices=['demucs', 'repet'], default='demucs', help='Separate vocals with demucs, or with the much cheaper and rougher REPET-SIM')
+parser.add_argument('--separation-segment', type=float, default=0, help='Demucs segment length in seconds, 0 uses the model default')
+parser.add_argument('--separation-overlap', type=float, default=0.25, help='Overlap between demucs segments')
+parser.add_argument('--separation-shifts', type=int, default=1, help='Random shifts averaged by demucs, more is better and slower')
+parser.add_argument('--separation-cache-size', type=float, default=2048, help='Size of the separated stems cache in MB, 0 disables it')
+
+# Denoise
+parser.add_argument('--denoise-method', type=str, choices=['noisereduce', 'noisereduce stationary', 'dns48', 'dns64', 'master64'], default='noisereduce', help='Default denoiser, noisereduce or a facebookresearch/denoiser model')
 
 # TTS
 parser.add_argument('--tts-use-cpu', action='store_true', help='Use cpu for tts instead of gpu')
@@ -24,6 +47,7 @@ parser.add_argument('-p', '--password', '--pass', type=str, help='Gradio passwor
 parser.add_argument('--theme', type=str, help='Gradio theme', default='gradio/soft')
 parser.add_argument('-l', '--listen', action='store_true', help='Listen on 0.0.0.0')
 parser.add_argument('--port', type=int, help='Use a different port, automatic when not set.', default=None)
+parser.add_argument('--metrics', action='store_true', help='Serve Prometheus metrics at /metrics')
 
 args = parser.parse_args()
 
@@ -0,0 +1,136 @@
+import math
+from functools import lru_cache
+
+import numpy as np
+import torch
+import torchaudio
+
+max_channels = 8  # Any axis longer than this is treated as the time axis
+
+
+def to_tensor(audio) -> torch.Tensor:
+    """Wraps numpy arrays without copying, tensors are returned as is."""
+    if torch.is_tensor(audio):
+        return audio
+    return torch.from_numpy(np.ascontiguousarray(audio))
+
+
+def normalize_dtype(audio: torch.Tensor) -> torch.Tensor:
+    """Converts integer pcm to float32 in the -1..1 range, float input is only cast to float32."""
+    if audio.dtype == torch.int16:
+        return audio.float() / 32767.0
+    if audio.dtype == torch.int32:
+        return audio.float() / 2147483647.0
+    if audio.dtype == torch.uint8:
+        return (audio.float() - 128) / 128.0
+    if audio.dtype == torch.float32:
+        return audio
+    return audio.float()
+
+
+def downmix(audio: torch.Tensor) -> torch.Tensor:
+    """
+    Averages channels into a 1d signal. Works with both (channels, samples) and (samples, channels) layouts.
+    Mono input, including (1, samples) and (samples, 1), is only flattened, never averaged.
+    """
+    audio = audio.squeeze()
+    if audio.dim() <= 1:
+        return audio.reshape(-1)
+    if audio.dim() == 2:
+        channel_dim = 0 if audio.shape[0] <= audio.shape[1] else 1
+        if audio.shape[channel_dim] <= max_channels:
+            return audio.mean(channel_dim)
+    return audio.flatten()
+
+
+@lru_cache
+def get_resampler(orig_sr: int, target_sr: int) -> torchaudio.transforms.Resample:
+    """One resampling kernel per sample rate pair, built once and kept on the cpu."""
+    return torchaudio.transforms.Resample(orig_sr, target_sr)
+
+
+def resample(audio: torch.Tensor, orig_sr: int, target_sr: int) -> torch.Tensor:
+    if orig_sr == target_sr:
+        return audio
+    with torch.no_grad():
+        return get_resampler(int(orig_sr), int(target_sr))(audio)
+
+
+def ingest(audio, sr: int, target_sr: int | None = None) -> tuple[int, torch.Tensor]:
+    """
+    Turns any audio input (gradio tuples, numpy arrays, tensors in any int/float dtype, mono or multichannel)
+    into a 1d float32 cpu tensor, resampled to target_sr if given.
+    :return: (sr, audio)
+    """
+    audio = to_tensor(audio).detach()
+    if audio.device.type != 'cpu':
+        audio = audio.cpu()
+    audio = downmix(normalize_dtype(audio))
+    if target_sr is not None:
+        audio = resample(audio, sr, target_sr)
+        sr = target_sr
+    return sr, audio
+
+
+def ingest_numpy(audio, sr: int, target_sr: int | None = None) -> tuple[int, np.ndarray]:
+    """Same as ingest, but returns a numpy array sharing memory with the tensor."""
+    sr, audio = ingest(audio, sr, target_sr)
+    return sr, audio.numpy()
+
+
+class PolyphaseResampler:
+    """
+    Rational-ratio polyphase resampler which keeps its filter history between calls, so audio can be fed in chunks.
+    Feeding a signal in one call or in many chunks gives the same output.
+    """
+
+    def __init__(self, orig_sr, target_sr=16000, zero_crossings=16, beta=8.0):
+        g = math.gcd(int(orig_sr), int(target_sr))
+        self.orig_sr = int(orig_sr)
+        self.target_sr = int(target_sr)
+        self.up = self.target_sr // g
+        self.down = self.orig_sr // g
+        # Windowed sinc lowpass at the lower of the two nyquist frequencies, designed at the upsampled rate.
+        factor = max(self.up, self.down)
+        half_len = zero_crossings * factor
+        t = np.arange(-half_len, half_len + 1)
+        h = np.sinc(t / factor) * np.kaiser(len(t), beta) * (self.up / factor)
+        self.taps = int(math.ceil(len(h) / self.up))
+        h = np.pad(h, (0, self.taps * self.up - len(h)))
+        # bank[phase, j] = h[phase + j * up], reversed so it can be applied to a forward slice of the input.
+        self.bank = h.reshape(self.taps, self.up).T[:, ::-1].astype(np.float32)
+        self.delay = half_len  # Group delay at the upsampled rate.
+        self.reset()
+
+    def reset(self):
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.consumed = 0  # Absolute index of the first sample after history.
+        self.produced = 0  # Absolute index of the next output sample.
+
+    def process(self, chunk, final=False):
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        total = self.consumed + len(chunk)
+        if final:
+            # Pad with silence so the filter tail of the last real samples is flushed out.
+            chunk = np.concatenate([chunk, np.zeros(self.delay // self.up + self.taps + 1, dtype=np.float32)])
+        x = np.concatenate([self.history, chunk])
+        start = self.consumed - len(self.history)  # Absolute index of x[0]
+        end = self.consumed + len(chunk)
+        if final:
+            n_end = -(-total * self.up // self.down)
+        else:
+            # Output n needs input up to index (n * down + delay) // up
+            n_end = -(-(end * self.up - self.delay) // self.down)
+        n = np.arange(self.produced, max(self.produced, n_end))
+        out = np.zeros(0, dtype=np.float32)
+        if len(n):
+            m = n * self.down + self.delay
+            last = m // self.up - start  # Index in x of the newest input sample for each output
+            windows = np.lib.stride_tricks.sliding_window_view(x, self.taps)
+            out = np.einsum('ij,ij->i', windows[last - self.taps + 1], self.bank[m % self.up])
+        self.produced += len(n)
+        self.consumed = end
+        self.history = x[len(x) - (self.taps - 1):]
+        if final:
+            self.reset()
+        return out.astype(np.float32)
@@ -1,36 +1,71 @@
 import gc
 import os.path
+import time
+from collections import OrderedDict
 
 import diffusers
 import torch.cuda
+import torch.nn.functional as F
 import transformers
 
+from webui.args import args
+
 model: diffusers.AudioLDMPipeline = None
 loaded = False
 clap_model: transformers.ClapModel = None
 processor: transformers.ClapProcessor = None
 device: str = None
+model_name: str = None
+clap_model_name = 'sanchit-gandhi/clap-htsat-unfused-m-full'
+low_memory = False
+
+embedding_cache_size = 256
+embedding_cache: OrderedDict[tuple[str, str], torch.Tensor] = OrderedDict()
 
 
-def create_model(pretrained='cvssp/audioldm-m-full', map_device='cuda' if torch.cuda.is_available() else 'cpu'):
+def create_model(pretrained='cvssp/audioldm-m-full', map_device='cuda' if torch.cuda.is_available() else 'cpu',
+                 low_mem: bool = None, bf16: bool = None):
+    """
+    :param low_mem: Load CLAP only once ranking is needed, and on cuda, keep the pipeline's submodules on the cpu until they're used.
+    :param bf16: Load the pipeline in bfloat16, useful on cpu.
+    """
     if is_loaded():
         delete_model()
-    global model, loaded, clap_model, processor, device
+    global model, loaded, clap_model, processor, device, model_name, low_memory
+    low_mem = args.audioldm_low_mem if low_mem is None else low_mem
+    bf16 = args.audioldm_bf16 if bf16 is None else bf16
     try:
         cache_dir = os.path.join('data', 'models', 'audioldm')
-        model = diffusers.AudioLDMPipeline.from_pretrained(pretrained, cache_dir=cache_dir).to(map_device)
-        clap_model = transformers.ClapModel.from_pretrained("sanchit-gandhi/clap-htsat-unfused-m-full", cache_dir=cache_dir).to(map_device)
-        processor = transformers.AutoProcessor.from_pretrained("sanchit-gandhi/clap-htsat-unfused-m-full", cache_dir=cache_dir)
+        model = diffusers.AudioLDMPipeline.from_pretrained(pretrained, cache_dir=cache_dir,
+                                                          torch_dtype=torch.bfloat16 if bf16 else torch.float32)
+        if low_mem and map_device.startswith('cuda'):
+            model.enable_model_cpu_offload()  # Moves text encoder, unet, vae and vocoder to the gpu one at a time
+        else:
+            model = model.to(map_device)
         device = map_device
+        model_name = pretrained
+        low_memory = low_mem
+        clap_model = processor = None
+        if not low_mem:
+            load_clap()
         loaded = True
     except:
         pass
 
 
+def load_clap():
+    global clap_model, processor
+    if clap_model is None:
+        cache_dir = os.path.join('data', 'models', 'audioldm')
+        clap_model = transformers.ClapModel.from_pretrained(clap_model_name, cache_dir=cache_dir).to(device)
+        processor = transformers.AutoProcessor.from_pretrained(clap_model_name, cache_dir=cache_dir)
+
+
 def delete_model():
     global model, loaded, clap_model, processor, device
     try:
         del model, clap_model, processor
+        embedding_cache.clear()
         gc.collect()
         torch.cuda.empty_cache()
         loaded = False
@@ -43,31 +78,118 @@ def is_loaded():
     return loaded
 
 
+def _cached_embedding(name, text, encode):
+    """LRU cache for text embeddings, keyed on (model name, text)."""
+    key = (name, text)
+    if key in embedding_cache:
+        embedding_cache.move_to_end(key)
+        return embedding_cache[key]
+    with torch.no_grad():
+        embedding = encode(text).detach()
+    embedding_cache[key] = embedding
+    if len(embedding_cache) > embedding_cache_size:
+        embedding_cache.popitem(last=False)
+    return embedding
+
+
+def _encode_pipeline_prompt(text):
+    # Same as AudioLDMPipeline._encode_prompt for a single prompt
+    inputs = model.tokenizer(text, padding='max_length', max_length=model.tokenizer.model_max_length,
+                             truncation=True, return_tensors='pt')
+    embeds = model.text_encoder(inputs.input_ids.to(device), attention_mask=inputs.attention_mask.to(device)).text_embeds
+    return F.normalize(embeds, dim=-1)
+
+
+def _encode_clap_text(text):
+    inputs = processor.tokenizer(text, padding=True, return_tensors='pt')
+    return F.normalize(clap_model.get_text_features(**{key: inputs[key].to(device) for key in inputs}), dim=-1)
+
+
+def prompt_embeds(prompts: list[str]):
+    return torch.cat([_cached_embedding(model_name, prompt, _encode_pipeline_prompt) for prompt in prompts])
+
+
 def score_waveforms(text, waveforms):
-    inputs = processor(text=text, audios=list(waveforms), return_tensors="pt", padding=True)
+    load_clap()
+    inputs = processor(audios=list(waveforms), return_tensors="pt", padding=True)
     inputs = {key: inputs[key].to(device) for key in inputs}
+    text_embeds = _cached_embedding(clap_model_name, text, _encode_clap_text)
     with torch.no_grad():
-        logits_per_text = clap_model(**inputs).logits_per_text  # this is the audio-text similarity score
-        probs = logits_per_text.softmax(dim=-1)  # we can take the softmax to get the label probabilities
-        most_probable = torch.argmax(probs)  # and now select the most likely audio waveform
+        audio_embeds = F.normalize(clap_model.get_audio_features(**inputs), dim=-1)
+        similarity = text_embeds @ audio_embeds.T  # Same ranking as logits_per_text, without the scale and softmax
+        most_probable = torch.argmax(similarity)  # and now select the most likely audio waveform
     waveform = waveforms[most_probable]
     return waveform
 
 
-def generate(prompt='', negative_prompt='', steps=10, duration=5.0, cfg=2.5, seed=-1, wav_best_count=1):
-    if is_loaded():
+def reset_memory_stats():
+    """Starts a new gpu peak for memory_stats, the rss peak can't be reset."""
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+
+
+def memory_stats():
+    """
+    Peak memory in MB. peak_vram is the peak since reset_memory_stats, so of a single generation, process_peak_rss is the
+    peak of the whole process so far.
+    """
+    stats = {}
+    try:
+        import resource
+        # ru_maxrss is in KB on linux, bytes on macos
+        stats['process_peak_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if os.uname().sysname == 'Darwin' else 1024)
+    except ImportError:  # Windows
+        pass
+    if torch.cuda.is_available():
+        stats['peak_vram'] = torch.cuda.max_memory_allocated() / 1024 ** 2
+    return stats
+
+
+def _generators(seed, count):
+    # One generator per waveform, so an item's result doesn't depend on what it was batched with.
+    return [torch.Generator(device).manual_seed(seed + i) for i in range(count)]
+
+
+def generate_batch(requests: list[dict]):
+    """
+    Generates multiple requests, requests which share steps, duration, cfg and count are run in a single pipeline call.
+    :param requests: A list of dicts with the keyword arguments of :func:`generate`.
+    :return: A list with a result for each request, in the same order. A result is (seed, (sr, waveform), stats), or an error string.
+    """
+    if not is_loaded():
+        return ['No model loaded! Please load a model first.' for _ in requests]
+    results = [None] * len(requests)
+    groups = {}
+    for i, request in enumerate(requests):
+        request = {'prompt': '', 'negative_prompt': '', 'steps': 10, 'duration': 5.0, 'cfg': 2.5, 'seed': -1,
+                   'wav_best_count': 1} | request
+        request['wav_best_count'] = max(1, int(request['wav_best_count']))
+        request['seed'] = int(request['seed']) if request['seed'] >= 0 else torch.seed() % 2 ** 32
+        key = (int(request['steps']), float(request['duration']), float(request['cfg']), request['wav_best_count'])
+        groups.setdefault(key, []).append((i, request))
+
+    for (steps, duration, cfg, count), items in groups.items():
         try:
-            seed = seed if seed >= 0 else torch.seed()
-            torch.manual_seed(seed)
-            output = model(prompt, negative_prompt=negative_prompt if negative_prompt else None,
+            start = time.time()
+            reset_memory_stats()
+            generators = [g for _, request in items for g in _generators(request['seed'], count)]
+            output = model(prompt_embeds=prompt_embeds([request['prompt'] for _, request in items]),
+                           negative_prompt_embeds=prompt_embeds([request['negative_prompt'] or '' for _, request in items]),
                            audio_length_in_s=duration, num_inference_steps=steps, guidance_scale=cfg,
-                           num_waveforms_per_prompt=wav_best_count)
-            waveforms = output.audios
-            if waveforms.shape[0] > 1:
-                waveform = score_waveforms(prompt, waveforms)
-            else:
-                waveform = waveforms[0]
-            return seed, (16000, waveform)
+                           num_waveforms_per_prompt=count, generator=generators)
+            for j, (i, request) in enumerate(items):
+                waveforms = output.audios[j * count:(j + 1) * count]
+                if waveforms.shape[0] > 1:
+                    waveform = score_waveforms(request['prompt'], waveforms)
+                else:
+                    waveform = waveforms[0]
+                results[i] = request['seed'], (16000, waveform), {'latency': time.time() - start, 'batch_size': len(items)} | memory_stats()
         except Exception as e:
-            return f'An exception occurred: {str(e)}'
-    return 'No model loaded! Please load a model first.'
+            for i, _ in items:
+                results[i] = f'An exception occurred: {str(e)}'
+    return results
+
+
+def generate(prompt='', negative_prompt='', steps=10, duration=5.0, cfg=2.5, seed=-1, wav_best_count=1):
+    return generate_batch([{'prompt': prompt, 'negative_prompt': negative_prompt, 'steps': steps, 'duration': duration,
+                            'cfg': cfg, 'seed': seed, 'wav_best_count': wav_best_count}])[0]
@@ -0,0 +1,191 @@
+import argparse
+import threading
+import time
+
+import numpy as np
+import torch
+
+from webui.modules.audio_ingest import ingest, resample
+
+noisereduce_methods = ['noisereduce', 'noisereduce stationary']
+dns_methods = ['dns48', 'dns64', 'master64']
+methods = noisereduce_methods + dns_methods
+
+# Settings for the dns models
+block_seconds = 10  # Audio per forward pass, bounds the memory used for long audio
+overlap_seconds = 0.5  # Crossfade between blocks
+batch_size = 4  # Blocks per forward pass, blocks of several files are batched together
+
+_models = {}
+_lock = threading.Lock()
+
+
+def default_device() -> str:
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _resident(key, create, device):
+    with _lock:
+        if key not in _models:
+            _models[key] = create().eval().requires_grad_(False).to(device)
+    return _models[key]
+
+
+def load_model(name: str = 'dns48', device=None):
+    """A denoiser (facebookresearch/denoiser) model, loaded once per name and device and kept in memory."""
+    from denoiser import pretrained
+    device = device or default_device()
+    return _resident((name, str(device)), getattr(pretrained, name), device)
+
+
+def load_model_file(path: str, device=None):
+    """load_model for a denoiser checkpoint file, like the --model_path of denoiser.enhance."""
+    from denoiser import pretrained
+    device = device or default_device()
+    return _resident((path, str(device)), lambda: pretrained.get_model(argparse.Namespace(model_path=path)), device)
+
+
+def _window(length, fade):
+    """Linear fades at both ends, overlapping windows add up to one where they overlap."""
+    window = np.ones(length, dtype=np.float32)
+    if fade:
+        ramp = (np.arange(fade, dtype=np.float32) + 0.5) / fade
+        window[:fade] = ramp
+        window[-fade:] = ramp[::-1]
+    return torch.from_numpy(window)
+
+
+def dns_denoise(audios: list[torch.Tensor], model, dry: float = 0) -> list[torch.Tensor]:
+    """
+    Denoises 1d tensors at the model's sample rate. They are cut in overlapping blocks of block_seconds, the blocks of
+    all of them are run batch_size at a time, and put back together with overlap-add.
+    :param dry: Share of the noisy audio mixed back in.
+    """
+    device = next(model.parameters()).device
+    sr = model.sample_rate
+    block = int(block_seconds * sr)
+    fade = int(overlap_seconds * sr)
+    hop = block - fade
+    window = _window(block, fade)
+    outputs = [torch.zeros(len(audio)) for audio in audios]
+    weights = [torch.zeros(len(audio)) for audio in audios]
+    # (audio index, start) of every block
+    blocks = [(i, start) for i, audio in enumerate(audios) for start in range(0, max(len(audio) - fade, 1), hop)]
+    with torch.inference_mode():
+        for first in range(0, len(blocks), batch_size):
+            batch = blocks[first:first + batch_size]
+            noisy = torch.zeros(len(batch), 1, block)
+            for row, (i, start) in enumerate(batch):
+                chunk = audios[i][start:start + block]
+                noisy[row, 0, :len(chunk)] = chunk
+            estimate = model(noisy.to(device)).float().cpu()[:, 0]
+            estimate = (1 - dry) * estimate + dry * noisy[:, 0]
+            for row, (i, start) in enumerate(batch):
+                length = min(block, len(audios[i]) - start)
+                w = window[:length]  # Dividing by the summed weights undoes the fades at the ends
+                outputs[i][start:start + length] += estimate[row, :length] * w
+                weights[i][start:start + length] += w
+    return [output / weight.clamp_min(1e-6) for output, weight in zip(outputs, weights)]
+
+
+def _noisereduce(sr, audio, method):
+    import noisereduce
+    stationary = method == 'noisereduce stationary'
+    return torch.from_numpy(noisereduce.reduce_noise(y=audio.numpy(), sr=sr, stationary=stationary))
+
+
+def denoise_batch(items: list[tuple[int, torch.Tensor]], method: str = None, device=None,
+                  record: dict = None) -> list[tuple[int, torch.Tensor]]:
+    """
+    Denoises several clips, with noisereduce one by one (it processes long audio in chunks itself), with a dns model in
+    shared batches.
+    :param items: [(sr, audio)], any layout ingest() takes.
+    :param method: One of methods, --denoise-method if not set.
+    :param record: Filled in with the throughput of this call, see describe().
+    :return: [(sr, 1d float32 tensor)], dns models return audio at their sample rate (16 kHz).
+    """
+    if method is None:
+        from webui.args import args
+        method = args.denoise_method
+    assert method in methods, f'Unknown denoise method {method}'
+    start = time.perf_counter()
+    if method in noisereduce_methods:
+        results = []
+        for sr, audio in items:
+            sr, audio = ingest(audio, sr)
+            results.append((sr, _noisereduce(sr, audio, method)))
+    else:
+        model = load_model(method, device)
+        audios = [resample(ingest(audio, sr)[1], sr, model.sample_rate) for sr, audio in items]
+        results = [(model.sample_rate, audio) for audio in dns_denoise(audios, model)]
+    elapsed = time.perf_counter() - start
+    audio_seconds = sum(len(audio) / sr for sr, audio in results)
+    if record is not None:
+        record.update(method=method, files=len(results), audio_seconds=audio_seconds, seconds=elapsed,
+                      realtime=audio_seconds / elapsed if elapsed else 0.)
+    return results
+
+
+def denoise(sr: int, audio, method: str = None, device=None, record: dict = None) -> tuple[int, torch.Tensor]:
+    """denoise_batch for a single clip."""
+    return denoise_batch([(sr, audio)], method, device, record)[0]
+
+
+def describe(record: dict) -> str:
+    if not record:
+        return ''
+    return (f'{record["method"]}: {record["audio_seconds"]:.1f}s of audio in {record["files"]} file(s) took '
+            f'{record["seconds"]:.2f}s, {record["realtime"]:.1f}x realtime')
+
+
+class _Identity(torch.nn.Module):
+    sample_rate = 16000
+
+    def __init__(self):
+        super().__init__()
+        self.scale = torch.nn.Parameter(torch.ones(1))
+
+    def forward(self, x):
+        return x * self.scale
+
+
+def check():
+    """With a model which changes nothing, the blocks add back up to the input, for lengths around the block edges."""
+    model = _Identity()
+    block, hop = int(block_seconds * model.sample_rate), int((block_seconds - overlap_seconds) * model.sample_rate)
+    lengths = [1, 100, block - 1, block, block + 1, hop + block, 3 * hop + 17]
+    audios = [torch.randn(length) for length in lengths]
+    for audio, result in zip(audios, dns_denoise(audios, model)):
+        assert result.shape == audio.shape and torch.allclose(result, audio, atol=1e-5), f'Length {len(audio)} differs'
+
+
+def benchmark(seconds=60, files=4, device='cpu'):
+    """
+    Throughput of every method on noisy tones, as one batch of files.
+    Without the pretrained weights, the dns models are timed with random weights.
+    :return: {method: x realtime}
+    """
+    from denoiser.demucs import Demucs
+    sr = 16000
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * sr) / sr
+    items = [(sr, torch.from_numpy((0.3 * np.sin(2 * np.pi * 220 * (i + 1) * t) + 0.05 * rng.standard_normal(len(t)))
+                                   .astype(np.float32))) for i in range(files)]
+    hidden = {'dns48': 48, 'dns64': 64, 'master64': 64}
+    results = {}
+    for method in methods:
+        if method in dns_methods:
+            try:
+                load_model(method, device)
+            except Exception:  # No network or no cached weights
+                _models[(method, str(device))] = Demucs(hidden=hidden[method], sample_rate=sr).eval().to(device)
+        record = {}
+        denoise_batch(items, method, device, record)
+        results[method] = record['realtime']
+    return results
+
+
+if __name__ == '__main__':
+    check()
+    for _method, _realtime in benchmark().items():
+        print(f'{_method}: {_realtime:.1f}x realtime')
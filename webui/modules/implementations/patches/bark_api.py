@@ -1,5 +1,6 @@
 from bark.api import *
 from .bark_generation import generate_text_semantic_new, generate_coarse_new, generate_fine_new, codec_decode_new
+from . import bark_precision, bark_profiler, bark_token_cache
 
 
 def text_to_semantic_new(
@@ -7,7 +8,10 @@ def text_to_semantic_new(
     history_prompt: Union[str, dict] = None,
     temp: float = 0.7,
     silent: bool = False,
-    allow_early_stop: bool = True
+    allow_early_stop: bool = True,
+    seed: int = None,
+    use_cache: bool = False,
+    sampling: dict = None
 ):
     """Generate semantic array from text.
 
@@ -17,19 +21,30 @@ def text_to_semantic_new(
         temp: generation temperature (1.0 more diverse, 0.0 more conservative)
         silent: disable progress bar
         allow_early_stop: (Added in new) set to False to generate until the limit
+        seed: (Added in new) seed for sampling
+        use_cache: (Added in new) reuse semantic tokens from an earlier call with the same text, prompt, temp and seed
+        sampling: (Added in new) extra sampling options, any of top_k, top_p, typical_p and min_p
 
     Returns:
         numpy semantic array to be fed into `semantic_to_waveform`
     """
-    x_semantic = generate_text_semantic_new(
-        text,
-        history_prompt=history_prompt,
-        temp=temp,
-        silent=silent,
-        use_kv_caching=True,
-        allow_early_stop=allow_early_stop
-    )
-    return x_semantic
+    def generate():
+        return generate_text_semantic_new(
+            text,
+            history_prompt=history_prompt,
+            temp=temp,
+            silent=silent,
+            use_kv_caching=True,
+            allow_early_stop=allow_early_stop,
+            seed=seed,
+            **(sampling or {})
+        )
+    if use_cache:
+        return bark_token_cache.cached('semantic', text, history_prompt, generate,
+                                       temp=temp, seed=seed, allow_early_stop=allow_early_stop,
+                                       precision=bark_precision.precision, model=bark_token_cache.model_size('text'),
+                                       **(sampling or {}))
+    return generate()
 
 
 def semantic_to_waveform_new(
@@ -39,7 +54,10 @@ def semantic_to_waveform_new(
     silent: bool = False,
     output_full: bool = False,
     skip_fine: bool = False,
-    decode_on_cpu: bool = False
+    decode_on_cpu: bool = False,
+    seed: int = None,
+    use_cache: bool = False,
+    sampling: dict = None
 ):
     """Generate audio array from semantic input.
 
@@ -51,22 +69,35 @@ def semantic_to_waveform_new(
         output_full: return full generation to be used as a history prompt
         skip_fine: (Added in new) Skip converting coarse to fine
         decode_on_cpu: (Added in new) Move everything to cpu when decoding, useful for decoding huge audio files on medium vram
+        seed: (Added in new) seed for coarse and fine sampling, every stage uses its own generator
+        use_cache: (Added in new) reuse coarse tokens from an earlier call with the same semantics, prompt, temp and seed
+        sampling: (Added in new) extra sampling options for the coarse stage, any of top_k, top_p, typical_p and min_p
 
     Returns:
         numpy audio array at sample frequency 24khz
     """
-    coarse_tokens = generate_coarse_new(
-        semantic_tokens,
-        history_prompt=history_prompt,
-        temp=temp,
-        silent=silent,
-        use_kv_caching=True
-    )
+    def generate():
+        return generate_coarse_new(
+            semantic_tokens,
+            history_prompt=history_prompt,
+            temp=temp,
+            silent=silent,
+            use_kv_caching=True,
+            seed=seed,
+            **(sampling or {})
+        )
+    if use_cache:
+        coarse_tokens = bark_token_cache.cached('coarse', semantic_tokens, history_prompt, generate, temp=temp, seed=seed,
+                                                precision=bark_precision.precision,
+                                                model=bark_token_cache.model_size('coarse'), **(sampling or {}))
+    else:
+        coarse_tokens = generate()
     if not skip_fine:
         fine_tokens = generate_fine_new(
             coarse_tokens,
             history_prompt=history_prompt,
             temp=0.5,
+            seed=seed
         )
     else:
         fine_tokens = coarse_tokens
@@ -90,7 +121,11 @@ def generate_audio_new(
     output_full: bool = False,
     skip_fine: bool = False,
     decode_on_cpu: bool = False,
-    allow_early_stop: bool = True
+    allow_early_stop: bool = True,
+    seed: int = None,
+    use_cache: bool = False,
+    sampling: dict = None,
+    return_metrics: bool = False
 ):
     """Generate audio array from input text.
 
@@ -104,16 +139,33 @@ def generate_audio_new(
         skip_fine: (Added in new) Skip converting from coarse to fine
         decode_on_cpu: (Added in new) Decode on cpu
         allow_early_stop: (Added in new) Set to false to continue until the limit is reached
+        seed: (Added in new) seed for sampling
+        use_cache: (Added in new) reuse semantic and coarse tokens from earlier calls with the same inputs
+        sampling: (Added in new) extra sampling options for the semantic and coarse stages, any of top_k, top_p, typical_p and min_p
+        return_metrics: (Added in new) also return a list with the timings, token counts and peak memory of every stage
 
     Returns:
-        numpy audio array at sample frequency 24khz
+        numpy audio array at sample frequency 24khz, followed by the metrics if return_metrics is set
     """
+    with bark_profiler.collect() as metrics:
+        out = _generate_audio(text, history_prompt, text_temp, waveform_temp, silent, output_full, skip_fine,
+                              decode_on_cpu, allow_early_stop, seed, use_cache, sampling)
+    if return_metrics:
+        return (*out, metrics) if output_full else (out, metrics)
+    return out
+
+
+def _generate_audio(text, history_prompt, text_temp, waveform_temp, silent, output_full, skip_fine, decode_on_cpu,
+                    allow_early_stop, seed, use_cache, sampling):
     semantic_tokens = text_to_semantic_new(
         text,
         history_prompt=history_prompt,
         temp=text_temp,
         silent=silent,
-        allow_early_stop=allow_early_stop
+        allow_early_stop=allow_early_stop,
+        seed=seed,
+        use_cache=use_cache,
+        sampling=sampling
     )
     out = semantic_to_waveform_new(
         semantic_tokens,
@@ -122,7 +174,10 @@ def generate_audio_new(
         silent=silent,
         output_full=output_full,
         skip_fine=skip_fine,
-        decode_on_cpu=decode_on_cpu
+        decode_on_cpu=decode_on_cpu,
+        seed=seed,
+        use_cache=use_cache,
+        sampling=sampling
     )
     if output_full:
         full_generation, audio_arr = out
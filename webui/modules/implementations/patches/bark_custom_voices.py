@@ -1,4 +1,9 @@
+import hashlib
 import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import torch
 import torchaudio
 from bark.generation import SAMPLE_RATE, load_codec_model
@@ -30,33 +35,100 @@ def load_hubert():
     hubert_path = HuBERTManager.make_sure_hubert_installed()
     model = ('quantifier_V1_hubert_base_ls960_23.pth', 'tokenizer_large.pth') if args.bark_cloning_large_model else ('quantifier_hubert_base_ls960_14.pth', 'tokenizer.pth')
     tokenizer_path = HuBERTManager.make_sure_tokenizer_installed(model=model[0], local_file=model[1])
+    device = 'cuda' if torch.cuda.is_available() and not args.bark_use_cpu else 'cpu'
     if 'hubert' not in huberts:
         print('Loading HuBERT')
-        huberts['hubert'] = CustomHubert(hubert_path)
+        huberts['hubert'] = CustomHubert(hubert_path, device=device, half=device == 'cuda', chunk_seconds=30)
     if 'tokenizer' not in huberts:
         print('Loading Custom Tokenizer')
-        tokenizer = CustomTokenizer.load_from_checkpoint(tokenizer_path, map_location=torch.device('cpu'))
-        huberts['tokenizer'] = tokenizer
+        tokenizer = CustomTokenizer.load_from_checkpoint(tokenizer_path, map_location=torch.device(device))
+        if args.bark_cloning_int8 and device == 'cpu':
+            tokenizer = tokenizer.quantized()
+        huberts['tokenizer'] = tokenizer.to(device)
 
 
-def wav_to_semantics(file) -> torch.Tensor:
-    # Vocab size is 10,000.
+hubert_cache_dir = os.path.join('data', 'cache', 'hubert')
+hubert_cache_size = 1024 * 1024 ** 2  # Bytes, least recently used features are removed past this size
+
+_hubert_cache_lock = threading.Lock()
+
+
+def load_wav(file) -> tuple[torch.Tensor, int]:
+    """Decodes a file, or passes through an already decoded (wav, sr) tuple."""
+    if isinstance(file, tuple):
+        return file
+    return torchaudio.load(file)
 
-    load_hubert()
 
-    wav, sr = torchaudio.load(file)
-    # sr, wav = wavfile.read(file)
-    # wav = torch.tensor(wav, dtype=torch.float32)
+def audio_hash(wav: torch.Tensor, sr: int) -> str:
+    h = hashlib.sha1(wav.contiguous().numpy().tobytes())
+    h.update(str(sr).encode())
+    return h.hexdigest()
 
+
+def hubert_features(wav: torch.Tensor, sr: int) -> torch.Tensor:
+    """
+    HuBERT features for a waveform, cached on disk by audio hash and the settings which change the features: output layer,
+    dtype (float16 on cuda) and chunk size.
+    """
+    load_hubert()
     if wav.shape[0] == 2:  # Stereo to mono if needed
         wav = wav.mean(0, keepdim=True)
+    hubert = huberts['hubert']
+    dtype = str(hubert.dtype).replace('torch.', '')
+    cache_file = os.path.join(hubert_cache_dir,
+                              f'{audio_hash(wav, sr)}_{hubert.output_layer}_{dtype}_{hubert.chunk_seconds}.npy')
+    try:
+        features = np.load(cache_file)
+        os.utime(cache_file)  # Mark as recently used
+        return torch.from_numpy(features).to(hubert.device)
+    except (OSError, ValueError):
+        pass
+    print('Extracting semantics')
+    features = hubert.forward(wav, input_sample_hz=sr)
+    save_hubert_features(cache_file, features.cpu().numpy())
+    return features
+
+
+def save_hubert_features(cache_file: str, features: np.ndarray):
+    """Writes through a temporary file so readers never see a partial file, then evicts past hubert_cache_size."""
+    os.makedirs(hubert_cache_dir, exist_ok=True)
+    temporary = cache_file + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'wb') as f:
+        np.save(f, features)
+    os.replace(temporary, cache_file)
+    with _hubert_cache_lock:
+        entries = []
+        for entry in os.scandir(hubert_cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= hubert_cache_size:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def wav_to_semantics(file) -> torch.Tensor:
+    # Vocab size is 10,000.
+
+    load_hubert()
+
+    wav, sr = load_wav(file)
 
     # Extract semantics in HuBERT style
-    print('Extracting semantics')
-    semantics = huberts['hubert'].forward(wav, input_sample_hz=sr)
+    semantics = hubert_features(wav, sr)
     print('Tokenizing semantics')
     tokens = huberts['tokenizer'].get_token(semantics)
-    return tokens
+    return tokens.cpu()
 
 
 def eval_semantics(code):
@@ -76,7 +148,7 @@ def generate_course_history(fine_history):
 
 def generate_fine_from_wav(file):
     model = load_codec_model(use_gpu=not args.bark_use_cpu)  # Don't worry about reimporting, it stores the loaded model in a dict
-    wav, sr = torchaudio.load(file)
+    wav, sr = load_wav(file)
     wav = convert_audio(wav, sr, SAMPLE_RATE, model.channels)
     wav = wav.unsqueeze(0)
     if not (args.bark_cpu_offload or args.bark_use_cpu):
@@ -89,3 +161,43 @@ def generate_fine_from_wav(file):
 
     return codes
 
+
+
+def clone_voice(file) -> dict:
+    """
+    Creates a speaker prompt from a reference file. The file is decoded once, and HuBERT and Encodec run concurrently on it.
+    :return: A dict with semantic_prompt, fine_prompt and coarse_prompt.
+    """
+    load_hubert()
+    load_codec_model(use_gpu=not args.bark_use_cpu)
+    wav, sr = load_wav(file)
+    with ThreadPoolExecutor(2) as pool:
+        semantic = pool.submit(wav_to_semantics, (wav, sr))
+        fine = pool.submit(generate_fine_from_wav, (wav, sr))
+        semantic_prompt = semantic.result().cpu().numpy()
+        fine_prompt = fine.result()
+    return {
+        'semantic_prompt': semantic_prompt,
+        'fine_prompt': fine_prompt,
+        'coarse_prompt': generate_course_history(fine_prompt)
+    }
+
+
+def clone_voices(files) -> list[str]:
+    """
+    Bulk version of clone_voice, adds every speaker to the speaker library. The next file is decoded while the current one is cloned.
+    :return: The names of the created speakers.
+    """
+    from webui.modules.implementations.patches.bark_speaker_library import library
+    names = []
+    with ThreadPoolExecutor(1) as decoder:
+        pending = decoder.submit(load_wav, files[0]) if files else None
+        for i, file in enumerate(files):
+            wav = pending.result()
+            if i + 1 < len(files):
+                pending = decoder.submit(load_wav, files[i + 1])
+            name = os.path.splitext(os.path.basename(file))[0]
+            print(f'Cloning {name} ({i + 1}/{len(files)})')
+            library.add(name, clone_voice(wav), source=os.path.basename(file))
+            names.append(name)
+    return names
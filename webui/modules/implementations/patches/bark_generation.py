@@ -3,6 +3,9 @@ from typing import Union
 import bark.generation as o
 from bark.generation import *
 
+from . import bark_precision, bark_profiler
+from .bark_sampling import sample
+
 SUPPORTED_LANGS = [
     ("English", "en"),
     ("German", "de"),
@@ -28,51 +31,66 @@ for n in range(10):
     ALLOWED_PROMPTS.append(f"speaker_{n}")
 
 
+def load_history_prompt(history_prompt: Union[str, dict]):
+    """
+    Resolves a history prompt to a dict-like with semantic_prompt, coarse_prompt and fine_prompt.
+    :return: None if the prompt can't be found.
+    """
+    if isinstance(history_prompt, dict):
+        return history_prompt
+    if history_prompt.endswith(".npz"):
+        return np.load(history_prompt)
+    if history_prompt in ALLOWED_PROMPTS:
+        return np.load(os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz"))
+    from webui.modules.implementations.patches.bark_speaker_library import library
+    if history_prompt in library:
+        return library.get(history_prompt)
+    filename = f'data/bark_custom_speakers/{history_prompt}.npz'
+    if os.path.isfile(filename):
+        return np.load(filename)
+    return None
+
+
+def make_generator(seed, device):
+    """An isolated generator for sampling, so concurrent generations don't share the global RNG. None if seed is None."""
+    if seed is None:
+        return None
+    device = torch.device(device)
+    if device.type == "mps":  # Sampling is shuttled to the cpu on mps
+        device = torch.device("cpu")
+    return torch.Generator(device).manual_seed(int(seed))
+
+
+@bark_profiler.profiled('semantic')
 def generate_text_semantic_new(
         text,
         history_prompt: Union[str, dict] = None,
         temp=0.7,
         top_k=None,
         top_p=None,
+        typical_p=None,
+        min_p=None,
         silent=False,
         min_eos_p=0.2,
         max_gen_duration_s=None,
         allow_early_stop=True,
         use_kv_caching=False,
+        seed=None,
 ):
     """Generate semantic tokens from text."""
     assert isinstance(text, str)
     text = o._normalize_whitespace(text)
     # assert len(text.strip()) > 0
-    if history_prompt is not None:
-        skip = False
-        if isinstance(history_prompt, dict):
-            semantic_history = history_prompt['semantic_prompt']
-        elif history_prompt.endswith(".npz"):
-            semantic_history = np.load(history_prompt)["semantic_prompt"]
-        else:
-            if history_prompt in ALLOWED_PROMPTS:
-                semantic_history = np.load(
-                    os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
-                )["semantic_prompt"]
-            else:
-                filename = f'data/bark_custom_speakers/{history_prompt}.npz'
-                if os.path.isfile(filename):
-                    semantic_history = np.load(
-                        filename
-                    )["semantic_prompt"]
-                else:
-                    skip = True
-        if not skip:
-            assert (
-                    isinstance(semantic_history, np.ndarray)
-                    and len(semantic_history.shape) == 1
-                    and len(semantic_history) > 0
-                    and semantic_history.min() >= 0
-                    and semantic_history.max() <= SEMANTIC_VOCAB_SIZE - 1
-            )
-        else:
-            semantic_history = None
+    x_history = load_history_prompt(history_prompt) if history_prompt is not None else None
+    if x_history is not None:
+        semantic_history = x_history["semantic_prompt"]
+        assert (
+                isinstance(semantic_history, np.ndarray)
+                and len(semantic_history.shape) == 1
+                and len(semantic_history) > 0
+                and semantic_history.min() >= 0
+                and semantic_history.max() <= SEMANTIC_VOCAB_SIZE - 1
+        )
     else:
         semantic_history = None
     # load models if not yet exist
@@ -84,9 +102,12 @@ def generate_text_semantic_new(
     model = model_container["model"]
     tokenizer = model_container["tokenizer"]
     encoded_text = np.array(o._tokenize(tokenizer, text)) + TEXT_ENCODING_OFFSET
+    record = bark_profiler.current()
     if OFFLOAD_CPU:
-        model.to(models_devices["text"])
+        record.offload(model, models_devices["text"])
     device = next(model.parameters()).device
+    record['device'] = device
+    generator = make_generator(seed, device)
     if len(encoded_text) > 256:
         p = round((len(encoded_text) - 256) / len(encoded_text) * 100, 1)
         logger.warning(f"warning, text too long, lopping of last {p}%")
@@ -115,7 +136,7 @@ def generate_text_semantic_new(
         ]).astype(np.int64)
     )[None]
     assert x.shape[1] == 256 + 256 + 1
-    with o._inference_mode():
+    with o._inference_mode(), bark_precision.autocast(device):
         x = x.to(device)
         n_tot_steps = 768
         # custom tqdm updates since we don't know when eos will occur
@@ -131,36 +152,13 @@ def generate_text_semantic_new(
             logits, kv_cache = model(
                 x_input, merge_context=True, use_cache=use_kv_caching, past_kv=kv_cache
             )
+            record['forwards'] += 1
             relevant_logits = logits[0, 0, :SEMANTIC_VOCAB_SIZE]
             if allow_early_stop:
                 relevant_logits = torch.hstack(
                     (relevant_logits, logits[0, 0, [SEMANTIC_PAD_TOKEN]])  # eos
                 )
-            if top_p is not None:
-                # faster to convert to numpy
-                logits_device = relevant_logits.device
-                logits_dtype = relevant_logits.type()
-                relevant_logits = relevant_logits.detach().cpu().type(torch.float32).numpy()
-                sorted_indices = np.argsort(relevant_logits)[::-1]
-                sorted_logits = relevant_logits[sorted_indices]
-                cumulative_probs = np.cumsum(softmax(sorted_logits))
-                sorted_indices_to_remove = cumulative_probs > top_p
-                sorted_indices_to_remove[1:] = sorted_indices_to_remove[:-1].copy()
-                sorted_indices_to_remove[0] = False
-                relevant_logits[sorted_indices[sorted_indices_to_remove]] = -np.inf
-                relevant_logits = torch.from_numpy(relevant_logits)
-                relevant_logits = relevant_logits.to(logits_device).type(logits_dtype)
-            if top_k is not None:
-                v, _ = torch.topk(relevant_logits, min(top_k, relevant_logits.size(-1)))
-                relevant_logits[relevant_logits < v[-1]] = -float("Inf")
-            probs = F.softmax(relevant_logits / temp, dim=-1)
-            # multinomial bugged on mps: shuttle to cpu if necessary
-            inf_device = probs.device
-            if probs.device.type == "mps":
-                probs = probs.to("cpu")
-            item_next = torch.multinomial(probs, num_samples=1)
-            probs = probs.to(inf_device)
-            item_next = item_next.to(inf_device)
+            item_next, probs = sample(relevant_logits, temp, top_k, top_p, typical_p, min_p, generator)
             if allow_early_stop and (
                     item_next == SEMANTIC_VOCAB_SIZE
                     or (min_eos_p is not None and probs[-1] >= min_eos_p)
@@ -169,6 +167,7 @@ def generate_text_semantic_new(
                 pbar.update(100 - pbar_state)
                 break
             x = torch.cat((x, item_next[None]), dim=1)
+            record['tokens'] += 1
             tot_generated_duration_s += 1 / SEMANTIC_RATE_HZ
             if max_gen_duration_s is not None and tot_generated_duration_s > max_gen_duration_s:
                 pbar.update(100 - pbar_state)
@@ -184,22 +183,26 @@ def generate_text_semantic_new(
         pbar.close()
         out = x.detach().cpu().numpy().squeeze()[256 + 256 + 1:]
     if OFFLOAD_CPU:
-        model.to("cpu")
+        record.offload(model, "cpu")
     assert all(0 <= out) and all(out < SEMANTIC_VOCAB_SIZE)
     o._clear_cuda_cache()
     return out
 
 
+@bark_profiler.profiled('coarse')
 def generate_coarse_new(
         x_semantic,
         history_prompt: Union[str, dict] = None,
         temp=0.7,
         top_k=None,
         top_p=None,
+        typical_p=None,
+        min_p=None,
         silent=False,
         max_coarse_history=630,  # min 60 (faster), max 630 (more context)
         sliding_window_len=60,
         use_kv_caching=False,
+        seed=None,
 ):
     """Generate coarse audio codes from semantic tokens."""
     assert (
@@ -213,45 +216,27 @@ def generate_coarse_new(
     assert max_coarse_history + sliding_window_len <= 1024 - 256
     semantic_to_coarse_ratio = COARSE_RATE_HZ / SEMANTIC_RATE_HZ * N_COARSE_CODEBOOKS
     max_semantic_history = int(np.floor(max_coarse_history / semantic_to_coarse_ratio))
-    if history_prompt is not None:
-        skip = False
-        if isinstance(history_prompt, dict):
-            x_history = history_prompt
-        elif history_prompt.endswith(".npz"):
-            x_history = np.load(history_prompt)
-        else:
-            if history_prompt in ALLOWED_PROMPTS:
-                x_history = np.load(
-                    os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
-                )
-            else:
-                filename = f'data/bark_custom_speakers/{history_prompt}.npz'
-                if os.path.isfile(filename):
-                    x_history = np.load(
-                        filename
-                    )
-                else:
-                    skip = True
-        if not skip:
-            x_semantic_history = x_history["semantic_prompt"]
-            x_coarse_history = x_history["coarse_prompt"]
-            assert (
-                    isinstance(x_semantic_history, np.ndarray)
-                    and len(x_semantic_history.shape) == 1
-                    and len(x_semantic_history) > 0
-                    and x_semantic_history.min() >= 0
-                    and x_semantic_history.max() <= SEMANTIC_VOCAB_SIZE - 1
-                    and isinstance(x_coarse_history, np.ndarray)
-                    and len(x_coarse_history.shape) == 2
-                    and x_coarse_history.shape[0] == N_COARSE_CODEBOOKS
-                    and x_coarse_history.shape[-1] >= 0
-                    and x_coarse_history.min() >= 0
-                    and x_coarse_history.max() <= CODEBOOK_SIZE - 1
-                    # and (
-                    #         round(x_coarse_history.shape[-1] / len(x_semantic_history), 1)
-                    #         == round(semantic_to_coarse_ratio / N_COARSE_CODEBOOKS, 1)
-                    # )
-            )
+    x_history = load_history_prompt(history_prompt) if history_prompt is not None else None
+    if x_history is not None:
+        x_semantic_history = x_history["semantic_prompt"]
+        x_coarse_history = x_history["coarse_prompt"]
+        assert (
+                isinstance(x_semantic_history, np.ndarray)
+                and len(x_semantic_history.shape) == 1
+                and len(x_semantic_history) > 0
+                and x_semantic_history.min() >= 0
+                and x_semantic_history.max() <= SEMANTIC_VOCAB_SIZE - 1
+                and isinstance(x_coarse_history, np.ndarray)
+                and len(x_coarse_history.shape) == 2
+                and x_coarse_history.shape[0] == N_COARSE_CODEBOOKS
+                and x_coarse_history.shape[-1] >= 0
+                and x_coarse_history.min() >= 0
+                and x_coarse_history.max() <= CODEBOOK_SIZE - 1
+                # and (
+                #         round(x_coarse_history.shape[-1] / len(x_semantic_history), 1)
+                #         == round(semantic_to_coarse_ratio / N_COARSE_CODEBOOKS, 1)
+                # )
+        )
         x_coarse_history = o._flatten_codebooks(x_coarse_history) + SEMANTIC_VOCAB_SIZE
         # trim histories correctly
         n_semantic_hist_provided = np.min(
@@ -275,9 +260,12 @@ def generate_coarse_new(
     if "coarse" not in models:
         preload_models()
     model = models["coarse"]
+    record = bark_profiler.current()
     if OFFLOAD_CPU:
-        model.to(models_devices["coarse"])
+        record.offload(model, models_devices["coarse"])
     device = next(model.parameters()).device
+    record['device'] = device
+    generator = make_generator(seed, device)
     # start loop
     n_steps = int(
         round(
@@ -289,7 +277,7 @@ def generate_coarse_new(
     x_semantic = np.hstack([x_semantic_history, x_semantic]).astype(np.int32)
     x_coarse = x_coarse_history.astype(np.int32)
     base_semantic_idx = len(x_semantic_history)
-    with o._inference_mode():
+    with o._inference_mode(), bark_precision.autocast(device):
         x_semantic_in = torch.from_numpy(x_semantic)[None].to(device)
         x_coarse_in = torch.from_numpy(x_coarse)[None].to(device)
         n_window_steps = int(np.ceil(n_steps / sliding_window_len))
@@ -324,6 +312,7 @@ def generate_coarse_new(
                     x_input = x_in
 
                 logits, kv_cache = model(x_input, use_cache=use_kv_caching, past_kv=kv_cache)
+                record['forwards'] += 1
                 logit_start_idx = (
                         SEMANTIC_VOCAB_SIZE + (1 - int(is_major_step)) * CODEBOOK_SIZE
                 )
@@ -331,40 +320,17 @@ def generate_coarse_new(
                         SEMANTIC_VOCAB_SIZE + (2 - int(is_major_step)) * CODEBOOK_SIZE
                 )
                 relevant_logits = logits[0, 0, logit_start_idx:logit_end_idx]
-                if top_p is not None:
-                    # faster to convert to numpy
-                    logits_device = relevant_logits.device
-                    logits_dtype = relevant_logits.type()
-                    relevant_logits = relevant_logits.detach().cpu().type(torch.float32).numpy()
-                    sorted_indices = np.argsort(relevant_logits)[::-1]
-                    sorted_logits = relevant_logits[sorted_indices]
-                    cumulative_probs = np.cumsum(softmax(sorted_logits))
-                    sorted_indices_to_remove = cumulative_probs > top_p
-                    sorted_indices_to_remove[1:] = sorted_indices_to_remove[:-1].copy()
-                    sorted_indices_to_remove[0] = False
-                    relevant_logits[sorted_indices[sorted_indices_to_remove]] = -np.inf
-                    relevant_logits = torch.from_numpy(relevant_logits)
-                    relevant_logits = relevant_logits.to(logits_device).type(logits_dtype)
-                if top_k is not None:
-                    v, _ = torch.topk(relevant_logits, min(top_k, relevant_logits.size(-1)))
-                    relevant_logits[relevant_logits < v[-1]] = -float("Inf")
-                probs = F.softmax(relevant_logits / temp, dim=-1)
-                # multinomial bugged on mps: shuttle to cpu if necessary
-                inf_device = probs.device
-                if probs.device.type == "mps":
-                    probs = probs.to("cpu")
-                item_next = torch.multinomial(probs, num_samples=1)
-                probs = probs.to(inf_device)
-                item_next = item_next.to(inf_device)
+                item_next, probs = sample(relevant_logits, temp, top_k, top_p, typical_p, min_p, generator)
                 item_next += logit_start_idx
                 x_coarse_in = torch.cat((x_coarse_in, item_next[None]), dim=1)
                 x_in = torch.cat((x_in, item_next[None]), dim=1)
                 del logits, relevant_logits, probs, item_next
                 n_step += 1
+                record['tokens'] += 1
             del x_in
         del x_semantic_in
     if OFFLOAD_CPU:
-        model.to("cpu")
+        record.offload(model, "cpu")
     gen_coarse_arr = x_coarse_in.detach().cpu().numpy().squeeze()[len(x_coarse_history):]
     del x_coarse_in
     assert len(gen_coarse_arr) == n_steps
@@ -375,11 +341,13 @@ def generate_coarse_new(
     return gen_coarse_audio_arr
 
 
+@bark_profiler.profiled('fine')
 def generate_fine_new(
         x_coarse_gen,
         history_prompt: Union[str, dict] = None,
         temp=0.5,
         silent=True,
+        seed=None,
 ):
     """Generate full audio codes from coarse audio codes."""
     assert (
@@ -390,34 +358,17 @@ def generate_fine_new(
             and x_coarse_gen.min() >= 0
             and x_coarse_gen.max() <= CODEBOOK_SIZE - 1
     )
-    if history_prompt is not None:
-        skip = False
-        if isinstance(history_prompt, dict):
-            x_fine_history = history_prompt['fine_prompt']
-        elif history_prompt.endswith(".npz"):
-            x_fine_history = np.load(history_prompt)["fine_prompt"]
-        else:
-            if history_prompt in ALLOWED_PROMPTS:
-                x_fine_history = np.load(
-                    os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
-                )["fine_prompt"]
-            else:
-                filename = f'data/bark_custom_speakers/{history_prompt}.npz'
-                if os.path.isfile(filename):
-                    x_fine_history = np.load(
-                        filename
-                    )["fine_prompt"]
-                else:
-                    skip = True
-        if not skip:
-            assert (
-                    isinstance(x_fine_history, np.ndarray)
-                    and len(x_fine_history.shape) == 2
-                    and x_fine_history.shape[0] == N_FINE_CODEBOOKS
-                    and x_fine_history.shape[1] >= 0
-                    and x_fine_history.min() >= 0
-                    and x_fine_history.max() <= CODEBOOK_SIZE - 1
-            )
+    x_history = load_history_prompt(history_prompt) if history_prompt is not None else None
+    if x_history is not None:
+        x_fine_history = x_history["fine_prompt"]
+        assert (
+                isinstance(x_fine_history, np.ndarray)
+                and len(x_fine_history.shape) == 2
+                and x_fine_history.shape[0] == N_FINE_CODEBOOKS
+                and x_fine_history.shape[1] >= 0
+                and x_fine_history.min() >= 0
+                and x_fine_history.max() <= CODEBOOK_SIZE - 1
+        )
     else:
         x_fine_history = None
     n_coarse = x_coarse_gen.shape[0]
@@ -427,9 +378,12 @@ def generate_fine_new(
     if "fine" not in models:
         preload_models()
     model = models["fine"]
+    record = bark_profiler.current()
     if OFFLOAD_CPU:
-        model.to(models_devices["fine"])
+        record.offload(model, models_devices["fine"])
     device = next(model.parameters()).device
+    record['device'] = device
+    generator = make_generator(seed, device)
     # make input arr
     in_arr = np.vstack(
         [
@@ -462,7 +416,7 @@ def generate_fine_new(
         )
     # we can be lazy about fractional loop and just keep overwriting codebooks
     n_loops = np.max([0, int(np.ceil((x_coarse_gen.shape[1] - (1024 - n_history)) / 512))]) + 1
-    with o._inference_mode():
+    with o._inference_mode(), bark_precision.autocast(device):
         in_arr = torch.tensor(in_arr.T).to(device)
         for n in tqdm.tqdm(range(n_loops), disable=silent):
             start_idx = np.min([n * 512, in_arr.shape[0] - 1024])
@@ -471,23 +425,16 @@ def generate_fine_new(
             in_buffer = in_arr[start_idx: start_idx + 1024, :][None]
             for nn in range(n_coarse, N_FINE_CODEBOOKS):
                 logits = model(nn, in_buffer)
+                record['forwards'] += 1
                 if temp is None:
                     relevant_logits = logits[0, rel_start_fill_idx:, :CODEBOOK_SIZE]
                     codebook_preds = torch.argmax(relevant_logits, -1)
                 else:
-                    relevant_logits = logits[0, :, :CODEBOOK_SIZE] / temp
-                    probs = F.softmax(relevant_logits, dim=-1)
-                    # multinomial bugged on mps: shuttle to cpu if necessary
-                    inf_device = probs.device
-                    if probs.device.type == "mps":
-                        probs = probs.to("cpu")
-                    codebook_preds = torch.hstack(
-                        [
-                            torch.multinomial(probs[nnn], num_samples=1).to(inf_device)
-                            for nnn in range(rel_start_fill_idx, 1024)
-                        ]
-                    )
+                    relevant_logits = logits[0, rel_start_fill_idx:, :CODEBOOK_SIZE]
+                    codebook_preds, _ = sample(relevant_logits, temp, generator=generator)
+                    codebook_preds = codebook_preds.squeeze(-1)
                 in_buffer[0, rel_start_fill_idx:, nn] = codebook_preds
+                record['tokens'] += codebook_preds.numel()
                 del logits, codebook_preds
             # transfer over info into model_in and convert to numpy
             for nn in range(n_coarse, N_FINE_CODEBOOKS):
@@ -498,7 +445,7 @@ def generate_fine_new(
         gen_fine_arr = in_arr.detach().cpu().numpy().squeeze().T
         del in_arr
     if OFFLOAD_CPU:
-        model.to("cpu")
+        record.offload(model, "cpu")
     gen_fine_arr = gen_fine_arr[:, n_history:]
     if n_remove_from_end > 0:
         gen_fine_arr = gen_fine_arr[:, :-n_remove_from_end]
@@ -507,6 +454,7 @@ def generate_fine_new(
     return gen_fine_arr
 
 
+@bark_profiler.profiled('codec')
 def codec_decode_new(fine_tokens, decode_on_cpu=False):
     """Turn quantized audio codes into audio array using encodec."""
     # load models if not yet exist
@@ -515,22 +463,27 @@ def codec_decode_new(fine_tokens, decode_on_cpu=False):
     if "codec" not in models:
         preload_models()
     model = models["codec"]
+    record = bark_profiler.current()
     if OFFLOAD_CPU and not decode_on_cpu:
-        model.to(models_devices["codec"])
+        record.offload(model, models_devices["codec"])
     elif decode_on_cpu:
-        model.to('cpu')
+        record.offload(model, 'cpu')
     device = next(model.parameters()).device
+    record['device'] = device
     arr = torch.from_numpy(fine_tokens)[None]
     arr = arr.to(device)
     arr = arr.transpose(0, 1)
     emb = model.quantizer.decode(arr)
-    out = model.decoder(emb)
-    audio_arr = out.detach().cpu().numpy().squeeze()
+    with bark_precision.codec_autocast(device):
+        out = model.decoder(emb)
+    audio_arr = out.detach().float().cpu().numpy().squeeze()
+    record['tokens'] += fine_tokens.size
+    record['forwards'] += 1
     del arr, emb, out
     if OFFLOAD_CPU and not decode_on_cpu:
-        model.to("cpu")
+        record.offload(model, "cpu")
     elif decode_on_cpu:
         from webui.args import args
-        model.to('cpu' if args.bark_use_cpu else 'cuda')
+        record.offload(model, 'cpu' if args.bark_use_cpu else 'cuda')
     return audio_arr
 
@@ -0,0 +1,174 @@
+import contextlib
+import time
+
+import numpy as np
+import torch
+import bark.generation as o
+
+precisions = ['fp32', 'bf16', 'int8']
+codec_precisions = ['fp32', 'bf16', 'fp16']
+
+precision = 'fp32'
+codec_precision = 'fp32'
+_originals = {}  # Unquantized models, only kept when applied with keep_original
+
+gpt_models = ['text', 'coarse', 'fine']
+
+
+def _get_model(name):
+    model = o.models[name]
+    return model['model'] if name == 'text' else model
+
+
+def _set_model(name, model):
+    if name == 'text':
+        o.models[name]['model'] = model
+    else:
+        o.models[name] = model
+
+
+def restore():
+    """Puts back the models replaced by an earlier apply(..., keep_original=True)."""
+    global precision
+    for name, model in _originals.items():
+        if name in o.models:
+            _set_model(name, model)
+    _originals.clear()
+    precision = 'fp32'
+
+
+def apply(mode: str = 'fp32', codec_mode: str = 'fp32', keep_original: bool = False):
+    """
+    Sets the precision of the loaded bark models.
+    :param mode: 'fp32', 'bf16' (autocast during generation) or 'int8' (dynamic quantization of the Linear layers, cpu only).
+    :param codec_mode: 'fp32', 'bf16' or 'fp16' (gpu only) for the Encodec decoder.
+    :param keep_original: Keep the fp32 models around so restore() can put them back, costs the memory of a copy.
+    """
+    global precision, codec_precision
+    assert mode in precisions, f'Unknown bark precision {mode}'
+    assert codec_mode in codec_precisions, f'Unknown codec precision {codec_mode}'
+    restore()
+    if mode == 'int8':
+        for name in gpt_models:
+            if name not in o.models:
+                continue
+            model = _get_model(name)
+            if o.OFFLOAD_CPU or next(model.parameters()).device.type != 'cpu':
+                print(f'Not quantizing bark {name} model, int8 quantization only works for models kept on cpu.')
+                continue
+            if keep_original:
+                _originals[name] = model
+            _set_model(name, torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8, inplace=not keep_original
+            ))
+    precision = mode
+    codec_precision = codec_mode
+
+
+def autocast(device):
+    """Autocast context for the gpt models, only does something in bf16 mode."""
+    device = torch.device(device)
+    if precision == 'bf16' and device.type in ['cpu', 'cuda']:
+        return torch.autocast(device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def codec_autocast(device):
+    """Autocast context for the Encodec decoder."""
+    device = torch.device(device)
+    if codec_precision == 'bf16' and device.type in ['cpu', 'cuda']:
+        return torch.autocast(device.type, dtype=torch.bfloat16)
+    if codec_precision == 'fp16' and device.type == 'cuda':
+        return torch.autocast('cuda', dtype=torch.float16)
+    return contextlib.nullcontext()
+
+
+def mel_distance(a: np.ndarray, b: np.ndarray, sr: int = o.SAMPLE_RATE) -> float:
+    """Mean absolute difference between the log-mel spectrograms of two waveforms, cropped to the shortest."""
+    import torchaudio
+    length = min(len(a), len(b))
+    mel = torchaudio.transforms.MelSpectrogram(sr, n_fft=1024, hop_length=256, n_mels=80)
+    spec_a, spec_b = [torch.log(mel(torch.from_numpy(np.asarray(x[:length], dtype=np.float32))) + 1e-5) for x in (a, b)]
+    return (spec_a - spec_b).abs().mean().item()
+
+
+def _agreement(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a.reshape(-1), b.reshape(-1)
+    length = min(len(a), len(b))
+    if length == 0:
+        return 1.0
+    return float((a[:length] == b[:length]).mean())
+
+
+def _generate(text, seed):
+    from .bark_generation import generate_text_semantic_new, generate_coarse_new, generate_fine_new, codec_decode_new
+    semantic = generate_text_semantic_new(text, seed=seed, silent=True, use_kv_caching=True)
+    coarse = generate_coarse_new(semantic, seed=seed, silent=True, use_kv_caching=True)
+    fine = generate_fine_new(coarse, temp=0.5, seed=seed, silent=True)
+    return semantic, coarse, fine, codec_decode_new(fine)
+
+
+def quality_check(text: str = 'Hello, this is a test of the quality of bark.', mode: str = 'int8',
+                  codec_mode: str = 'fp32', seed: int = 0) -> dict:
+    """
+    Compares a mode against fp32 on the loaded models, with the same seed.
+    Every stage after the first is fed the fp32 tokens, so a difference early on doesn't spill over into the later stages.
+    :return: Token agreement per stage, and mel distances of the full generation and of only the decoder.
+    """
+    from .bark_generation import generate_text_semantic_new, generate_coarse_new, generate_fine_new, codec_decode_new
+    if precision == 'int8' and not _originals:
+        raise ValueError('The bark models are quantized in place, load them again in fp32 for the quality check.')
+    previous = precision, codec_precision, bool(_originals)
+    apply('fp32', 'fp32')
+    semantic, coarse, fine, audio = _generate(text, seed)
+    apply(mode, codec_mode, keep_original=True)
+    try:
+        result = {
+            'semantic_agreement': _agreement(semantic, generate_text_semantic_new(text, seed=seed, silent=True,
+                                                                                  use_kv_caching=True)),
+            'coarse_agreement': _agreement(coarse, generate_coarse_new(semantic, seed=seed, silent=True,
+                                                                       use_kv_caching=True)),
+            'fine_agreement': _agreement(fine, generate_fine_new(coarse, temp=0.5, seed=seed, silent=True)),
+            'codec_mel_distance': mel_distance(audio, codec_decode_new(fine)),
+            'mel_distance': mel_distance(audio, _generate(text, seed)[3]),
+        }
+    finally:
+        apply(*previous)
+    return result
+
+
+def benchmark(text: str = 'Hello, this is a test of the speed of bark on the cpu.', modes=None, seed: int = 0) -> dict:
+    """
+    Tokens/sec of the semantic and coarse stages on cpu, per model size and mode. Reloads the models.
+    :return: {'small'/'large': {mode: {'semantic': tokens/s, 'coarse': tokens/s}}}
+    """
+    from .bark_generation import generate_text_semantic_new, generate_coarse_new
+    modes = modes or precisions
+    results = {}
+    for small in [True, False]:
+        o.clean_models()
+        o.preload_models(text_use_gpu=False, coarse_use_gpu=False, fine_use_gpu=False, codec_use_gpu=False,
+                         text_use_small=small, coarse_use_small=small, fine_use_small=small)
+        size = 'small' if small else 'large'
+        results[size] = {}
+        for mode in modes:
+            apply(mode, keep_original=True)
+            start = time.perf_counter()
+            semantic = generate_text_semantic_new(text, seed=seed, silent=True, use_kv_caching=True)
+            semantic_time = time.perf_counter() - start
+            start = time.perf_counter()
+            coarse = generate_coarse_new(semantic, seed=seed, silent=True, use_kv_caching=True)
+            coarse_time = time.perf_counter() - start
+            results[size][mode] = {'semantic': len(semantic) / semantic_time, 'coarse': coarse.size / coarse_time}
+        restore()
+    o.clean_models()
+    return results
+
+
+if __name__ == '__main__':
+    for _size, _modes in benchmark().items():
+        for _mode, _speeds in _modes.items():
+            print(f'{_size} {_mode}: semantic {_speeds["semantic"]:.1f} tokens/s, coarse {_speeds["coarse"]:.1f} tokens/s')
+    o.preload_models(text_use_gpu=False, coarse_use_gpu=False, fine_use_gpu=False, codec_use_gpu=False)
+    for _mode in ['bf16', 'int8']:
+        print(_mode, quality_check(mode=_mode))
@@ -0,0 +1,147 @@
+import contextlib
+import functools
+import os
+import threading
+import time
+
+import torch
+
+stages = ['semantic', 'coarse', 'fine', 'codec']
+
+_local = threading.local()
+_lock = threading.Lock()
+_measuring = 0  # Stages running, the cuda peak is only reset when no other stage is measuring it
+
+# Totals since startup, for the metrics endpoint
+totals = {stage: {'calls': 0, 'seconds': 0., 'tokens': 0, 'forwards': 0, 'offload_seconds': 0.} for stage in stages}
+last = {stage: {'tokens_per_second': 0., 'peak_memory': 0} for stage in stages}
+
+
+def _sync(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def _process_peak_rss() -> int:
+    """Peak rss of this process since startup in bytes, 0 where it's not available."""
+    try:
+        import resource
+        # ru_maxrss is in KB on linux, bytes on macos
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if os.uname().sysname == 'Darwin' else 1024)
+    except ImportError:  # Windows
+        return 0
+
+
+def _start_peak() -> int:
+    """Starts measuring the peak memory of a stage, returns what _end_peak needs."""
+    global _measuring
+    with _lock:
+        if torch.cuda.is_available() and not _measuring:
+            torch.cuda.reset_peak_memory_stats()
+        _measuring += 1
+    return _process_peak_rss()
+
+
+def _end_peak(device, rss_start: int) -> int:
+    """
+    Peak memory of the stage in bytes. On cuda the peak allocated memory since the stage started, which includes stages
+    running at the same time. On cpu how much the stage raised the peak rss of the process, the rss peak can't be reset.
+    """
+    global _measuring
+    device = torch.device(device)
+    peak = torch.cuda.max_memory_allocated(device) if device.type == 'cuda' else _process_peak_rss() - rss_start
+    with _lock:
+        _measuring -= 1
+    return peak
+
+
+class _Record(dict):
+    def offload(self, model, device):
+        """model.to(device), timed as offload time."""
+        start = time.perf_counter()
+        model.to(device)
+        _sync(device)
+        self['offload_seconds'] += time.perf_counter() - start
+
+
+def current() -> _Record:
+    """The record of the stage running on this thread. Outside of a profiled stage, a record which goes nowhere."""
+    return getattr(_local, 'record', None) or _Record(tokens=0, forwards=0, offload_seconds=0., device='cpu')
+
+
+def profiled(stage: str):
+    """Decorator for a bark stage, records wall time, peak memory and whatever the stage adds through current()."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = _Record(stage=stage, tokens=0, forwards=0, offload_seconds=0., device='cpu')
+            _local.record = record
+            rss_start = _start_peak()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _sync(record['device'])
+                _local.record = None
+                record['seconds'] = time.perf_counter() - start
+                record['tokens_per_second'] = record['tokens'] / record['seconds'] if record['seconds'] else 0.
+                record['peak_memory'] = _end_peak(record.pop('device'), rss_start)
+                _add(dict(record))
+        return wrapper
+    return decorator
+
+
+def _add(record: dict):
+    stage = record['stage']
+    with _lock:
+        total = totals[stage]
+        total['calls'] += 1
+        for key in ['seconds', 'tokens', 'forwards', 'offload_seconds']:
+            total[key] += record[key]
+        last[stage] = {'tokens_per_second': record['tokens_per_second'], 'peak_memory': record['peak_memory']}
+    for collected in getattr(_local, 'collectors', []):
+        collected.append(record)
+
+
+@contextlib.contextmanager
+def collect():
+    """
+    Collects the records of every stage that runs on this thread inside the with block, in order.
+    Nested blocks each get the records, an inner collect() doesn't hide them from the outer one.
+    """
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    records = []
+    _local.collectors.append(records)
+    try:
+        yield records
+    finally:
+        _local.collectors.pop()
+
+
+def summary(records: list[dict]) -> str:
+    return '\n'.join(
+        f'{r["stage"]}: {r["seconds"]:.2f}s, {r["tokens"]} tokens ({r["tokens_per_second"]:.1f}/s), '
+        f'{r["forwards"]} forwards, offload {r["offload_seconds"]:.2f}s, peak {r["peak_memory"] / 1024 ** 2:.0f}MB'
+        for r in records
+    )
+
+
+def prometheus() -> str:
+    """The totals and last values in the Prometheus text format."""
+    metrics = [
+        ('bark_stage_calls_total', 'counter', 'Calls per bark stage.', lambda s: totals[s]['calls']),
+        ('bark_stage_seconds_total', 'counter', 'Wall time per bark stage.', lambda s: totals[s]['seconds']),
+        ('bark_stage_tokens_total', 'counter', 'Tokens generated (decoded for codec) per bark stage.', lambda s: totals[s]['tokens']),
+        ('bark_stage_forwards_total', 'counter', 'Model forward passes per bark stage.', lambda s: totals[s]['forwards']),
+        ('bark_stage_offload_seconds_total', 'counter', 'Time spent moving models between devices per bark stage.', lambda s: totals[s]['offload_seconds']),
+        ('bark_stage_tokens_per_second', 'gauge', 'Tokens/s of the last call per bark stage.', lambda s: last[s]['tokens_per_second']),
+        ('bark_stage_peak_memory_bytes', 'gauge', 'Peak memory during the last call per bark stage, allocated memory on cuda, increase of the process peak rss on cpu.', lambda s: last[s]['peak_memory']),
+    ]
+    lines = []
+    with _lock:
+        for name, kind, help_text, value in metrics:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines += [f'{name}{{stage="{stage}"}} {value(stage)}' for stage in stages]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,134 @@
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+def _remove_top_p(logits: torch.Tensor, top_p: float) -> torch.Tensor:
+    """Nucleus filtering, keeps the smallest set of tokens with a cumulative probability above top_p."""
+    sorted_logits, sorted_indices = torch.sort(logits, descending=True, dim=-1)
+    cumulative_probs = sorted_logits.float().softmax(dim=-1).cumsum(dim=-1)
+    sorted_to_remove = cumulative_probs > top_p
+    # Shift right so the token crossing the threshold is kept, the most likely token is always kept
+    sorted_to_remove[..., 1:] = sorted_to_remove[..., :-1].clone()
+    sorted_to_remove[..., 0] = False
+    return sorted_to_remove.scatter(-1, sorted_indices, sorted_to_remove)
+
+
+def _remove_top_k(logits: torch.Tensor, top_k: int) -> torch.Tensor:
+    v, _ = torch.topk(logits, min(top_k, logits.size(-1)), dim=-1)
+    return logits < v[..., -1:]
+
+
+def _remove_typical_p(logits: torch.Tensor, typical_p: float) -> torch.Tensor:
+    """Locally typical sampling, keeps the tokens whose surprisal is closest to the entropy of the distribution."""
+    log_probs = logits.float().log_softmax(dim=-1)
+    probs = log_probs.exp()
+    entropy = -torch.nan_to_num(probs * log_probs).sum(dim=-1, keepdim=True)
+    shifted = (-log_probs - entropy).abs()
+    sorted_shifted, sorted_indices = torch.sort(shifted, dim=-1)
+    cumulative_probs = probs.gather(-1, sorted_indices).cumsum(dim=-1)
+    sorted_to_remove = cumulative_probs > typical_p
+    sorted_to_remove[..., 1:] = sorted_to_remove[..., :-1].clone()
+    sorted_to_remove[..., 0] = False
+    return sorted_to_remove.scatter(-1, sorted_indices, sorted_to_remove)
+
+
+def _remove_min_p(logits: torch.Tensor, min_p: float) -> torch.Tensor:
+    """Removes tokens less likely than min_p times the most likely token."""
+    probs = logits.float().softmax(dim=-1)
+    return probs < min_p * probs.amax(dim=-1, keepdim=True)
+
+
+def filter_logits(logits: torch.Tensor, top_k=None, top_p=None, typical_p=None, min_p=None) -> torch.Tensor:
+    """
+    Masks out logits with -inf, everything stays on the logits' device. Works on the last dimension, so batches work too.
+    The filters are applied in order, top_p, top_k, typical_p, min_p.
+    :param logits: Logits of shape (..., vocab).
+    :return: A filtered copy of the logits.
+    """
+    logits = logits.clone()
+    for value, remove in ((top_p, _remove_top_p), (top_k, _remove_top_k),
+                          (typical_p, _remove_typical_p), (min_p, _remove_min_p)):
+        if value is not None:
+            logits.masked_fill_(remove(logits, value), -float("Inf"))
+    return logits
+
+
+def sample(logits: torch.Tensor, temp=1.0, top_k=None, top_p=None, typical_p=None, min_p=None,
+           generator: torch.Generator = None):
+    """
+    Samples one token per row of logits.
+    :param logits: Logits of shape (vocab,) or (batch, vocab).
+    :param temp: Temperature, applied after filtering.
+    :param generator: Optional generator for seeded sampling, on the cpu if the logits are on mps.
+    :return: (tokens, probs), tokens of shape (1,) or (batch, 1), both on the logits' device.
+    """
+    logits = filter_logits(logits, top_k, top_p, typical_p, min_p)
+    probs = F.softmax(logits.float() / temp, dim=-1)
+    # multinomial bugged on mps: shuttle to cpu if necessary
+    inf_device = probs.device
+    if inf_device.type == "mps":
+        item_next = torch.multinomial(probs.to("cpu"), num_samples=1, generator=generator).to(inf_device)
+    else:
+        item_next = torch.multinomial(probs, num_samples=1, generator=generator)
+    return item_next, probs
+
+
+def _numpy_top_p(relevant_logits: torch.Tensor, top_p: float) -> torch.Tensor:
+    """The previous implementation, round-trips through numpy every step. Only kept for the benchmark."""
+    from scipy.special import softmax
+    logits_device = relevant_logits.device
+    logits_dtype = relevant_logits.type()
+    relevant_logits = relevant_logits.detach().cpu().type(torch.float32).numpy()
+    sorted_indices = np.argsort(relevant_logits)[::-1]
+    sorted_logits = relevant_logits[sorted_indices]
+    cumulative_probs = np.cumsum(softmax(sorted_logits))
+    sorted_indices_to_remove = cumulative_probs > top_p
+    sorted_indices_to_remove[1:] = sorted_indices_to_remove[:-1].copy()
+    sorted_indices_to_remove[0] = False
+    relevant_logits[sorted_indices[sorted_indices_to_remove]] = -np.inf
+    relevant_logits = torch.from_numpy(relevant_logits)
+    return relevant_logits.to(logits_device).type(logits_dtype)
+
+
+def benchmark(vocab=10_001, steps=500, top_p=0.9, devices=None):
+    """
+    Times a top_p sampling step with the numpy path and the device path, with the vocab size of the semantic stage.
+    :return: {device: {'numpy': ms/step, 'torch': ms/step, 'match': bool}}
+    """
+    if devices is None:
+        devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    results = {}
+    for device in devices:
+        logits = torch.randn(steps, vocab, device=device) * 3
+
+        def sync():
+            if device == 'cuda':
+                torch.cuda.synchronize()
+
+        def run(step):
+            sync()
+            start = time.perf_counter()
+            for row in logits:
+                probs = F.softmax(step(row), dim=-1)
+                torch.multinomial(probs, num_samples=1)
+            sync()
+            return (time.perf_counter() - start) * 1000 / steps
+
+        # On the cpu the numpy path writes into the logits' storage, so it gets a copy
+        numpy_ms = run(lambda row: _numpy_top_p(row.clone(), top_p))
+        torch_ms = run(lambda row: filter_logits(row, top_p=top_p))
+        match = all(
+            torch.equal(_numpy_top_p(row.clone(), top_p).isinf(), filter_logits(row, top_p=top_p).isinf())
+            for row in logits[:20]
+        )
+        results[device] = {'numpy': numpy_ms, 'torch': torch_ms, 'match': match}
+    return results
+
+
+if __name__ == '__main__':
+    for _device, _result in benchmark().items():
+        print(f'{_device}: numpy {_result["numpy"]:.3f} ms/step, torch {_result["torch"]:.3f} ms/step, '
+              f'same mask: {_result["match"]}')
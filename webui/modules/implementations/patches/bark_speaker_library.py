@@ -0,0 +1,136 @@
+import json
+import os.path
+import shutil
+import time
+import zipfile
+
+import numpy as np
+
+prompt_keys = ['semantic_prompt', 'coarse_prompt', 'fine_prompt']
+codec_frame_rate = 75  # Encodec frames per second at 24khz
+
+
+class SpeakerLibrary:
+    """
+    Speaker prompts stored as uint16 .npy files (semantic tokens are < 10 000, codec codes are < 1024), one directory per speaker.
+    An index.json holds metadata so listing doesn't need to touch the prompts, and prompts are memory mapped when loaded.
+    """
+
+    def __init__(self, path=os.path.join('data', 'bark_custom_speakers', 'library')):
+        self.path = path
+        self.index_file = os.path.join(path, 'index.json')
+        self._index = None
+        self._index_mtime = None
+
+    @property
+    def index(self) -> dict:
+        mtime = os.path.getmtime(self.index_file) if os.path.isfile(self.index_file) else None
+        if self._index is None or mtime != self._index_mtime:
+            self._index = {}
+            if mtime is not None:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            self._index_mtime = mtime
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self.path, exist_ok=True)
+        temp = self.index_file + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f, indent=2)
+        os.replace(temp, self.index_file)
+        self._index_mtime = os.path.getmtime(self.index_file)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self) -> list[str]:
+        return sorted(self.index.keys())
+
+    def info(self, name) -> dict:
+        return self.index[name]
+
+    def add(self, name, prompts, source=None, overwrite=True):
+        """
+        :param prompts: A dict (or npz) with semantic_prompt, coarse_prompt and fine_prompt.
+        """
+        if name in self and not overwrite:
+            raise FileExistsError(f'Speaker {name} already exists')
+        speaker_dir = os.path.join(self.path, name)
+        os.makedirs(speaker_dir, exist_ok=True)
+        for key in prompt_keys:
+            arr = np.asarray(prompts[key])
+            if arr.size and (arr.min() < 0 or arr.max() > np.iinfo(np.uint16).max):
+                raise ValueError(f'{key} of {name} is out of range for uint16')
+            np.save(os.path.join(speaker_dir, key + '.npy'), arr.astype(np.uint16))
+        index = self.index
+        index[name] = {
+            'duration': np.asarray(prompts['fine_prompt']).shape[-1] / codec_frame_rate,
+            'source': source,
+            'created': time.time()
+        }
+        self._save_index()
+
+    def get(self, name) -> dict:
+        """Memory mapped uint16 prompts, nothing is read from disk until it's used."""
+        if name not in self:
+            raise KeyError(f'Speaker {name} not found')
+        speaker_dir = os.path.join(self.path, name)
+        return {key: np.load(os.path.join(speaker_dir, key + '.npy'), mmap_mode='r') for key in prompt_keys}
+
+    def remove(self, name):
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        self.index.pop(name, None)
+        self._save_index()
+
+    def import_npz(self, files, base_path=None, overwrite=True) -> list[str]:
+        """
+        Bulk import of .npz speaker files, or zips containing them.
+        :param base_path: Names are made relative to this path, otherwise the file name is used.
+        :return: The imported names.
+        """
+        imported = []
+        for file in files:
+            if file.endswith('.zip'):
+                with zipfile.ZipFile(file) as zf:
+                    for member in zf.namelist():
+                        if member.endswith('.npz'):
+                            with zf.open(member) as f:
+                                imported.append(self._import_one(member[:-4], np.load(f), f'{file}:{member}', overwrite))
+                continue
+            if base_path:
+                name = os.path.relpath(file, base_path)[:-4].replace('\\', '/')
+            else:
+                name = os.path.splitext(os.path.basename(file))[0]
+            with np.load(file) as data:
+                imported.append(self._import_one(name, data, file, overwrite))
+        return [name for name in imported if name]
+
+    def _import_one(self, name, data, source, overwrite):
+        if not all(key in data for key in prompt_keys):
+            print(f'Skipping {source}, it is not a speaker file')
+            return None
+        if name in self and not overwrite:
+            return None
+        self.add(name, data, source)
+        return name
+
+    def export(self, names, out_file) -> str:
+        """Exports speakers as regular bark .npz files (int64) in a zip."""
+        with zipfile.ZipFile(out_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name in names:
+                with zf.open(f'{name}.npz', 'w') as f:
+                    np.savez(f, **{key: np.asarray(value, dtype=np.int64) for key, value in self.get(name).items()})
+        return out_file
+
+    def migrate(self, base_path=os.path.join('data', 'bark_custom_speakers')) -> list[str]:
+        """Imports loose .npz speakers which aren't in the library yet. The .npz files are left in place."""
+        files = []
+        for path, subdirs, names in os.walk(base_path):
+            if os.path.abspath(path).startswith(os.path.abspath(self.path)):
+                continue
+            files += [os.path.join(path, name) for name in names if name.endswith('.npz')]
+        return self.import_npz(files, base_path, overwrite=False)
+
+
+library = SpeakerLibrary()
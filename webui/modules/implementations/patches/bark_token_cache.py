@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os.path
+import re
+import threading
+
+import numpy as np
+
+cache_dir = os.path.join('data', 'cache', 'bark_tokens')
+max_cache_size = 512 * 1024 ** 2  # Bytes, least recently used entries are removed past this size
+
+_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def prompt_hash(history_prompt) -> str:
+    """Hash of a speaker prompt's contents, so renaming or re-cloning a speaker doesn't give stale hits."""
+    if history_prompt is None:
+        return 'none'
+    from webui.modules.implementations.patches.bark_generation import load_history_prompt
+    prompt = load_history_prompt(history_prompt)
+    if prompt is None:
+        return 'none'
+    h = hashlib.sha1()
+    for key in ['semantic_prompt', 'coarse_prompt', 'fine_prompt']:
+        if key in prompt:
+            h.update(np.ascontiguousarray(prompt[key], dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def model_size(model_type: str) -> str:
+    """
+    Layers and width of the loaded model of a stage, 'text' or 'coarse', so tokens of the small and large models aren't
+    mixed up. Loads the models if needed, like the stages do.
+    """
+    from bark.generation import models, preload_models
+    if model_type not in models:
+        preload_models()
+    model = models[model_type]
+    if isinstance(model, dict):  # The text model comes with its tokenizer
+        model = model['model']
+    return f'{model.config.n_layer}x{model.config.n_embd}'
+
+
+def make_key(stage: str, data, history_prompt, **params) -> str:
+    """
+    :param stage: 'semantic' or 'coarse'.
+    :param data: The input of the stage, text or a token array.
+    :param params: Sampling parameters, like temp and seed, and the model, see model_size.
+    """
+    h = hashlib.sha1(stage.encode())
+    if isinstance(data, str):
+        h.update(normalize_text(data).encode())
+    else:
+        h.update(np.ascontiguousarray(data, dtype=np.int64).tobytes())
+    h.update(prompt_hash(history_prompt).encode())
+    h.update(json.dumps(params, sort_keys=True).encode())
+    return f'{stage}_{h.hexdigest()}'
+
+
+def get(key: str) -> np.ndarray | None:
+    path = os.path.join(cache_dir, key + '.npy')
+    try:
+        tokens = np.load(path)
+        os.utime(path)  # Mark as recently used
+    except (OSError, ValueError):  # Not cached, or evicted meanwhile
+        return None
+    return tokens
+
+
+def put(key: str, tokens: np.ndarray):
+    """Writes through a temporary file, so readers never see a partial file."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npy')
+    temporary = path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporary, 'wb') as f:
+        np.save(f, tokens.astype(np.uint16))
+    os.replace(temporary, path)
+    evict()
+
+
+def evict(max_size=None):
+    max_size = max_cache_size if max_size is None else max_size
+    with _lock:
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # Removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_size:
+                break
+            total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cached(stage: str, data, history_prompt, generate, **params) -> np.ndarray:
+    """Returns the cached tokens for these inputs, or calls generate() and caches the result."""
+    key = make_key(stage, data, history_prompt, **params)
+    tokens = get(key)
+    if tokens is None:
+        tokens = generate()
+        put(key, tokens)
+    return tokens.astype(np.int64)
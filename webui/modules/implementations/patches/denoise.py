@@ -1,34 +1,29 @@
+from denoiser.audio import convert_audio
 from denoiser.enhance import *
 
+from webui.modules.implementations import denoising
 
-def enhance_new(args, in_file, out_file, model=None, local_out_dir=None):
-    # Load model
-    if not model:
-        model = pretrained.get_model(args).to(args.device)
-    model.eval()
-
-    dset = Audioset([(in_file, None)], with_path=True,
-                    sample_rate=model.sample_rate, channels=model.chin, convert=True)
-    if dset is None:
-        return
-    loader = distrib.loader(dset, batch_size=1)
 
-    distrib.barrier()
+def _model_name(args):
+    for name in ['dns64', 'master64']:
+        if getattr(args, name, False):
+            return name
+    return 'dns48'
 
-    with ProcessPoolExecutor(1) as pool:
-        iterator = LogProgress(logger, loader, name="Generate enhanced files")
-        pendings = []
-        for data in iterator:
-            # Get batch data
-            noisy_signals, filenames = data
-            noisy_signals = noisy_signals.to(args.device)
 
-            # Forward
-            estimate = get_estimate(model, noisy_signals, args)
-            for estimate, noisy, filename in zip(estimate, noisy_signals, filenames):
-                write(estimate, out_file, sr=model.sample_rate)
+def enhance_new(args, in_file, out_file, model=None, local_out_dir=None):
+    """
+    Denoises in_file into out_file in overlapping blocks, see denoising.dns_denoise.
+    Without a model, the one selected by args (or args.model_path) is loaded once and kept in memory.
+    """
+    if model is None:
+        if getattr(args, 'model_path', None):
+            model = denoising.load_model_file(args.model_path, args.device)
+        else:
+            model = denoising.load_model(_model_name(args), args.device)
+    model.eval()
 
-        if pendings:
-            print('Waiting for pending jobs...')
-            for pending in LogProgress(logger, pendings, updates=5, name="Generate enhanced files"):
-                pending.result()
+    wav, sr = torchaudio.load(in_file)
+    wav = convert_audio(wav, sr, model.sample_rate, model.chin)
+    estimate = denoising.dns_denoise([wav[0]], model, dry=args.dry)[0]
+    write(estimate[None], out_file, sr=model.sample_rate)
@@ -0,0 +1,179 @@
+import collections
+import contextlib
+import hashlib
+import os
+import time
+
+import numpy as np
+import torch
+
+decoders = ['viterbi', 'weighted argmax', 'argmax']
+
+# Settings, set from the command line args by configure()
+batch_size = 512  # Frames per forward pass, bounds the memory used by the model
+threads = 0  # Cpu threads while predicting, set process wide while it runs, 0 keeps torch's setting
+decoder = 'viterbi'
+window_seconds = 30  # Seconds of probabilities decoded at once, bounds the memory used by decoding
+overlap_seconds = 1  # Decoded on both sides of every window and dropped, so window edges don't change the pitch
+cache_size = 8  # Results kept, 0 disables the cache
+
+_models = {}
+_cache = collections.OrderedDict()
+
+
+def configure(batch_size_: int = None, threads_: int = None, decoder_: str = None):
+    global batch_size, threads, decoder
+    if batch_size_ is not None:
+        batch_size = batch_size_
+    if threads_ is not None:
+        threads = threads_
+    if decoder_ is not None:
+        assert decoder_ in decoders, f'Unknown crepe decoder {decoder_}'
+        decoder = decoder_
+
+
+def default_device() -> str:
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_model(capacity: str = 'full', device='cpu'):
+    """The crepe model, kept loaded per capacity and device, so switching between tiny and full doesn't reload."""
+    import torchcrepe
+    key = (capacity, str(device))
+    if key not in _models:
+        model = torchcrepe.Crepe(capacity)
+        file = os.path.join(os.path.dirname(torchcrepe.__file__), 'assets', f'{capacity}.pth')
+        model.load_state_dict(torch.load(file, map_location='cpu'))
+        _models[key] = model.to(device).eval().requires_grad_(False)
+    return _models[key]
+
+
+@contextlib.contextmanager
+def _threads(device):
+    if not threads or torch.device(device).type != 'cpu':
+        yield
+        return
+    previous = torch.get_num_threads()
+    torch.set_num_threads(threads)
+    try:
+        yield
+    finally:
+        torch.set_num_threads(previous)
+
+
+def _decode_function(name):
+    import torchcrepe
+    return {
+        'viterbi': torchcrepe.decode.viterbi,
+        'weighted argmax': torchcrepe.decode.weighted_argmax,
+        'argmax': torchcrepe.decode.argmax,
+    }[name]
+
+
+def _cache_key(x, *params):
+    return (hashlib.sha1(np.ascontiguousarray(x).tobytes()).hexdigest(),) + params
+
+
+def predict(x: np.ndarray, sr: int, hop: int, f0_min: float, f0_max: float, capacity: str = 'full', device=None,
+            decoder_name: str = None) -> np.ndarray:
+    """
+    Crepe pitch, one frame per hop (with padding), unvoiced frames are not marked. Doesn't modify x.
+    Frames go through the model batch_size at a time and are decoded every window_seconds, with overlap_seconds of
+    context on both sides, so memory doesn't grow with the length of the audio. The audio itself stays on the cpu.
+    While it runs, threads sets torch's thread count for the whole process.
+    :param device: Defaults to cuda when available.
+    :param decoder_name: One of decoders, defaults to decoder.
+    """
+    import torchcrepe
+    device = device or default_device()
+    decoder_name = decoder_name or decoder
+    key = _cache_key(x, sr, hop, f0_min, f0_max, capacity, decoder_name)
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key].copy()
+
+    audio = np.asarray(x, dtype=np.float32).reshape(-1)
+    scale = np.quantile(np.abs(audio), 0.999)
+    audio = torch.from_numpy(audio / scale if scale > 0 else audio.copy())[None]
+    model = load_model(capacity, device)
+    decode = _decode_function(decoder_name)
+    window_frames = max(window_seconds * torchcrepe.SAMPLE_RATE // hop, 1)
+    overlap_frames = int(overlap_seconds * torchcrepe.SAMPLE_RATE // hop)
+    pitch = []
+
+    def decode_window(probabilities, first, last=None):
+        # shape=(1, 360, frames), as postprocess expects
+        probabilities = probabilities.T[None]
+        pitch.append(torchcrepe.postprocess(probabilities, f0_min, f0_max, decode)[0, first:last].cpu().numpy())
+
+    with torch.inference_mode(), _threads(device):
+        window = []
+        window_length = 0
+        context = 0  # Frames at the start of window which were decoded with the previous window
+        for frames in torchcrepe.preprocess(audio, sr, hop, batch_size, device, pad=True):
+            window.append(model(frames))
+            window_length += len(frames)
+            if window_length >= context + window_frames + overlap_frames:
+                probabilities = torch.cat(window)
+                decode_window(probabilities, context, window_length - overlap_frames)
+                # The next window starts with up to overlap_frames it decoded and the overlap_frames it didn't
+                start = max(window_length - 2 * overlap_frames, 0)
+                window = [probabilities[start:]]
+                context = window_length - overlap_frames - start
+                window_length -= start
+        if window_length > context:
+            decode_window(torch.cat(window), context)
+    pitch = np.concatenate(pitch) if pitch else np.zeros(0, dtype=np.float32)
+
+    if cache_size > 0:
+        _cache[key] = pitch.copy()
+        while len(_cache) > cache_size:
+            _cache.popitem(last=False)
+    return pitch
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def benchmark(seconds=20, hop=160, capacities=('tiny', 'full'), thread_counts=(0,)):
+    """
+    Cpu time of the previous torchcrepe.predict call (batch size tied to the hop, model reloaded on a capacity change) against
+    predict(), on the vibrato tone of pitch_extraction.benchmark. The cache is bypassed.
+    :return: {(capacity, threads): {'previous': (seconds, median cents error), 'engine': (seconds, median cents error)}}
+    """
+    import torchcrepe
+    from webui.modules.implementations.rvc import pitch_extraction
+    global threads, cache_size
+    sr = torchcrepe.SAMPLE_RATE
+    x, reference = pitch_extraction.vibrato_tone(seconds, sr, hop)
+    previous_settings = threads, cache_size
+    cache_size = 0
+    results = {}
+    try:
+        for capacity in capacities:
+            for threads in thread_counts:
+                with _threads('cpu'):
+                    torchcrepe.load.model('cpu', capacity)  # The previous path reloads the model when the capacity changes
+                    start = time.perf_counter()
+                    normalized = (x / np.quantile(np.abs(x), 0.999)).astype(np.float32)
+                    previous = torchcrepe.predict(torch.from_numpy(normalized)[None], sr, hop, 50, 1100, capacity,
+                                                  batch_size=hop * 2, device='cpu', pad=True)[0].numpy()
+                    previous_time = time.perf_counter() - start
+                load_model(capacity, 'cpu')
+                start = time.perf_counter()
+                pitch = predict(x, sr, hop, 50, 1100, capacity, 'cpu')
+                engine_time = time.perf_counter() - start
+                results[(capacity, threads)] = {
+                    'previous': (previous_time, pitch_extraction.cents_error(previous, reference)),
+                    'engine': (engine_time, pitch_extraction.cents_error(pitch, reference)),
+                }
+    finally:
+        threads, cache_size = previous_settings
+    return results
+
+
+if __name__ == '__main__':
+    for (_capacity, _threads_count), _result in benchmark(thread_counts=(0, 1)).items():
+        print(f'{_capacity}, {_threads_count or "default"} threads: ' + ', '.join(
+            f'{variant} {elapsed:.2f}s ({cents:.1f} cents)' for variant, (elapsed, cents) in _result.items()))
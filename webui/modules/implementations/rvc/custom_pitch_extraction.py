@@ -1,7 +0,0 @@
-import torch
-import torchaudio
-import torchaudio.functional as F
-
-
-def pitch_extract(f0_method, x, f0_min, f0_max, p_len, time_step, sr, window):
-    pass
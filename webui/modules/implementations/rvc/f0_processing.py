@@ -0,0 +1,119 @@
+import time
+
+import numpy as np
+
+f0_min = 50
+f0_max = 1100
+
+
+def uv_mask(f0: np.ndarray) -> np.ndarray:
+    """1 for voiced frames (f0 > 0), 0 for unvoiced frames."""
+    return (np.asarray(f0) > 0).astype(np.float32)
+
+
+def interpolate_f0(f0: np.ndarray):
+    """
+    Fills the unvoiced frames, linearly between voiced frames, with the first voiced value before the first voiced frame,
+    and with the last voiced value after the last one. Doesn't modify f0.
+    :return: (interpolated f0, uv mask). All zeros if nothing is voiced.
+    """
+    f0 = np.asarray(f0).reshape(-1)
+    uv = uv_mask(f0)
+    voiced = np.flatnonzero(uv)
+    if len(voiced) == 0:
+        return np.zeros_like(f0), uv
+    return np.interp(np.arange(len(f0)), voiced, f0[voiced]).astype(f0.dtype, copy=False), uv
+
+
+def resize_f0(f0: np.ndarray, target_len: int) -> np.ndarray:
+    """Linear resize to target_len frames. Frames next to unvoiced frames (< 0.001) become unvoiced (0)."""
+    source = np.array(f0, dtype=np.float64).reshape(-1)
+    if len(source) == 0 or target_len == 0:
+        return np.zeros(target_len)
+    source[source < 0.001] = np.nan
+    target = np.interp(
+        np.arange(0, len(source) * target_len, len(source)) / target_len,
+        np.arange(0, len(source)),
+        source,
+    )
+    return np.nan_to_num(target)
+
+
+def round_f0(f0: np.ndarray, decimals: int = 1) -> np.ndarray:
+    return np.round(f0, decimals)
+
+
+def pad_f0(f0: np.ndarray, p_len: int) -> np.ndarray:
+    """Pads with unvoiced frames on both sides up to p_len, like the extractors without padding of their own need."""
+    pad_size = (p_len - len(f0) + 1) // 2
+    if pad_size > 0 or p_len - len(f0) - pad_size > 0:
+        f0 = np.pad(f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant")
+    return f0
+
+
+def f0_to_coarse(f0: np.ndarray, f0_min: float = f0_min, f0_max: float = f0_max) -> np.ndarray:
+    """Quantizes f0 to the 1-255 mel scale bins used for the pitch embedding, unvoiced frames get 1."""
+    f0_mel_min = 1127 * np.log(1 + f0_min / 700)
+    f0_mel_max = 1127 * np.log(1 + f0_max / 700)
+    f0_mel = 1127 * np.log(1 + np.asarray(f0) / 700)
+    voiced = f0_mel > 0
+    f0_mel[voiced] = (f0_mel[voiced] - f0_mel_min) * 254 / (f0_mel_max - f0_mel_min) + 1
+    return np.rint(np.clip(f0_mel, 1, 255)).astype(int)
+
+
+def _interpolate_f0_loop(f0):
+    """The previous per-frame implementation, only kept for benchmark() and tests/test_f0_processing.py."""
+    data = np.reshape(np.array(f0), (f0.size, 1))
+    vuv_vector = np.zeros((data.size, 1), dtype=np.float32)
+    vuv_vector[data > 0.0] = 1.0
+    ip_data = data
+    frame_number = data.size
+    last_value = 0.0
+    for i in range(frame_number):
+        if data[i] <= 0.0:
+            j = i + 1
+            for j in range(i + 1, frame_number):
+                if data[j] > 0.0:
+                    break
+            if j < frame_number - 1:
+                if last_value > 0.0:
+                    step = (data[j] - data[i - 1]) / float(j - i)
+                    for k in range(i, j):
+                        ip_data[k] = data[i - 1] + step * (k - i + 1)
+                else:
+                    for k in range(i, j):
+                        ip_data[k] = data[j]
+            else:
+                for k in range(i, frame_number):
+                    ip_data[k] = last_value
+        else:
+            last_value = data[i]
+    return ip_data[:, 0], vuv_vector[:, 0]
+
+
+def benchmark(minutes=10, frames_per_second=100):
+    """
+    Times interpolate_f0 against the previous implementation on a track with voiced phrases and unvoiced pauses.
+    :return: (previous seconds, current seconds)
+    """
+    rng = np.random.default_rng(0)
+    frames = minutes * 60 * frames_per_second
+    f0 = rng.uniform(80, 400, frames)
+    start = 0
+    while start < frames:  # Alternate 0.5-3s phrases with 0.1-5s pauses, and end on a pause
+        start += rng.integers(frames_per_second // 2, 3 * frames_per_second)
+        length = rng.integers(frames_per_second // 10, 5 * frames_per_second)
+        f0[start:start + length] = 0
+        start += length
+    f0[-frames_per_second:] = 0
+    timer = time.perf_counter()
+    _interpolate_f0_loop(f0)
+    loop_time = time.perf_counter() - timer
+    timer = time.perf_counter()
+    interpolate_f0(f0)
+    return loop_time, time.perf_counter() - timer
+
+
+if __name__ == '__main__':
+    _loop_time, _time = benchmark()
+    print(f'interpolate_f0 on 10 minutes: previous {_loop_time:.2f}s, now {_time * 1000:.2f}ms')
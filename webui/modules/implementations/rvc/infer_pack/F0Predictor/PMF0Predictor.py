@@ -1,7 +1,9 @@
-from infer_pack.modules.F0Predictor.F0Predictor import F0Predictor
+from webui.modules.implementations.rvc.infer_pack.F0Predictor.F0Predictor import F0Predictor
 import parselmouth
 import numpy as np
 
+from webui.modules.implementations.rvc import f0_processing
+
 
 class PMF0Predictor(F0Predictor):
     def __init__(self, hop_length=512, f0_min=50, f0_max=1100, sampling_rate=44100):
@@ -14,39 +16,7 @@ class PMF0Predictor(F0Predictor):
         """
         对F0进行插值处理
         """
-
-        data = np.reshape(f0, (f0.size, 1))
-
-        vuv_vector = np.zeros((data.size, 1), dtype=np.float32)
-        vuv_vector[data > 0.0] = 1.0
-        vuv_vector[data <= 0.0] = 0.0
-
-        ip_data = data
-
-        frame_number = data.size
-        last_value = 0.0
-        for i in range(frame_number):
-            if data[i] <= 0.0:
-                j = i + 1
-                for j in range(i + 1, frame_number):
-                    if data[j] > 0.0:
-                        break
-                if j < frame_number - 1:
-                    if last_value > 0.0:
-                        step = (data[j] - data[i - 1]) / float(j - i)
-                        for k in range(i, j):
-                            ip_data[k] = data[i - 1] + step * (k - i + 1)
-                    else:
-                        for k in range(i, j):
-                            ip_data[k] = data[j]
-                else:
-                    for k in range(i, frame_number):
-                        ip_data[k] = last_value
-            else:
-                ip_data[i] = data[i]  # 这里可能存在一个没有必要的拷贝
-                last_value = data[i]
-
-        return ip_data[:, 0], vuv_vector[:, 0]
+        return f0_processing.interpolate_f0(f0)
 
     def compute_f0(self, wav, p_len=None):
         x = wav
@@ -66,9 +36,7 @@ class PMF0Predictor(F0Predictor):
             .selected_array["frequency"]
         )
 
-        pad_size = (p_len - len(f0) + 1) // 2
-        if pad_size > 0 or p_len - len(f0) - pad_size > 0:
-            f0 = np.pad(f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant")
+        f0 = f0_processing.pad_f0(f0, p_len)
         f0, uv = self.interpolate_f0(f0)
         return f0
 
@@ -90,8 +58,6 @@ class PMF0Predictor(F0Predictor):
             .selected_array["frequency"]
         )
 
-        pad_size = (p_len - len(f0) + 1) // 2
-        if pad_size > 0 or p_len - len(f0) - pad_size > 0:
-            f0 = np.pad(f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant")
+        f0 = f0_processing.pad_f0(f0, p_len)
         f0, uv = self.interpolate_f0(f0)
         return f0, uv
@@ -325,48 +325,29 @@ class SineGen(torch.nn.Module):
         output uv: tensor(batchsize=1, length, 1)
         """
         with torch.no_grad():
-            f0 = f0[:, None].transpose(1, 2)
-            f0_buf = torch.zeros(f0.shape[0], f0.shape[1], self.dim, device=f0.device)
-            # fundamental component
-            f0_buf[:, :, 0] = f0[:, :, 0]
-            for idx in np.arange(self.harmonic_num):
-                f0_buf[:, :, idx + 1] = f0_buf[:, :, 0] * (
-                    idx + 2
-                )  # idx + 2: the (idx+1)-th overtone, (idx+2)-th harmonic
-            rad_values = (f0_buf / self.sampling_rate) % 1  ###%1意味着n_har的乘积无法后处理优化
-            rand_ini = torch.rand(
-                f0_buf.shape[0], f0_buf.shape[2], device=f0_buf.device
-            )
+            upp = int(upp)
+            batch, frames = f0.shape
+            # All harmonics at once, (batch, frames, dim)
+            f0_buf = f0[:, :, None] * torch.arange(1, self.dim + 1, device=f0.device, dtype=f0.dtype)
+            rad_values = (f0_buf / self.sampling_rate) % 1  # Phase increment per sample, in cycles
+            rand_ini = torch.rand(batch, self.dim, device=f0.device)
             rand_ini[:, 0] = 0
             rad_values[:, 0, :] = rad_values[:, 0, :] + rand_ini
-            tmp_over_one = torch.cumsum(rad_values, 1)  # % 1  #####%1意味着后面的cumsum无法再优化
-            tmp_over_one *= upp
-            tmp_over_one = F.interpolate(
-                tmp_over_one.transpose(2, 1),
-                scale_factor=upp,
-                mode="linear",
-                align_corners=True,
-            ).transpose(2, 1)
-            rad_values = F.interpolate(
-                rad_values.transpose(2, 1), scale_factor=upp, mode="nearest"
-            ).transpose(
-                2, 1
-            )  #######
-            tmp_over_one %= 1
-            tmp_over_one_idx = (tmp_over_one[:, 1:, :] - tmp_over_one[:, :-1, :]) < 0
-            cumsum_shift = torch.zeros_like(rad_values)
-            cumsum_shift[:, 1:, :] = tmp_over_one_idx * -1.0
-            sine_waves = torch.sin(
-                torch.cumsum(rad_values + cumsum_shift, dim=1) * 2 * np.pi
-            )
-            sine_waves = sine_waves * self.sine_amp
-            uv = self._f02uv(f0)
-            uv = F.interpolate(
-                uv.transpose(2, 1), scale_factor=upp, mode="nearest"
-            ).transpose(2, 1)
+            # Phase at the start of every frame, accumulated at frame rate in float64 so long clips don't drift.
+            # Only the fractional part matters for the sine, so every sample's phase stays small.
+            frame_phase = torch.cumsum(rad_values.double() * upp, dim=1) % 1
+            frame_phase = torch.cat([torch.zeros_like(frame_phase[:, :1]), frame_phase[:, :-1]], dim=1).float()
+            steps = torch.arange(1, upp + 1, device=f0.device, dtype=torch.float32)
+            # (batch, frames, upp, dim), sample i of frame t has phase frame_phase[t] + (i + 1) * rad_values[t]
+            sine_waves = torch.addcmul(frame_phase[:, :, None, :], rad_values[:, :, None, :], steps[None, None, :, None])
+            sine_waves.mul_(2 * np.pi).sin_().mul_(self.sine_amp)
+            uv = self._f02uv(f0)[:, :, None, None]
             noise_amp = uv * self.noise_std + (1 - uv) * self.sine_amp / 3
-            noise = noise_amp * torch.randn_like(sine_waves)
-            sine_waves = sine_waves * uv + noise
+            noise = torch.randn_like(sine_waves).mul_(noise_amp)
+            sine_waves.mul_(uv).add_(noise)
+            sine_waves = sine_waves.reshape(batch, frames * upp, self.dim)
+            noise = noise.reshape(batch, frames * upp, self.dim)
+            uv = uv.expand(-1, -1, upp, -1).reshape(batch, frames * upp, 1)
         return sine_waves, uv, noise
 
 
@@ -612,7 +593,8 @@ class SynthesizerTrnMs256NSFsid(nn.Module):
     def remove_weight_norm(self):
         self.dec.remove_weight_norm()
         self.flow.remove_weight_norm()
-        self.enc_q.remove_weight_norm()
+        if hasattr(self, "enc_q"):  # Deleted for inference
+            self.enc_q.remove_weight_norm()
 
     def forward(
         self, phone, phone_lengths, pitch, pitchf, y, y_lengths, ds
@@ -723,7 +705,8 @@ class SynthesizerTrnMs768NSFsid(nn.Module):
     def remove_weight_norm(self):
         self.dec.remove_weight_norm()
         self.flow.remove_weight_norm()
-        self.enc_q.remove_weight_norm()
+        if hasattr(self, "enc_q"):  # Deleted for inference
+            self.enc_q.remove_weight_norm()
 
     def forward(
         self, phone, phone_lengths, pitch, pitchf, y, y_lengths, ds
@@ -831,7 +814,8 @@ class SynthesizerTrnMs256NSFsid_nono(nn.Module):
     def remove_weight_norm(self):
         self.dec.remove_weight_norm()
         self.flow.remove_weight_norm()
-        self.enc_q.remove_weight_norm()
+        if hasattr(self, "enc_q"):  # Deleted for inference
+            self.enc_q.remove_weight_norm()
 
     def forward(self, phone, phone_lengths, y, y_lengths, ds):  # 这里ds是id，[bs,1]
         g = self.emb_g(ds).unsqueeze(-1)  # [b, 256, 1]##1是t，广播的
@@ -933,7 +917,8 @@ class SynthesizerTrnMs768NSFsid_nono(nn.Module):
     def remove_weight_norm(self):
         self.dec.remove_weight_norm()
         self.flow.remove_weight_norm()
-        self.enc_q.remove_weight_norm()
+        if hasattr(self, "enc_q"):  # Deleted for inference
+            self.enc_q.remove_weight_norm()
 
     def forward(self, phone, phone_lengths, y, y_lengths, ds):  # 这里ds是id，[bs,1]
         g = self.emb_g(ds).unsqueeze(-1)  # [b, 256, 1]##1是t，广播的
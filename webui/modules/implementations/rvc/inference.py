@@ -0,0 +1,140 @@
+import hashlib
+import os
+import time
+
+import torch
+from torch import nn
+
+from webui.modules.implementations.rvc.infer_pack import models
+
+cache_dir = os.path.join('data', 'cache', 'rvc')
+graph_modes = ['none', 'torchscript', 'compile']
+
+synthesizers = {
+    ('v1', 1): models.SynthesizerTrnMs256NSFsid,
+    ('v1', 0): models.SynthesizerTrnMs256NSFsid_nono,
+    ('v2', 1): models.SynthesizerTrnMs768NSFsid,
+    ('v2', 0): models.SynthesizerTrnMs768NSFsid_nono,
+}
+
+
+def prepare_for_inference(net_g):
+    """
+    Folds weight norm into the weights and drops the parts that are only used for training. Works in place.
+    Call after loading the state dict, the checkpoints store the weight norm parameters.
+    """
+    if hasattr(net_g, 'enc_q'):  # Posterior encoder, only used for training
+        del net_g.enc_q
+    net_g.remove_weight_norm()
+    for module in list(net_g.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, nn.Dropout):
+                setattr(module, name, nn.Identity())
+    return net_g.eval().requires_grad_(False)
+
+
+def _example_inputs(dec, length, device, dtype):
+    x = torch.randn(1, dec.conv_pre.in_channels, length, device=device, dtype=dtype)
+    g = torch.randn(1, dec.cond.in_channels, 1, device=device, dtype=dtype) if hasattr(dec, 'cond') else None
+    if isinstance(dec, models.GeneratorNSF):
+        f0 = torch.rand(1, length, device=device) * 200 + 100  # The pipeline passes f0 in float32
+        return x, f0, g
+    return x, g
+
+
+def _artifact_path(model_path, mode, device, dtype):
+    h = hashlib.sha1()
+    stat = os.stat(model_path)
+    # The source of the models is part of the key, so changes to the decoder don't load an outdated graph
+    for part in [os.path.abspath(model_path), stat.st_size, stat.st_mtime, os.stat(models.__file__).st_mtime,
+                 mode, str(device), str(dtype), torch.__version__]:
+        h.update(str(part).encode())
+    return os.path.join(cache_dir, f'{os.path.splitext(os.path.basename(model_path))[0]}_{h.hexdigest()[:16]}.pt')
+
+
+def _same_output(a, b, inputs, tolerance) -> bool:
+    torch.manual_seed(0)  # The decoder adds noise, same seed gives the same noise
+    out_a = a(*inputs)
+    torch.manual_seed(0)
+    out_b = b(*inputs)
+    return out_a.shape == out_b.shape and (out_a.float() - out_b.float()).abs().max().item() < tolerance
+
+
+def freeze_decoder(net_g, model_path, mode='torchscript'):
+    """
+    Replaces the decoder with a TorchScript graph cached per model file, or with a torch.compile'd decoder.
+    The graph is checked against the eager decoder on a different length than it was traced with, the eager decoder is kept if they differ.
+    :param mode: One of graph_modes.
+    """
+    assert mode in graph_modes, f'Unknown graph mode {mode}'
+    if mode == 'none':
+        return net_g
+    if mode == 'compile':
+        os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(cache_dir, 'inductor'))
+        net_g.dec = torch.compile(net_g.dec, dynamic=True)
+        return net_g
+    param = next(net_g.dec.parameters())
+    device, dtype = param.device, param.dtype
+    path = _artifact_path(model_path, mode, device, dtype)
+    with torch.no_grad():
+        if os.path.isfile(path):
+            net_g.dec = torch.jit.load(path, map_location=device)
+            return net_g
+        traced = torch.jit.trace(net_g.dec, _example_inputs(net_g.dec, 100, device, dtype), check_trace=False)
+        if not _same_output(net_g.dec, traced, _example_inputs(net_g.dec, 137, device, dtype),
+                            1e-2 if dtype == torch.half else 1e-4):
+            print('Traced rvc decoder differs from the eager decoder, not using it.')
+            return net_g
+    os.makedirs(cache_dir, exist_ok=True)
+    torch.jit.save(traced, path)
+    net_g.dec = traced
+    return net_g
+
+
+def _default_synthesizer():
+    # Shape of a v2 40k model
+    return models.SynthesizerTrnMs768NSFsid(
+        1025, 32, 192, 192, 768, 2, 6, 3, 0, "1", [3, 7, 11], [[1, 3, 5], [1, 3, 5], [1, 3, 5]], [10, 10, 2, 2],
+        512, [16, 16, 4, 4], 109, 256, 40000, is_half=False
+    )
+
+
+def benchmark(model_path=None, seconds=(1, 5), repeats=3):
+    """
+    Cpu latency of the decoder with weight norm, with weight norm folded, and as TorchScript.
+    :param model_path: An rvc model, random weights with the shape of a v2 40k model are used if not set.
+    :return: {variant: {seconds of audio: ms}}
+    """
+    torch.set_grad_enabled(False)
+    if model_path is None:
+        net_g = _default_synthesizer()
+    else:
+        cpt = torch.load(model_path, map_location='cpu')
+        cpt['config'][-3] = cpt['weight']['emb_g.weight'].shape[0]
+        net_g = synthesizers[(cpt.get('version', 'v1'), cpt.get('f0', 1))](*cpt['config'], is_half=False)
+        net_g.load_state_dict(cpt['weight'], strict=False)
+    net_g.eval()
+    frames_per_second = 100  # Hubert features are upsampled to 100 frames per second
+    inputs = {s: _example_inputs(net_g.dec, s * frames_per_second, 'cpu', torch.float32) for s in seconds}
+
+    def time_dec(dec):
+        result = {}
+        for s, x in inputs.items():
+            dec(*x)  # Warmup
+            start = time.perf_counter()
+            for _ in range(repeats):
+                dec(*x)
+            result[s] = (time.perf_counter() - start) * 1000 / repeats
+        return result
+
+    results = {'weight norm': time_dec(net_g.dec)}
+    prepare_for_inference(net_g)
+    results['folded'] = time_dec(net_g.dec)
+    traced = torch.jit.trace(net_g.dec, inputs[seconds[0]], check_trace=False)
+    results['torchscript'] = time_dec(traced)
+    return results
+
+
+if __name__ == '__main__':
+    for _variant, _times in benchmark().items():
+        print(_variant + ': ' + ', '.join(f'{s}s audio {ms:.0f} ms' for s, ms in _times.items()))
@@ -0,0 +1,228 @@
+import time
+
+import numpy as np
+from scipy import signal
+
+from webui.modules.implementations.rvc import crepe_engine, f0_processing
+from webui.modules.implementations.rvc.infer_pack.F0Predictor.PMF0Predictor import PMF0Predictor
+
+cost_tiers = {1: 'fast', 2: 'medium', 3: 'slow'}
+
+
+class PitchExtractor:
+    """
+    Extracts f0 at a given hop. Unvoiced frames are 0.
+    cost is a speed tier from cost_tiers, gpu is whether it runs on the gpu when one is available.
+    """
+    cost = 1
+    gpu = False
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def extract(self, x: np.ndarray, sr: int, hop: int, p_len: int, f0_min: float, f0_max: float, **kwargs) -> np.ndarray:
+        """
+        :param x: Mono audio.
+        :param p_len: Number of frames to return.
+        :param kwargs: Options used by some extractors, like filter_radius and crepe_hop_length. Others ignore them.
+        :return: f0 of shape (p_len,).
+        """
+        raise NotImplementedError
+
+
+class F0PredictorExtractor(PitchExtractor):
+    """Wraps an F0Predictor. The predictors fill unvoiced frames, the uv mask puts them back to 0."""
+    def __init__(self, name, predictor, cost=1, median_filter=False, median_filter_radius=None):
+        """
+        :param median_filter: Always smooth with a median filter of 3.
+        :param median_filter_radius: Smooth with a median filter of 3 when filter_radius is larger than this.
+        """
+        super().__init__(name)
+        self.predictor = predictor
+        self.cost = cost
+        self.median_filter = median_filter
+        self.median_filter_radius = median_filter_radius
+
+    def extract(self, x, sr, hop, p_len, f0_min, f0_max, filter_radius=3, **kwargs):
+        predictor = self.predictor(hop_length=hop, f0_min=f0_min, f0_max=f0_max, sampling_rate=sr)
+        f0, uv = predictor.compute_f0_uv(x, p_len)
+        return self.smooth(f0 * uv, filter_radius)
+
+    def smooth(self, f0, filter_radius):
+        if self.median_filter or (self.median_filter_radius is not None and filter_radius > self.median_filter_radius):
+            f0 = signal.medfilt(f0, 3)
+        return f0
+
+
+class PyworldExtractor(F0PredictorExtractor):
+    """
+    pyworld dio or harvest refined with stonemask, one frame per hop. Unlike the F0Predictor classes the result isn't
+    resized or rounded, so it stays the same as the previous VC.get_f0.
+    """
+    def __init__(self, name, method, **kwargs):
+        super().__init__(name, None, **kwargs)
+        self.method = method
+
+    def extract(self, x, sr, hop, p_len, f0_min, f0_max, filter_radius=3, **kwargs):
+        import pyworld
+        x = x.astype(np.double)
+        f0, t = getattr(pyworld, self.method)(x, fs=sr, f0_floor=f0_min, f0_ceil=f0_max, frame_period=1000 * hop / sr)
+        f0 = self.smooth(pyworld.stonemask(x, f0, t, sr), filter_radius)
+        return np.pad(f0[:p_len], (0, max(p_len - len(f0), 0)))  # pyworld returns a frame more than p_len
+
+
+class CrepeExtractor(PitchExtractor):
+    cost = 3
+    gpu = True
+
+    def __init__(self, name, model='full'):
+        """:param model: 'full' or 'tiny'."""
+        super().__init__(name)
+        self.model = model
+        if model == 'tiny':
+            self.cost = 2
+
+    def extract(self, x, sr, hop, p_len, f0_min, f0_max, crepe_hop_length=128, device=None, **kwargs):
+        """:param device: The device to run on, cuda when available if not set."""
+        pitch = crepe_engine.predict(x, sr, crepe_hop_length, f0_min, f0_max, self.model, device)
+        p_len = p_len or len(x) // crepe_hop_length
+        # Resize the pitch for final f0
+        return f0_processing.resize_f0(pitch, p_len)
+
+
+class YinExtractor(PitchExtractor):
+    """
+    YIN (de Cheveigné and Kawahara, 2002) in numpy, on the cpu. Frames are processed in blocks so memory stays bounded.
+    """
+    cost = 1
+
+    def __init__(self, name, threshold=0.1, block_frames=2048):
+        """
+        :param threshold: Absolute threshold on the cumulative mean normalized difference, lower is stricter.
+        :param block_frames: Frames per block.
+        """
+        super().__init__(name)
+        self.threshold = threshold
+        self.block_frames = block_frames
+
+    def extract(self, x, sr, hop, p_len, f0_min, f0_max, **kwargs):
+        x = np.asarray(x, dtype=np.float32).reshape(-1)
+        tau_min = max(int(sr // f0_max), 2)
+        tau_max = int(np.ceil(sr / f0_min))
+        window = tau_max  # Integration window, long enough for the lowest pitch
+        frame_length = window + tau_max + 1
+        n_fft = 1 << int(np.ceil(np.log2(frame_length + window)))
+        padded = np.pad(x, (frame_length // 2, frame_length + p_len * hop))
+        f0 = np.zeros(p_len)
+        for start in range(0, p_len, self.block_frames):
+            count = min(self.block_frames, p_len - start)
+            frames = np.lib.stride_tricks.sliding_window_view(
+                padded[start * hop: (start + count - 1) * hop + frame_length], frame_length
+            )[::hop]
+            f0[start:start + count] = self._block(frames, window, tau_min, tau_max, n_fft, sr)
+        return f0
+
+    def _block(self, frames, window, tau_min, tau_max, n_fft, sr):
+        # Difference function d(tau) = e(0) + e(tau) - 2 r(tau), with the autocorrelation r through the fft
+        spectrum = np.fft.rfft(frames, n_fft)
+        r = np.fft.irfft(spectrum * np.conj(np.fft.rfft(frames[:, :window], n_fft)), n_fft)[:, :tau_max + 1]
+        energy = np.concatenate([np.zeros((len(frames), 1)), np.cumsum(frames.astype(np.float64) ** 2, axis=1)], axis=1)
+        taus = np.arange(tau_max + 1)
+        shifted_energy = energy[:, taus + window] - energy[:, taus]
+        diff = np.maximum(shifted_energy[:, :1] + shifted_energy - 2 * r, 0)
+        # Cumulative mean normalized difference
+        cumulative = np.cumsum(diff[:, 1:], axis=1)
+        cmnd = np.ones_like(diff)
+        cmnd[:, 1:] = diff[:, 1:] * taus[1:] / np.maximum(cumulative, 1e-12)
+        # First tau under the threshold, followed down to its local minimum
+        candidates = cmnd[:, tau_min:tau_max]
+        is_min = (candidates < self.threshold) & (candidates <= cmnd[:, tau_min + 1:tau_max + 1])
+        voiced = is_min.any(axis=1) & (shifted_energy[:, 0] > 1e-8)
+        tau = np.argmax(is_min, axis=1) + tau_min
+        # Parabolic interpolation around the minimum
+        rows = np.arange(len(frames))
+        a, b, c = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, np.minimum(tau + 1, tau_max)]
+        denominator = a - 2 * b + c
+        shift = np.where(np.abs(denominator) > 1e-12, 0.5 * (a - c) / np.where(denominator == 0, 1, denominator), 0)
+        return np.where(voiced, sr / (tau + np.clip(shift, -1, 1)), 0)
+
+
+extractors: dict[str, PitchExtractor] = {}
+
+
+def register(extractor: PitchExtractor) -> PitchExtractor:
+    extractors[extractor.name] = extractor
+    return extractor
+
+
+register(PyworldExtractor('dio', 'dio', cost=1, median_filter=True))
+register(F0PredictorExtractor('pm', PMF0Predictor, cost=1))
+register(YinExtractor('yin'))
+register(PyworldExtractor('harvest', 'harvest', cost=3, median_filter_radius=2))
+register(PyworldExtractor('pyworld harvest', 'harvest', cost=3, median_filter=True))
+register(CrepeExtractor('torchcrepe'))
+register(CrepeExtractor('torchcrepe tiny', 'tiny'))
+
+
+def choices() -> list[str]:
+    return list(extractors.keys())
+
+
+def describe() -> str:
+    """The registered extractors by speed tier, for the ui."""
+    tiers = []
+    for cost, tier in cost_tiers.items():
+        names = [f'{e.name}{" (gpu)" if e.gpu else ""}' for e in extractors.values() if e.cost == cost]
+        if names:
+            tiers.append(f'{tier}: {", ".join(names)}')
+    return '. '.join(tiers)
+
+
+def extract(name: str, x: np.ndarray, sr: int, hop: int, p_len: int, f0_min: float = f0_processing.f0_min,
+            f0_max: float = f0_processing.f0_max, **kwargs) -> np.ndarray:
+    if name not in extractors:
+        raise ValueError(f'Unknown pitch extraction method "{name}", registered methods are: {", ".join(choices())}')
+    return extractors[name].extract(x, sr, hop, p_len, f0_min, f0_max, **kwargs)
+
+
+def vibrato_tone(seconds, sr, hop):
+    """
+    A vibrato tone (5 harmonics) around 220 Hz with a pause every 4 seconds.
+    :return: (audio, true f0 per hop)
+    """
+    t = np.arange(seconds * sr) / sr
+    true_f0 = 220 * 2 ** (np.sin(2 * np.pi * 0.5 * t) / 6)
+    phase = 2 * np.pi * np.cumsum(true_f0) / sr
+    x = sum(np.sin(k * phase) / k for k in range(1, 6)) * 0.3
+    x[(t % 4) > 3] = 0
+    return x, true_f0[::hop][:len(x) // hop]
+
+
+def cents_error(f0, reference) -> float:
+    """Median absolute error in cents, on the frames where both are voiced."""
+    f0 = np.asarray(f0)[:len(reference)]
+    reference = reference[:len(f0)]
+    voiced = (f0 > 0) & (reference > 0)
+    if not voiced.any():
+        return float('inf')
+    return float(np.median(np.abs(1200 * np.log2(f0[voiced] / reference[voiced]))))
+
+
+def benchmark(seconds=30, sr=16000, hop=160, names=None):
+    """
+    Times the extractors on vibrato_tone, and measures their median error in cents on voiced frames.
+    :return: {name: (seconds, median cents error)}
+    """
+    x, reference = vibrato_tone(seconds, sr, hop)
+    p_len = len(x) // hop
+    results = {}
+    for name in names or choices():
+        start = time.perf_counter()
+        f0 = extract(name, x, sr, hop, p_len)
+        results[name] = (time.perf_counter() - start, cents_error(f0, reference))
+    return results
+
+
+if __name__ == '__main__':
+    for _name, (_elapsed, _cents) in benchmark(names=['dio', 'pm', 'yin', 'harvest']).items():
+        print(f'{_name}: {_elapsed:.2f}s for 30s of audio, median error {_cents:.1f} cents')
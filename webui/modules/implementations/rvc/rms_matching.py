@@ -0,0 +1,244 @@
+import time
+
+import numpy as np
+
+frame_seconds = 0.5  # Distance between envelope points, frames are twice as long and centered on them
+min_rms = 1e-6
+ramp_block = 64  # Segments ramped at once, bounds the temporary memory of apply_gain
+
+
+def block_energy(x: np.ndarray, hop: int) -> np.ndarray:
+    """Sum of squares of every hop samples, the last block can be partial."""
+    x = np.asarray(x)
+    full = len(x) // hop
+    blocks = x[:full * hop].reshape(full, hop)
+    energy = np.einsum('ij,ij->i', blocks, blocks, dtype=np.float64)  # No squared copy of x
+    if len(x) > full * hop:
+        rest = x[full * hop:]
+        energy = np.append(energy, np.dot(rest, rest))
+    return energy
+
+
+def envelope(energy: np.ndarray, hop: int, frames: int) -> np.ndarray:
+    """
+    RMS of frames of 2 * hop centered on every hop, zero padded, from block_energy. Same as librosa.feature.rms with
+    frame_length=2 * hop, hop_length=hop.
+    :param frames: Number of frames, the blocks up to frames (included) are used.
+    """
+    padded = np.zeros(frames + 1)
+    used = energy[:frames]
+    padded[1:len(used) + 1] = used
+    return np.sqrt((padded[:-1] + padded[1:]) / (2 * hop))
+
+
+def gain(rms_source: np.ndarray, rms_target: np.ndarray, rate: float) -> np.ndarray:
+    """The gain which mixes the target's loudness with the source's, rate is the share of the target."""
+    if len(rms_source) < len(rms_target):  # Lengths differ by a frame at most, after resampling
+        rms_source = np.pad(rms_source, (0, len(rms_target) - len(rms_source)), mode='edge')
+    return rms_source[:len(rms_target)] ** (1 - rate) * np.maximum(rms_target, min_rms) ** (rate - 1)
+
+
+def apply_gain(y: np.ndarray, gains: np.ndarray, hop: int, offset: int = 0) -> np.ndarray:
+    """
+    Multiplies y in place with a gain which goes linearly from gains[k] at sample (k - offset) * hop to gains[k + 1], and
+    stays at the last gain after it.
+    :param offset: Index of the gain at the start of y.
+    """
+    position = 0
+    for start in range(offset, len(gains) - 1, ramp_block):
+        g = gains[start:min(start + ramp_block, len(gains) - 1) + 1]
+        segments = min(len(g) - 1, (len(y) - position) // hop)
+        if segments == 0:
+            break
+        ramp = np.arange(hop) / hop
+        view = y[position:position + segments * hop].reshape(segments, hop)
+        view *= g[:segments, None] + (g[1:segments + 1] - g[:segments])[:, None] * ramp
+        position += segments * hop
+    if position < len(y):
+        last = min(offset + position // hop, len(gains) - 1)
+        rest = y[position:]
+        if last + 1 < len(gains):  # Part of a segment
+            rest *= gains[last] + (gains[last + 1] - gains[last]) * np.arange(len(rest)) / hop
+        else:
+            rest *= gains[last]
+    return y
+
+
+def match_rms(source: np.ndarray, sr_source: int, target: np.ndarray, sr_target: int, rate: float) -> np.ndarray:
+    """
+    Mixes the loudness envelope of target with the one of source, in place. rate is the share of target, 1 keeps target as is.
+    Replaces vc_infer_pipeline.change_rms. That one stretched both envelopes to the length of target, now the envelope points
+    stay on their times and the gain is ramped between them.
+    """
+    hop_source, hop_target = int(sr_source * frame_seconds), int(sr_target * frame_seconds)
+    rms_source = envelope(block_energy(source, hop_source), hop_source, 1 + len(source) // hop_source)
+    rms_target = envelope(block_energy(target, hop_target), hop_target, 1 + len(target) // hop_target)
+    return apply_gain(target, gain(rms_source, rms_target, rate), hop_target)
+
+
+class RmsMatcher:
+    """
+    match_rms on audio which arrives in chunks. process() returns the target samples whose gain is known, which lags up to
+    two frames (a second) behind, flush() returns the rest at the end. The output equals match_rms on the whole audio.
+    """
+    def __init__(self, sr_source: int, sr_target: int, rate: float):
+        self.hop_source, self.hop_target = int(sr_source * frame_seconds), int(sr_target * frame_seconds)
+        self.rate = rate
+        self.source_rest = np.zeros(0)
+        self.source_energy = []
+        self.source_length = 0
+        self.target_pending = np.zeros(0, dtype=np.float32)  # Starts at the first segment without its gain
+        self.target_energy = []
+        self.target_length = 0
+        self.emitted_segments = 0
+
+    def _blocks(self, rest, x, hop, energy):
+        rest = np.concatenate([rest, x])
+        full = len(rest) // hop * hop
+        energy.extend(block_energy(rest[:full], hop))
+        return rest[full:]
+
+    def _gains(self, first, count, final=False):
+        """Gains of frames first to first + count - 1."""
+        def frames_of(energy, rest, hop, length):
+            blocks = np.array(energy + ([np.dot(rest, rest)] if final and len(rest) else []))
+            total = 1 + length // hop if final else len(energy)
+            return envelope(blocks, hop, total)
+        rms_source = frames_of(self.source_energy, self.source_rest, self.hop_source, self.source_length)
+        rms_target = frames_of(self.target_energy, self.target_pending[len(self.target_pending) // self.hop_target
+                                                                       * self.hop_target:], self.hop_target,
+                               self.target_length)
+        gains = gain(rms_source, rms_target, self.rate) if final else gain(rms_source[:len(rms_target)], rms_target, self.rate)
+        return gains[first:first + count]
+
+    def process(self, source_chunk: np.ndarray, target_chunk: np.ndarray) -> np.ndarray:
+        self.source_length += len(source_chunk)
+        self.target_length += len(target_chunk)
+        self.source_rest = self._blocks(self.source_rest, source_chunk, self.hop_source, self.source_energy)
+        self.target_pending = np.concatenate([self.target_pending, target_chunk])
+        complete = self.emitted_segments + len(self.target_pending) // self.hop_target
+        self.target_energy.extend(block_energy(
+            self.target_pending[(len(self.target_energy) - self.emitted_segments) * self.hop_target:
+                                (complete - self.emitted_segments) * self.hop_target], self.hop_target))
+        # Segment k needs the gains of frames k and k + 1, which need the blocks up to k + 1
+        ready = min(len(self.source_energy), len(self.target_energy)) - 1 - self.emitted_segments
+        if ready <= 0:
+            return np.zeros(0, dtype=self.target_pending.dtype)
+        gains = self._gains(self.emitted_segments, ready + 1)
+        out = apply_gain(self.target_pending[:ready * self.hop_target], gains, self.hop_target)
+        self.target_pending = self.target_pending[ready * self.hop_target:]
+        self.emitted_segments += ready
+        return out
+
+    def flush(self) -> np.ndarray:
+        gains = self._gains(self.emitted_segments, len(self.target_pending) // self.hop_target + 2, final=True)
+        out = apply_gain(self.target_pending, gains, self.hop_target)
+        self.target_pending = np.zeros(0, dtype=out.dtype)
+        return out
+
+
+def _change_rms_reference(data1, sr1, data2, sr2, rate):
+    """The previous vc_infer_pipeline.change_rms, only kept for check() and benchmark()."""
+    import librosa
+    import torch
+    import torch.nn.functional as F
+    rms1 = librosa.feature.rms(y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2)
+    rms2 = librosa.feature.rms(y=data2, frame_length=sr2 // 2 * 2, hop_length=sr2 // 2)
+    rms1 = torch.from_numpy(rms1)
+    rms1 = F.interpolate(rms1.unsqueeze(0), size=data2.shape[0], mode="linear").squeeze()
+    rms2 = torch.from_numpy(rms2)
+    rms2 = F.interpolate(rms2.unsqueeze(0), size=data2.shape[0], mode="linear").squeeze()
+    rms2 = torch.max(rms2, torch.zeros_like(rms2) + 1e-6)
+    data2 *= (torch.pow(rms1, torch.tensor(1 - rate)) * torch.pow(rms2, torch.tensor(rate - 1))).numpy()
+    return data2
+
+
+def _test_signals(seconds, sr_source=16000, sr_target=40000):
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * sr_source) / sr_source
+    source = (np.sin(2 * np.pi * 220 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.3 * t))).astype(np.float32)
+    target = (rng.standard_normal(int(seconds * sr_target)) * 0.1).astype(np.float32)
+    return source, target
+
+
+def check(seconds=7.3, rate=0.25):
+    """
+    The envelope matches librosa, chunked processing matches match_rms, and the gain stays close to the previous
+    change_rms away from the edges (the envelope points moved by less than a frame).
+    """
+    import librosa
+    source, target = _test_signals(seconds)
+    sr_source, sr_target = 16000, 40000
+    hop = sr_target // 2
+    expected = librosa.feature.rms(y=target, frame_length=hop * 2, hop_length=hop)[0]
+    result = envelope(block_energy(target, hop), hop, 1 + len(target) // hop)
+    assert np.allclose(result, expected, rtol=1e-4), f'Envelope differs from librosa: {result} != {expected}'
+
+    batch = match_rms(source, sr_source, target.copy(), sr_target, rate)
+    matcher = RmsMatcher(sr_source, sr_target, rate)
+    rng = np.random.default_rng(1)
+    chunks = []
+    source_position = target_position = 0
+    while source_position < len(source):
+        size = int(rng.integers(1000, 30000))
+        chunks.append(matcher.process(source[source_position:source_position + size],
+                                      target[target_position:target_position + size * 5 // 2].copy()))
+        source_position += size
+        target_position += size * 5 // 2
+    chunks.append(matcher.flush())
+    streamed = np.concatenate(chunks)
+    assert len(streamed) == len(batch), f'Streamed {len(streamed)} samples instead of {len(batch)}'
+    assert np.allclose(streamed, batch, atol=1e-6), f'Streamed differs by {np.abs(streamed - batch).max()}'
+
+    # The loudness should follow source ** (1 - rate) * target ** rate, at least as closely as before
+    previous = _change_rms_reference(source, sr_source, target.copy(), sr_target, rate)
+    rms_source = librosa.feature.rms(y=source, frame_length=sr_source, hop_length=sr_source // 2)[0]
+    rms_source = np.pad(rms_source, (0, max(len(expected) - len(rms_source), 0)), mode='edge')[:len(expected)]
+    desired = rms_source ** (1 - rate) * expected ** rate
+    inner = slice(2, -2)
+
+    def error(y):
+        rms = librosa.feature.rms(y=y, frame_length=hop * 2, hop_length=hop)[0]
+        return np.median(np.abs(np.log(rms[inner] / desired[inner])))
+    assert error(batch) <= error(previous) * 1.05, f'Loudness error {error(batch)}, was {error(previous)}'
+
+
+def _peak_memory_of(func, *args):
+    """Peak rss increase while running func, in a forked process so earlier peaks don't hide it."""
+    import multiprocessing
+    import resource  # Unix only
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+
+    def run():
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        queue.put((elapsed, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024))
+
+    process = context.Process(target=run)
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def benchmark(minutes=5, rate=0.25):
+    """
+    Time and peak memory of change_rms and match_rms on a 16 kHz source and a 40 kHz target. Linux only.
+    :return: {name: (seconds, peak memory increase in bytes)}
+    """
+    import librosa  # noqa, imported before forking so the import isn't measured
+    import torch  # noqa
+    source, target = _test_signals(minutes * 60)
+    return {
+        'change_rms': _peak_memory_of(_change_rms_reference, source, 16000, target, 40000, rate),
+        'match_rms': _peak_memory_of(match_rms, source, 16000, target, 40000, rate),
+    }
+
+
+if __name__ == '__main__':
+    check()
+    for _name, (_elapsed, _memory) in benchmark().items():
+        print(f'{_name}: {_elapsed * 1000:.0f}ms, peak +{_memory / 1024 ** 2:.0f}MB on 5 minutes at 40kHz')
@@ -18,6 +18,8 @@ from fairseq import checkpoint_utils
 
 from hubert.hubert_manager import HuBERTManager
 from webui.modules.implementations.rvc.vc_infer_pipeline import VC
+from webui.modules.implementations.rvc.inference import prepare_for_inference, freeze_decoder
+from webui.modules.implementations.rvc import crepe_engine
 
 from webui.modules.implementations.rvc.infer_pack.models import (
     SynthesizerTrnMs256NSFsid,
@@ -321,6 +323,10 @@ def get_vc(sid):
         net_g = net_g.half()
     else:
         net_g = net_g.float()
+    from webui.args import args
+    prepare_for_inference(net_g)
+    freeze_decoder(net_g, person, args.rvc_graph)
+    crepe_engine.configure(args.rvc_crepe_batch_size, args.rvc_crepe_threads, args.rvc_crepe_decoder)
     vc = VC(tgt_sr, config)
     n_spk = cpt["config"][-3]
     return {"visible": True, "maximum": n_spk, "__type__": "update"}
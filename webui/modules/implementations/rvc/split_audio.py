@@ -1,99 +1,307 @@
-import os.path
+import threading
+import time
 
+import numpy as np
 import torch
 
+from webui.modules.implementations.rvc import stem_cache
 
-def _split(sr, audio):
-    import scipy.io.wavfile
-    import librosa
+backends = ['demucs', 'repet']
+model_name = 'htdemucs_6s'
+repet_sr = 16000
 
-    scipy.io.wavfile.write('speakeraudio.wav', sr, audio.detach().cpu().numpy())
+_models = {}
+_lock = threading.Lock()
 
-    audio, sr = librosa.load('speakeraudio.wav', sr=16000)
 
-    # Code source: Brian McFee
-    # License: ISC
+def _nearest_neighbours(features, k, width, block):
+    """
+    For every frame, its k most similar frames (cosine) which are at least width frames away, computed block by block
+    instead of with a full frame by frame matrix. Like librosa's recurrence matrix, the k + 2 * width most similar frames
+    are candidates, so frames can have less than k neighbours. Of those, the most similar are kept, librosa only does that
+    in affinity mode, the connectivity mode nn_filter uses by default keeps the first ones in time.
+    :return: (frames, k) indices, -1 where there are less than k neighbours.
+    """
+    frames = features.shape[1]
+    normalized = features / np.maximum(np.linalg.norm(features, axis=0, keepdims=True), 1e-12)
+    candidates = min(frames - 1, k + 2 * width)
+    neighbours = np.full((frames, k), -1)
+    for start in range(0, frames, block):
+        rows = np.arange(start, min(start + block, frames))
+        similarity = normalized[:, rows].T @ normalized
+        similarity[np.arange(len(rows)), rows] = -np.inf
+        nearest = np.argpartition(-similarity, candidates - 1, axis=1)[:, :candidates]
+        nearest_similarity = np.take_along_axis(similarity, nearest, axis=1)
+        nearest_similarity[np.abs(nearest - rows[:, None]) < width] = -np.inf
+        order = np.argsort(-nearest_similarity, axis=1, kind='stable')[:, :k]
+        chosen = np.take_along_axis(nearest, order, axis=1)
+        chosen[np.take_along_axis(nearest_similarity, order, axis=1) == -np.inf] = -1
+        neighbours[rows, :chosen.shape[1]] = chosen
+    return neighbours
 
-    ##################
-    # Standard imports
-    import numpy as np
-    import matplotlib.pyplot as plt
 
-    import librosa.display
+def _neighbour_median(spectrogram, neighbours, block_bytes=64 * 1024 ** 2):
+    """Per frequency median over the neighbours of every frame, the frame itself if it has none."""
+    bins, frames = spectrogram.shape
+    k = neighbours.shape[1]
+    result = np.empty_like(spectrogram)
+    block = max(1, block_bytes // (bins * k * spectrogram.itemsize))
+    for start in range(0, frames, block):
+        indices = neighbours[start:start + block]
+        counts = (indices >= 0).sum(axis=1)
+        values = spectrogram[:, np.maximum(indices, 0)]  # (bins, block, k)
+        values[:, indices < 0] = np.inf  # Sorted last
+        values.sort(axis=2)
+        low = np.maximum(counts - 1, 0) // 2
+        high = counts // 2
+        rows = np.arange(len(indices))
+        median = (values[:, rows, low] + values[:, rows, high]) / 2
+        alone = counts == 0
+        median[:, alone] = spectrogram[:, start:start + block][:, alone]
+        result[:, start:start + block] = median
+    return result
 
-    S_full, phase = librosa.magphase(librosa.stft(audio))
 
-    # We'll compare frames using cosine similarity, and aggregate similar frames
-    # by taking their (per-frequency) median value.
-    #
-    # To avoid being biased by local continuity, we constrain similar frames to be
-    # separated by at least 2 seconds.
-    #
-    # This suppresses sparse/non-repetetitive deviations from the average spectrum,
-    # and works well to discard vocal elements.
+def repet_separate(sr: int, audio: torch.Tensor, width_seconds: float = 2, margin_background: float = 2,
+                   margin_vocals: float = 10, block: int = 512) -> tuple[dict[str, torch.Tensor], int]:
+    """
+    REPET-SIM (Rafii and Pardo, 2012), on the cpu. Repeating parts of the spectrogram are taken as the background,
+    the rest as vocals. Much cheaper than demucs, and rougher.
+    The median of similar frames is the background estimate, similar frames are searched block by block.
+    Based on the librosa vocal separation example by Brian McFee (ISC license).
+    :param width_seconds: Similar frames are at least this far apart, so sustained notes don't count as repeating.
+    :param margin_background: Margin of the background mask, higher puts less in the background.
+    :param margin_vocals: Margin of the vocals mask, higher puts less in the vocals.
+    :param block: Frames per block of the similarity search.
+    :return: ({'vocals': (1, samples), 'no_vocals': (1, samples)}, repet_sr)
+    """
+    import librosa
+    audio = audio.detach().float().cpu()
+    if audio.dim() == 2:
+        audio = audio.mean(0)
+    y = librosa.resample(audio.numpy(), orig_sr=sr, target_sr=repet_sr) if sr != repet_sr else audio.numpy()
+    stft = librosa.stft(y)
+    spectrogram = np.abs(stft)
+    frames = spectrogram.shape[1]
+    width = int(librosa.time_to_frames(width_seconds, sr=repet_sr))
+    k = int(2 * np.ceil(np.sqrt(max(frames - 2 * width + 1, 1))))  # Same default as librosa's nn_filter
+    background = _neighbour_median(spectrogram, _nearest_neighbours(spectrogram, k, width, block)) \
+        if frames > 2 * width else spectrogram.copy()
+    # The background can't be louder than the mix
+    np.minimum(spectrogram, background, out=background)
+    foreground = spectrogram - background
+    mask_background = librosa.util.softmask(background, margin_background * foreground, power=2)
+    mask_vocals = librosa.util.softmask(foreground, margin_vocals * background, power=2)
+    del spectrogram, background, foreground
+    stems = {
+        'vocals': librosa.istft(stft * mask_vocals, length=len(y)),
+        'no_vocals': librosa.istft(stft * mask_background, length=len(y)),
+    }
+    return {stem: torch.from_numpy(wav).unsqueeze(0) for stem, wav in stems.items()}, repet_sr
 
-    S_filter = librosa.decompose.nn_filter(S_full,
-                                           aggregate=np.median,
-                                           metric='cosine',
-                                           width=int(librosa.time_to_frames(2, sr=sr)))
 
-    # The output of the filter shouldn't be greater than the input
-    # if we assume signals are additive.  Taking the pointwise minimium
-    # with the input spectrum forces this.
-    S_filter = np.minimum(S_full, S_filter)
+def default_device() -> str:
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
 
-    # We can also use a margin to reduce bleed between the vocals and instrumentation masks.
-    # Note: the margins need not be equal for foreground and background separation
-    margin_i, margin_v = 2, 10
-    power = 2
 
-    mask_i = librosa.util.softmask(S_filter,
-                                   margin_i * (S_full - S_filter),
-                                   power=power)
+def load_model(name: str = model_name, device=None):
+    """The demucs model, loaded once per name and device and kept in memory."""
+    from demucs.pretrained import get_model
+    device = device or default_device()
+    key = (name, str(device))
+    with _lock:
+        if key not in _models:
+            _models[key] = get_model(name).eval().requires_grad_(False).to(device)
+    return _models[key]
 
-    mask_v = librosa.util.softmask(S_full - S_filter,
-                                   margin_v * S_filter,
-                                   power=power)
 
-    # Once we have the masks, simply multiply them with the input spectrum
-    # to separate the components
+def unload_models():
+    _models.clear()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
 
-    S_foreground = mask_v * S_full
-    S_background = mask_i * S_full
 
-    # S_full_audio = librosa.istft(S_full*phase)
-    S_foreground_audio = librosa.istft(S_foreground*phase)
-    S_background_audio = librosa.istft(S_background*phase)
+def _settings(backend, segment, overlap, shifts):
+    from webui.args import args
+    stem_cache.configure(args.separation_cache_size)
+    return (backend or args.separation_backend,
+            args.separation_segment if segment is None else segment,
+            args.separation_overlap if overlap is None else overlap,
+            args.separation_shifts if shifts is None else shifts)
 
-    return S_foreground_audio, S_background_audio, sr
 
+def demucs_separate(sr: int, audio: torch.Tensor, name: str = model_name, device=None, segment: float = 0,
+                    overlap: float = 0.25, shifts: int = 1) -> tuple[dict[str, torch.Tensor], int]:
+    """
+    Separates audio into the stems of the model, in memory.
+    The track goes through the model one segment at a time, only the current segment is on the device.
+    :param segment: Segment length in seconds, capped to what the model supports. The model's default if 0.
+    :param overlap: Overlap between segments, 0 to 1.
+    :param shifts: Random shifts averaged together, more is better and slower. 0 disables.
+    :return: ({stem: (channels, samples) on the cpu}, sample rate of the stems)
+    """
+    from demucs.apply import apply_model
+    from demucs.audio import convert_audio
+    device = device or default_device()
+    model = load_model(name, device)
+    if segment:
+        segment = min(segment, getattr(model, 'max_allowed_segment', segment))
+    audio = audio.detach().float().cpu()
+    if audio.dim() == 1:
+        audio = audio.unsqueeze(0)
+    wav = convert_audio(audio, sr, model.samplerate, model.audio_channels)
+    # Normalized like demucs.separate does
+    reference = wav.mean(0)
+    mean, std = reference.mean(), reference.std() + 1e-8
+    wav = (wav - mean) / std
+    with torch.inference_mode():
+        sources = apply_model(model, wav[None], shifts=shifts, split=True, overlap=overlap, segment=segment or None,
+                              device=device)[0]
+    sources = sources * std + mean
+    return dict(zip(model.sources, sources)), model.samplerate
 
-def split(sr, audio):
-    import scipy.io.wavfile
-    scipy.io.wavfile.write('speakeraudio.wav', sr, audio.detach().cpu().numpy())
-    # import torchaudio
-    # torchaudio.save('speakeraudio.wav', audio.abs().unsqueeze(0), sr)
 
-    import demucs.separate
+def separate(sr: int, audio: torch.Tensor, backend: str = None, name: str = model_name, device=None,
+             segment: float = None, overlap: float = None, shifts: int = None, two_stems: str = None,
+             cache: bool = True) -> tuple[dict[str, torch.Tensor], int]:
+    """
+    Separates audio with demucs_separate or repet_separate, the segment settings only apply to demucs.
+    Results are kept in the stem cache, so separating the same audio with the same settings again only loads them.
+    :param audio: (samples) or (channels, samples).
+    :param backend: One of backends, --separation-backend if not set. repet only separates vocals.
+    :param two_stems: Only return this stem and the sum of the others as 'no_<stem>', like demucs' --two-stems.
+    :param cache: Use the stem cache.
+    :return: ({stem: (channels, samples) on the cpu}, sample rate of the stems)
+    """
+    backend, segment, overlap, shifts = _settings(backend, segment, overlap, shifts)
+    assert backend in backends, f'Unknown separation backend {backend}'
+    if backend == 'repet':
+        assert two_stems == 'vocals', 'The repet backend only separates vocals'
+        cache_key = stem_cache.key(audio, sr, backend, repet_sr)
+    else:
+        cache_key = stem_cache.key(audio, sr, name, two_stems or 'all', segment, overlap, shifts)
+    if cache:
+        cached = stem_cache.load(cache_key)
+        if cached is not None:
+            return cached
+    if backend == 'repet':
+        stems, sr = repet_separate(sr, audio)
+    else:
+        stems, sr = demucs_separate(sr, audio, name, device, segment, overlap, shifts)
+    if two_stems and f'no_{two_stems}' not in stems:
+        stem = stems.pop(two_stems)
+        stems = {two_stems: stem, f'no_{two_stems}': sum(stems.values())}
+    if cache:
+        stem_cache.save(cache_key, stems, sr)
+    return stems, sr
+
+
+def split(sr, audio, **kwargs):
+    """
+    Vocals and everything else, see separate() for the kwargs.
+    :return: (vocals, other, sr), (channels, samples) tensors.
+    """
+    stems, sr = separate(sr, audio, two_stems='vocals', **kwargs)
+    return stems['vocals'], stems['no_vocals'], sr
+
+
+def benchmark(seconds=20, repeats=2, name=model_name, device='cpu'):
+    """
+    Time of the previous split (demucs.separate.main, which reloads the model and goes through files) against separate(),
+    without and with the stem cache. Needs the model to be downloaded already, the first load isn't timed.
+    :return: {variant: seconds per separation}
+    """
+    import os
     import shlex
-    # model_name = 'htdemucs'
-    model_name = 'htdemucs_6s'
-    # model_name = 'mdx_extra_q'
-    args = shlex.split(f'speakeraudio.wav -n {model_name} --two-stems vocals --filename {{stem}}.{{ext}} --float32')
-    demucs.separate.main(args)
+    import tempfile
+    import scipy.io.wavfile
+    import demucs.separate
+    audio = torch.randn(seconds * 44100) * 0.1
+    results = {}
+    load_model(name, device)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'speakeraudio.wav')
+        scipy.io.wavfile.write(path, 44100, audio.numpy())
+        start = time.perf_counter()
+        for _ in range(repeats):
+            demucs.separate.main(shlex.split(f'{path} -n {name} --two-stems vocals --float32 -d {device} -o {directory}'))
+        results['separate.main'] = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        split(44100, audio, backend='demucs', name=name, device=device, segment=0, overlap=0.25, shifts=1, cache=False)
+    results['resident'] = (time.perf_counter() - start) / repeats
+    split(44100, audio, backend='demucs', name=name, device=device, segment=0, overlap=0.25, shifts=1)  # Fills the cache
+    start = time.perf_counter()
+    for _ in range(repeats):
+        split(44100, audio, backend='demucs', name=name, device=device, segment=0, overlap=0.25, shifts=1)
+    results['cached'] = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        split(44100, audio, backend='repet', cache=False)
+    results['repet'] = (time.perf_counter() - start) / repeats
+    return results
+
 
-    # audio_other_files = [os.path.join('separated', model_name, f+'.wav') for f in ['bass', 'drums', 'other', 'piano', 'guitar'] if os.path.isfile(os.path.join('separated', model_name, f+'.wav'))]
-    # audio_other_files = [os.path.join('separated', model_name, f+'.wav') for f in ['bass', 'other', 'piano', 'guitar'] if os.path.isfile(os.path.join('separated', model_name, f+'.wav'))]
-    audio_vocals_file = os.path.join('separated', model_name, 'vocals.wav')
-    other_file = os.path.join('separated', model_name, 'no_vocals.wav')
+def _music(seconds, sr=repet_sr):
+    """A repeating chord pattern with a non repeating melody on top."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    chords = sum(np.sin(2 * np.pi * f * t) for f in [110, 138.6, 164.8]) * (0.6 + 0.4 * np.sign(np.sin(2 * np.pi * 2 * t)))
+    notes = rng.uniform(200, 800, int(seconds * 4) + 1)[(t * 4).astype(int)]
+    melody = np.sin(2 * np.pi * np.cumsum(notes) / sr)
+    return torch.from_numpy((0.1 * chords + 0.2 * melody).astype(np.float32))
 
-    import torchaudio
 
-    vocals, sr = torchaudio.load(audio_vocals_file)
-    additional, _ = torchaudio.load(other_file)
+def _repet_background_reference(spectrogram, width):
+    """The background estimate of the previous _split, with librosa's nn_filter. Only kept for benchmark_repet."""
+    import librosa
+    return librosa.decompose.nn_filter(spectrogram, aggregate=np.median, metric='cosine', width=width)
+
 
-    return vocals, additional, sr
+def check_repet(seconds=20):
+    """The block-wise neighbour median matches librosa's nn_filter on an affinity recurrence matrix (the k nearest frames)."""
+    import librosa
+    spectrogram = np.abs(librosa.stft(_music(seconds).numpy()))
+    width = int(librosa.time_to_frames(2, sr=repet_sr))
+    k = int(2 * np.ceil(np.sqrt(spectrogram.shape[1] - 2 * width + 1)))
+    recurrence = librosa.segment.recurrence_matrix(spectrogram, metric='cosine', width=width, sparse=True, mode='affinity')
+    expected = librosa.decompose.nn_filter(spectrogram, rec=recurrence, aggregate=np.median)
+    result = _neighbour_median(spectrogram, _nearest_neighbours(spectrogram, k, width, block=100))
+    close = np.isclose(result, expected, rtol=1e-4, atol=1e-6).all(axis=0).mean()
+    assert close > 0.99, f'Only {close:.1%} of the frames match nn_filter'
+    stems, sr = repet_separate(repet_sr, _music(seconds))
+    assert sr == repet_sr and all(stem.shape == (1, seconds * repet_sr) for stem in stems.values())
+
+
+def benchmark_repet(seconds=(60, 180)):
+    """
+    Cpu time of the previous nn_filter background estimate against the block-wise one, and of the whole repet_separate.
+    :return: {seconds of audio: {variant: seconds}}
+    """
+    import librosa
+    width = int(librosa.time_to_frames(2, sr=repet_sr))
+    results = {}
+    for length in seconds:
+        audio = _music(length)
+        spectrogram = np.abs(librosa.stft(audio.numpy()))
+        k = int(2 * np.ceil(np.sqrt(spectrogram.shape[1] - 2 * width + 1)))
+        timings = {}
+        start = time.perf_counter()
+        _repet_background_reference(spectrogram, width)
+        timings['nn_filter'] = time.perf_counter() - start
+        start = time.perf_counter()
+        _neighbour_median(spectrogram, _nearest_neighbours(spectrogram, k, width, block=512))
+        timings['block-wise'] = time.perf_counter() - start
+        start = time.perf_counter()
+        repet_separate(repet_sr, audio)
+        timings['repet_separate'] = time.perf_counter() - start
+        results[length] = timings
+    return results
 
 
-# def split(sr, audio):
-#     return audio, audio, sr
+if __name__ == '__main__':
+    check_repet()
+    for _length, _timings in benchmark_repet().items():
+        print(f'{_length}s of audio: ' + ', '.join(f'{variant} {elapsed:.1f}s' for variant, elapsed in _timings.items()))
+    for _variant, _seconds in benchmark().items():
+        print(f'{_variant}: {_seconds:.1f}s per 20s of audio')
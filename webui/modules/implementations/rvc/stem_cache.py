@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import torch
+
+cache_dir = os.path.join('data', 'cache', 'stems')
+max_size = 2048 * 1024 ** 2  # Bytes, set from the command line args by configure(), 0 disables the cache
+stale_seconds = 3600  # Temporary directories untouched for this long are left over from a crashed save
+
+_lock = threading.Lock()
+
+
+def configure(max_size_mb: float = None):
+    global max_size
+    if max_size_mb is not None:
+        max_size = int(max_size_mb * 1024 ** 2)
+
+
+def key(audio: torch.Tensor, sr: int, *params) -> str:
+    """Hash of the audio content and everything else that changes the stems (model name, stem set, segment settings)."""
+    h = hashlib.sha1(audio.detach().float().cpu().contiguous().numpy().tobytes())
+    h.update(json.dumps([sr, list(audio.shape)] + [str(p) for p in params]).encode())
+    return h.hexdigest()
+
+
+def _path(k):
+    return os.path.join(cache_dir, k)
+
+
+def load(k: str):
+    """
+    :return: ({stem: (channels, samples) float32 tensor}, sr), or None if it's not cached.
+    """
+    if not max_size:
+        return None
+    path = _path(k)
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        stems = {stem: torch.from_numpy(np.load(os.path.join(path, f'{stem}.npy')).astype(np.float32))
+                 for stem in meta['stems']}
+        os.utime(path)  # Most recently used
+    except (OSError, ValueError, KeyError):  # Not cached, or evicted meanwhile
+        return None
+    return stems, meta['sr']
+
+
+def save(k: str, stems: dict[str, torch.Tensor], sr: int):
+    """Stores the stems as float16 npy files, then removes the least recently used entries over max_size."""
+    if not max_size:
+        return
+    path = _path(k)
+    temporary = path + f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    os.makedirs(temporary, exist_ok=True)
+    for stem, audio in stems.items():
+        np.save(os.path.join(temporary, f'{stem}.npy'), audio.detach().cpu().numpy().astype(np.float16))
+    with open(os.path.join(temporary, 'meta.json'), 'w') as f:
+        json.dump({'sr': sr, 'stems': list(stems.keys())}, f)
+    with _lock:
+        if os.path.isdir(path):
+            shutil.rmtree(temporary, ignore_errors=True)
+        else:
+            os.replace(temporary, path)
+        _evict()
+
+
+def _size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _evict():
+    """Removes the least recently used entries over max_size, and temporary directories of saves that didn't finish."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        try:
+            if not entry.is_dir():
+                continue
+            mtime = entry.stat().st_mtime
+            if entry.name.endswith('.tmp'):
+                if time.time() - mtime > stale_seconds:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            entries.append((mtime, _size(entry.path), entry.path))
+        except FileNotFoundError:  # Removed by another process
+            continue
+    entries.sort(reverse=True)
+    total = 0
+    for _, entry_size, path in entries:
+        total += entry_size
+        if total > max_size:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def size() -> int:
+    """Bytes used by the cache."""
+    if not os.path.isdir(cache_dir):
+        return 0
+    return sum(_size(entry.path) for entry in os.scandir(cache_dir) if entry.is_dir())
+
+
+def clear():
+    shutil.rmtree(cache_dir, ignore_errors=True)
@@ -4,53 +4,16 @@ copyright: RVC-Project
 license: MIT
 """
 
-import numpy as np, parselmouth, torch, pdb
+import numpy as np, torch, pdb
 from time import time as ttime
 import torch.nn.functional as F
 import scipy.signal as signal
-import pyworld, os, traceback, faiss, librosa, torchcrepe
+import os, traceback, faiss, librosa
 from scipy import signal
-from functools import lru_cache
 
-bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
-
-input_audio_path2wav = {}
-
-
-@lru_cache
-def cache_harvest_f0(input_audio_path, fs, f0max, f0min, frame_period):
-    audio = input_audio_path2wav[input_audio_path]
-    f0, t = pyworld.harvest(
-        audio,
-        fs=fs,
-        f0_ceil=f0max,
-        f0_floor=f0min,
-        frame_period=frame_period,
-    )
-    f0 = pyworld.stonemask(audio, f0, t, fs)
-    return f0
+from webui.modules.implementations.rvc import f0_processing, pitch_extraction, rms_matching
 
-
-def change_rms(data1, sr1, data2, sr2, rate):  # 1是输入音频，2是输出音频,rate是2的占比
-    # print(data1.max(),data2.max())
-    rms1 = librosa.feature.rms(
-        y=data1, frame_length=sr1 // 2 * 2, hop_length=sr1 // 2
-    )  # 每半秒一个点
-    rms2 = librosa.feature.rms(y=data2, frame_length=sr2 // 2 * 2, hop_length=sr2 // 2)
-    rms1 = torch.from_numpy(rms1)
-    rms1 = F.interpolate(
-        rms1.unsqueeze(0), size=data2.shape[0], mode="linear"
-    ).squeeze()
-    rms2 = torch.from_numpy(rms2)
-    rms2 = F.interpolate(
-        rms2.unsqueeze(0), size=data2.shape[0], mode="linear"
-    ).squeeze()
-    rms2 = torch.max(rms2, torch.zeros_like(rms2) + 1e-6)
-    data2 *= (
-        torch.pow(rms1, torch.tensor(1 - rate))
-        * torch.pow(rms2, torch.tensor(rate - 1))
-    ).numpy()
-    return data2
+bh, ah = signal.butter(N=5, Wn=48, btype="high", fs=16000)
 
 
 class VC(object):
@@ -72,70 +35,6 @@ class VC(object):
         self.t_max = self.sr * self.x_max  # 免查询时长阈值
         self.device = config.device
 
-    # From https://github.com/Tiger14n/RVC-GUI/blob/main/vc_infer_pipeline.py. Get the f0 via the pyworld computation.
-    def get_f0_pyworld_computation(self, x, f0_min, f0_max, f0_type):
-        if f0_type == "pyworld harvest":
-            f0, t = pyworld.harvest(
-                x.astype(np.double),
-                fs=self.sr,
-                f0_ceil=f0_max,
-                f0_floor=f0_min,
-                frame_period=10,
-            )
-        elif f0_type == "dio":
-            f0, t = pyworld.dio(
-                x.astype(np.double),
-                fs=self.sr,
-                f0_ceil=f0_max,
-                f0_floor=f0_min,
-                frame_period=10,
-            )
-        f0 = pyworld.stonemask(x.astype(np.double), f0, t, self.sr)
-        f0 = signal.medfilt(f0, 3)
-        return f0
-
-    # From https://github.com/Tiger14n/RVC-GUI/blob/main/vc_infer_pipeline.py: Get the f0 via the crepe algorithm from torchcrepe
-    def get_f0_crepe_computation(
-            self,
-            x,
-            f0_min,
-            f0_max,
-            p_len,
-            hop_length=128,  # 512 before. Hop length changes the speed that the voice jumps to a different dramatic pitch. Lower hop lengths means more pitch accuracy but longer inference time.
-            model="full",  # Either use crepe-tiny "tiny" or crepe "full". Default is full
-    ):
-        x = x.astype(np.float32)  # fixes the F.conv2D exception. We needed to convert double to float.
-        x /= np.quantile(np.abs(x), 0.999)
-        torch_device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        audio = torch.from_numpy(x).to(torch_device, copy=True)
-        audio = torch.unsqueeze(audio, dim=0)
-        if audio.ndim == 2 and audio.shape[0] > 1:
-            audio = torch.mean(audio, dim=0, keepdim=True).detach()
-        audio = audio.detach()
-        print("Initiating prediction with a crepe_hop_length of: " + str(hop_length))
-        pitch: torch.Tensor = torchcrepe.predict(
-            audio,
-            self.sr,
-            hop_length,
-            f0_min,
-            f0_max,
-            model,
-            batch_size=hop_length * 2,
-            device=torch_device,
-            pad=True
-        )
-        p_len = p_len or x.shape[0] // hop_length
-        # Resize the pitch for final f0
-        source = np.array(pitch.squeeze(0).cpu().float().numpy())
-        source[source < 0.001] = np.nan
-        target = np.interp(
-            np.arange(0, len(source) * p_len, len(source)) / p_len,
-            np.arange(0, len(source)),
-            source
-        )
-        f0 = np.nan_to_num(target)
-        return f0 # Resized f0
-
     def get_f0(
         self,
         input_audio_path,
@@ -147,42 +46,11 @@ class VC(object):
         inp_f0=None,
         crepe_hop_length=128
     ):
-        global input_audio_path2wav
-        time_step = self.window / self.sr * 1000
         f0_min = 50
         f0_max = 1100
-        f0_mel_min = 1127 * np.log(1 + f0_min / 700)
-        f0_mel_max = 1127 * np.log(1 + f0_max / 700)
-        if f0_method == "pm":
-            f0 = (
-                parselmouth.Sound(x, self.sr)
-                .to_pitch_ac(
-                    time_step=time_step / 1000,
-                    voicing_threshold=0.6,
-                    pitch_floor=f0_min,
-                    pitch_ceiling=f0_max,
-                )
-                .selected_array["frequency"]
-            )
-            pad_size = (p_len - len(f0) + 1) // 2
-            if pad_size > 0 or p_len - len(f0) - pad_size > 0:
-                f0 = np.pad(
-                    f0, [[pad_size, p_len - len(f0) - pad_size]], mode="constant"
-                )
-        elif f0_method == "harvest":
-            input_audio_path2wav[input_audio_path] = x.astype(np.double)
-            f0 = cache_harvest_f0(input_audio_path, self.sr, f0_max, f0_min, 10)
-            if filter_radius > 2:
-                f0 = signal.medfilt(f0, 3)
-        elif f0_method == "pyworld harvest" or f0_method == "dio":
-            f0 = self.get_f0_pyworld_computation(x, f0_min, f0_max, f0_method)
-        elif f0_method == "torchcrepe":
-            f0 = self.get_f0_crepe_computation(x, f0_min, f0_max, p_len, crepe_hop_length)
-        elif f0_method == "torchcrepe tiny":
-            f0 = self.get_f0_crepe_computation(x, f0_min, f0_max, p_len, crepe_hop_length, "tiny")
-        else:
-            import webui.modules.implementations.rvc.custom_pitch_extraction as cpe
-            f0 = cpe.pitch_extract(f0_method, x, f0_min, f0_max, p_len, time_step, self.sr, self.window)
+        f0 = pitch_extraction.extract(f0_method, x, self.sr, self.window, p_len, f0_min, f0_max,
+                                      filter_radius=filter_radius, crepe_hop_length=crepe_hop_length,
+                                      device=self.device)
         f0 *= pow(2, f0_up_key / 12)
         # with open("test.txt","w")as f:f.write("\n".join([str(i)for i in f0.tolist()]))
         tf0 = self.sr // self.window  # 每秒f0点数
@@ -199,13 +67,7 @@ class VC(object):
             ]
         # with open("test_opt.txt","w")as f:f.write("\n".join([str(i)for i in f0.tolist()]))
         f0bak = f0.copy()
-        f0_mel = 1127 * np.log(1 + f0 / 700)
-        f0_mel[f0_mel > 0] = (f0_mel[f0_mel > 0] - f0_mel_min) * 254 / (
-            f0_mel_max - f0_mel_min
-        ) + 1
-        f0_mel[f0_mel <= 1] = 1
-        f0_mel[f0_mel > 255] = 255
-        f0_coarse = np.rint(f0_mel).astype(np.int)
+        f0_coarse = f0_processing.f0_to_coarse(f0, f0_min, f0_max)
         return f0_coarse, f0bak  # 1-0
 
     def vc(
@@ -476,7 +338,7 @@ class VC(object):
             )
         audio_opt = np.concatenate(audio_opt)
         if rms_mix_rate != 1:
-            audio_opt = change_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
+            audio_opt = rms_matching.match_rms(audio, 16000, audio_opt, tgt_sr, rms_mix_rate)
         if resample_sr >= 16000 and tgt_sr != resample_sr:
             audio_opt = librosa.resample(
                 audio_opt, orig_sr=tgt_sr, target_sr=resample_sr
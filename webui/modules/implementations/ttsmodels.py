@@ -1,4 +1,5 @@
 import os.path
+import random
 import tempfile
 
 import gradio
@@ -7,8 +8,8 @@ import numpy as np
 import scipy.io.wavfile
 
 import webui.modules.models as mod
-from webui.modules.implementations.patches.bark_custom_voices import wav_to_semantics, generate_fine_from_wav, \
-    generate_course_history
+from webui.modules.implementations.patches.bark_custom_voices import wav_to_semantics, clone_voice, clone_voices
+from webui.modules.implementations.patches.bark_speaker_library import library
 
 
 class BarkTTS(mod.TTSModelLoader):
@@ -16,12 +17,14 @@ class BarkTTS(mod.TTSModelLoader):
 
     @staticmethod
     def get_voices():
-        found_prompts = []
+        found_prompts = library.names()
         base_path = 'data/bark_custom_speakers/'
         for path, subdirs, files in os.walk(base_path):
             for name in files:
                 if name.endswith('.npz'):
-                    found_prompts.append(os.path.join(path, name)[len(base_path):-4])
+                    prompt = os.path.join(path, name)[len(base_path):-4]
+                    if prompt not in library:
+                        found_prompts.append(prompt)
         from webui.modules.implementations.patches.bark_generation import ALLOWED_PROMPTS
         return ['None'] + found_prompts + ALLOWED_PROMPTS
 
@@ -29,20 +32,14 @@ class BarkTTS(mod.TTSModelLoader):
     def create_voice(file):
         file_path = file.name
         file_name = '.'.join(file_path.replace('\\', '/').split('/')[-1].split('.')[:-1])
-        out_file = f'data/bark_custom_speakers/{file_name}.npz'
 
-        semantic_prompt = wav_to_semantics(file.name)
-        fine_prompt = generate_fine_from_wav(file.name)
-        coarse_prompt = generate_course_history(fine_prompt)
-
-
-        np.savez(out_file,
-                 semantic_prompt=semantic_prompt,
-                 fine_prompt=fine_prompt,
-                 coarse_prompt=coarse_prompt
-                 )
+        library.add(file_name, clone_voice(file.name), source=os.path.basename(file_path))
         return file_name
 
+    @staticmethod
+    def create_voices(files):
+        return clone_voices([file.name for file in files])
+
     def _components(self, **quick_kwargs):
         def update_speaker(option):
             if option == 'File':
@@ -76,6 +73,7 @@ class BarkTTS(mod.TTSModelLoader):
         with gradio.Row(visible=False) as temps:
             text_temp = gradio.Slider(0.05, 1, 0.7, step=0.05, label='Text temperature', **quick_kwargs)
             waveform_temp = gradio.Slider(0.05, 1, 0.7, step=0.05, label='Waveform temperature', **quick_kwargs)
+            seed = gradio.Number(-1, label='Seed', info='Default: -1 (random). The same seed, text and settings give the same result.', **quick_kwargs)
         mode = gradio.Radio(['File', 'Upload'], label='Speaker from', value='File', **quick_kwargs)
         clone_guide = gradio.Markdown('''
 ## When cloning a voice:
@@ -96,17 +94,27 @@ class BarkTTS(mod.TTSModelLoader):
         # speaker_file_transcript.hide = True
 
         keep_generating = gradio.Checkbox(label='Keep it up (keep generating)', value=False, **quick_kwargs)
+        cache_tokens = gradio.Checkbox(label='Reuse cached tokens', value=False, info='Reuse semantic and coarse tokens from earlier generations with the same text, speaker and settings. Useful for only regenerating the waveform. The seed is part of the key, with seed -1 the previous seed is reused.', **quick_kwargs)
+
+        session = gradio.State({})  # Per browser session, keeps the last seed for reusing cached tokens with seed -1
 
         mode.select(fn=update_speaker, inputs=mode, outputs=[speaker, refresh_speakers, speaker_file])
         input_type.select(fn=update_input, inputs=input_type, outputs=[textbox, audio_upload])
         return [textbox, audio_upload, input_type, mode, text_temp, waveform_temp,
-                speaker, speaker_file, refresh_speakers, keep_generating, clone_guide, temps, speakers]
+                speaker, speaker_file, refresh_speakers, keep_generating, clone_guide, cache_tokens, seed, session, temps, speakers]
 
     model = 'suno/bark'
 
     def get_response(self, *inputs):
         textbox, audio_upload, input_type, mode, text_temp, waveform_temp, speaker,\
-            speaker_file, refresh_speakers, keep_generating, clone_guide = inputs
+            speaker_file, refresh_speakers, keep_generating, clone_guide, cache_tokens, seed, session = inputs
+        if seed is not None and seed >= 0:
+            seed = int(seed)
+        elif cache_tokens and 'seed' in session:  # The seed is part of the cache key
+            seed = session['seed']
+        else:
+            seed = random.randint(0, 2 ** 32 - 1)
+        session['seed'] = seed
         _speaker = None
         if mode == 'File':
             _speaker = speaker if speaker != 'None' else None
@@ -116,17 +124,21 @@ class BarkTTS(mod.TTSModelLoader):
             scipy.io.wavfile.write(temp_file, speaker_sr, speaker_wav)
             _speaker = self.create_voice(temp_file)
         from webui.modules.implementations.patches.bark_api import generate_audio_new, semantic_to_waveform_new
+        from webui.modules.implementations.patches import bark_profiler
         from bark.generation import SAMPLE_RATE
-        if input_type == 'Text':
-            history_prompt, audio = generate_audio_new(textbox, _speaker, text_temp, waveform_temp, output_full=True,
-                                                       allow_early_stop=not keep_generating)
-        else:
-            semantics = wav_to_semantics(audio_upload.name).numpy()
-            history_prompt, audio = semantic_to_waveform_new(semantics, _speaker, waveform_temp, output_full=True)
+        with bark_profiler.collect() as metrics:
+            if input_type == 'Text':
+                history_prompt, audio = generate_audio_new(textbox, _speaker, text_temp, waveform_temp, output_full=True,
+                                                           allow_early_stop=not keep_generating, seed=seed,
+                                                           use_cache=cache_tokens)
+            else:
+                semantics = wav_to_semantics(audio_upload.name).numpy()
+                history_prompt, audio = semantic_to_waveform_new(semantics, _speaker, waveform_temp, output_full=True,
+                                                                 seed=seed, use_cache=cache_tokens)
         temp = tempfile.NamedTemporaryFile(delete=False)
         temp.name = temp.name.replace(temp.name.replace('\\', '/').split('/')[-1], 'speaker.npz')
         numpy.savez(temp.name, **history_prompt)
-        return (SAMPLE_RATE, audio), temp.name
+        return (SAMPLE_RATE, audio), temp.name, f'Seed: {seed}\n{bark_profiler.summary(metrics)}'
 
     def unload_model(self):
         from bark.generation import clean_models
@@ -147,6 +159,8 @@ class BarkTTS(mod.TTSModelLoader):
             coarse_use_small=low_vram,
             text_use_small=low_vram
         )
+        from webui.modules.implementations.patches import bark_precision
+        bark_precision.apply(args.bark_precision, args.bark_codec_precision)
 
 
 elements = []
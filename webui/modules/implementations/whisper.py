@@ -1,8 +1,12 @@
 import gc
+
+import numpy as np
 import torch
 import whisper
 from transformers import WhisperProcessor, WhisperForConditionalGeneration, pipeline, AutomaticSpeechRecognitionPipeline
 
+from webui.modules.audio_ingest import ingest_numpy, PolyphaseResampler
+
 processor: WhisperProcessor = None
 model: WhisperForConditionalGeneration | AutomaticSpeechRecognitionPipeline = None
 device: str = None
@@ -68,10 +72,7 @@ def transcribe(wav):
     if loaded_model is not None:
         import traceback
         try:
-            if sr != 16000:
-                import torchaudio.functional as F
-                wav = F.resample((torch.tensor(wav).to(device).float() / 32767.0).mean(-1).squeeze().unsqueeze(0), sr, 16000).flatten().cpu().detach().numpy()
-                sr = 16000
+            sr, wav = ingest_numpy(wav, sr, 16000)
             # return model(wav)['text'].strip()
             return whisper.transcribe(model, wav)['text'].strip()
         except Exception as e:
@@ -79,3 +80,110 @@ def transcribe(wav):
             return f'Exception: {e}'
     else:
         return 'No model loaded! Please load a model.'
+
+
+class StreamingTranscriber:
+    """
+    Transcribes audio which arrives in chunks, for example from a streaming microphone.
+
+    Audio is kept in a rolling buffer. Every ``decode_interval`` seconds the buffer is decoded, segments which were
+    decoded the same way twice in a row (except the last one, which is still unstable) are committed, and the buffer is
+    trimmed to just before the uncommitted tail, keeping ``overlap`` seconds of context. So only the tail is re-decoded.
+    """
+
+    def __init__(self, decode_interval=1.0, max_buffer=20.0, overlap=0.5):
+        self.decode_interval = decode_interval
+        self.max_buffer = max_buffer
+        self.overlap = overlap
+        self.resampler: PolyphaseResampler = None
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.committed = []
+        self.tail = ''
+        self.previous_segments = []
+        self.since_decode = 0
+
+    @property
+    def text(self):
+        return ' '.join(self.committed).strip()
+
+    def hypothesis(self):
+        return {'partial': ' '.join(self.committed + [self.tail]).strip(), 'final': self.text}
+
+    def _decode(self):
+        result = whisper.transcribe(model, self.buffer, initial_prompt=self.text[-200:] or None,
+                                    condition_on_previous_text=False)
+        return [(seg['end'], seg['text'].strip()) for seg in result['segments'] if seg['text'].strip()]
+
+    def _commit(self, segments, upto):
+        if upto <= 0:
+            return
+        for _, text in segments[:upto]:
+            self.committed.append(_strip_overlap(self.committed, text))
+        cut = max(0, int((segments[upto - 1][0] - self.overlap) * 16000))
+        self.buffer = self.buffer[cut:]
+        self.previous_segments = []
+
+    def push(self, sr, chunk):
+        if loaded_model is None:
+            raise RuntimeError('No model loaded! Please load a model.')
+        _, chunk = ingest_numpy(chunk, sr)
+        if sr != 16000:
+            if self.resampler is None or self.resampler.orig_sr != sr:
+                self.resampler = PolyphaseResampler(sr, 16000)
+            chunk = self.resampler.process(chunk)
+        self.buffer = np.concatenate([self.buffer, chunk])
+        self.since_decode += len(chunk)
+        if self.since_decode < self.decode_interval * 16000:
+            return self.hypothesis()
+        self.since_decode = 0
+
+        segments = self._decode()
+        stable = 0
+        for i, (seg, prev) in enumerate(zip(segments[:-1], self.previous_segments)):
+            if seg[1] != prev[1]:
+                break
+            stable = i + 1
+        if len(self.buffer) > self.max_buffer * 16000 and stable == 0:
+            stable = max(0, len(segments) - 1)  # Buffer is full, force a commit of everything except the tail.
+        self.previous_segments = segments
+        self._commit(segments, stable)
+        self.tail = ' '.join(text for _, text in segments[stable:])
+        return self.hypothesis()
+
+    def finish(self):
+        if self.resampler is not None:
+            self.buffer = np.concatenate([self.buffer, self.resampler.process(np.zeros(0), final=True)])
+        if len(self.buffer) and loaded_model is not None:
+            segments = self._decode()
+            self._commit(segments, len(segments))
+        self.buffer = np.zeros(0, dtype=np.float32)
+        self.tail = ''
+        self.resampler = None
+        return self.hypothesis()
+
+
+def _strip_overlap(committed, text, max_words=8):
+    """Removes words at the start of ``text`` which repeat the end of the committed text, caused by buffer overlap."""
+    previous = ' '.join(committed).split()[-max_words:]
+    words = text.split()
+    for n in range(min(len(previous), len(words)), 0, -1):
+        if [w.lower().strip('.,!?') for w in previous[-n:]] == [w.lower().strip('.,!?') for w in words[:n]]:
+            return ' '.join(words[n:])
+    return text
+
+
+def transcribe_stream(wav, state: StreamingTranscriber = None):
+    state = state or StreamingTranscriber()
+    if wav is None:
+        return state.hypothesis()['partial'], state
+    sr, chunk = wav
+    try:
+        return state.push(sr, chunk)['partial'], state
+    except Exception as e:
+        return f'Exception: {e}', state
+
+
+def finish_stream(state: StreamingTranscriber = None):
+    if state is None:
+        return '', None
+    return state.finish()['final'], None
@@ -3,11 +3,26 @@ import webui.modules.implementations.audioldm as aldm
 
 
 def generate(prompt, negative, duration, steps, cfg, seed, wav_best_count):
-    output = aldm.generate(prompt, negative, steps, duration, cfg, seed, wav_best_count)
-    if isinstance(output, str):
-        return None, None, output
-    else:
-        return output[1], gradio.make_waveform(output[1]), f'Successfully generated audio with seed: {output[0]}.'
+    # Gradio batches queued clicks, they're split into pipeline calls by aldm.generate_batch.
+    requests = [{'prompt': p, 'negative_prompt': n, 'steps': st, 'duration': d, 'cfg': c, 'seed': s, 'wav_best_count': w}
+                for p, n, d, st, c, s, w in zip(prompt, negative, duration, steps, cfg, seed, wav_best_count)]
+    audios, videos, texts = [], [], []
+    for output in aldm.generate_batch(requests):
+        if isinstance(output, str):
+            audios.append(None)
+            videos.append(None)
+            texts.append(output)
+        else:
+            audios.append(output[1])
+            videos.append(gradio.make_waveform(output[1]))
+            stats = output[2]
+            text = f'Successfully generated audio with seed: {output[0]}.\nTook {stats["latency"]:.2f}s (batch of {stats["batch_size"]}).'
+            if 'peak_vram' in stats:
+                text += f'\nPeak VRAM: {stats["peak_vram"]:.0f}MB.'
+            if 'process_peak_rss' in stats:
+                text += f'\nPeak RSS (since startup): {stats["process_peak_rss"]:.0f}MB.'
+            texts.append(text)
+    return audios, videos, texts
 
 
 def audioldm_tab():
@@ -50,4 +65,4 @@ def audioldm_tab():
             text_out = gradio.Textbox(label='Result')
 
         gen_button.click(fn=generate, inputs=[prompt, neg_prompt, duration, steps, cfg, seed, wav_best_count],
-                         outputs=[audio_out, video_out, text_out])
+                         outputs=[audio_out, video_out, text_out], batch=True, max_batch_size=4)
@@ -7,6 +7,7 @@ import torchaudio
 from TTS.api import TTS
 import gradio
 
+from webui.modules.audio_ingest import to_tensor, normalize_dtype, downmix, ingest
 from webui.modules.download import fill_models
 
 flag_strings = ['denoise', 'denoise output', 'separate background', 'recombine background']
@@ -21,18 +22,7 @@ def flatten_audio(audio_tensor: torch.Tensor | tuple[torch.Tensor, int] | tuple[
             return audio_tensor[0], flatten_audio(audio_tensor[1])
         elif torch.is_tensor(audio_tensor[0]):
             return flatten_audio(audio_tensor[0]), audio_tensor[1]
-    if audio_tensor.dtype == torch.int16:
-        audio_tensor = audio_tensor.float() / 32767.0
-    if audio_tensor.dtype == torch.int32:
-        audio_tensor = audio_tensor.float() / 2147483647.0
-    if len(audio_tensor.shape) == 2:
-        if audio_tensor.shape[0] == 2:
-            # audio_tensor = audio_tensor[0, :].div(2).add(audio_tensor[1, :].div(2))
-            audio_tensor = audio_tensor.mean(0)
-        elif audio_tensor.shape[1] == 2:
-            # audio_tensor = audio_tensor[:, 0].div(2).add(audio_tensor[:, 1].div(2))
-            audio_tensor = audio_tensor.mean(1)
-        audio_tensor = audio_tensor.flatten()
+    audio_tensor = downmix(normalize_dtype(to_tensor(audio_tensor)))
     if add_batch:
         audio_tensor = audio_tensor.unsqueeze(0)
     return audio_tensor
@@ -70,14 +60,9 @@ def load_rvc(model):
 
 
 def denoise(sr, audio):
-    if not torch.is_tensor(audio):
-        audio = torch.tensor(audio)
-    if len(audio.shape) == 1:
-        audio = audio.unsqueeze(0)
-    audio = audio.detach().cpu().numpy()
-    import noisereduce.noisereduce as noisereduce
-    audio = torch.tensor(noisereduce.reduce_noise(y=audio, sr=sr))
-    return sr, audio
+    from webui.modules.implementations import denoising
+    sr, audio = denoising.denoise(sr, audio)
+    return sr, audio.unsqueeze(0)
 
 
 def gen(rvc_model_selected, speaker_id, pitch_extract, tts, text_in, audio_in, up_key, index_rate, filter_radius, protect, crepe_hop_length, flag):
@@ -95,21 +80,15 @@ def gen(rvc_model_selected, speaker_id, pitch_extract, tts, text_in, audio_in, u
             tts_model_name = tts
             print('Loading TTS model')
             tts_model = TTS(tts)
-        audio_in, sr = torch.tensor(tts_model.tts(text_in)), tts_model.synthesizer.output_sample_rate
+        audio_in, sr = np.asarray(tts_model.tts(text_in), dtype=np.float32), tts_model.synthesizer.output_sample_rate
     else:
         sr, audio_in = audio_in
-        audio_in = torch.tensor(audio_in)
-    audio_tuple = (sr, audio_in)
-
-    audio_tuple = flatten_audio(audio_tuple)
+    sr, audio_in = ingest(audio_in, sr)
+    audio_tuple = (sr, audio_in.unsqueeze(0))
 
     if 'separate background' in flag:
-        if not torch.is_tensor(audio_tuple[1]):
-            audio_tuple = (audio_tuple[0], torch.tensor(audio_tuple[1]).to(torch.float32))
-        if len(audio_tuple[1].shape) != 1:
-            audio_tuple = (audio_tuple[0], audio_tuple[1].flatten())
         import webui.modules.implementations.rvc.split_audio as split_audio
-        foreground, background, sr = split_audio.split(*audio_tuple)
+        foreground, background, sr = split_audio.split(sr, audio_in)
         audio_tuple = flatten_audio((sr, foreground))
         background = flatten_audio(background)
     if 'denoise' in flag:
@@ -172,7 +151,8 @@ def rvc():
                         refresh = gradio.Button('🔃', variant='tool secondary')
                         unload = gradio.Button('💣', variant='tool primary')
                 speaker_id = gradio.Slider(value=0, step=1, maximum=0, visible=False, label='Speaker id', info='For multi speaker models, the speaker to use.')
-                pitch_extract = gradio.Radio(choices=["dio", "pm", "harvest", "pyworld harvest", "torchcrepe", "torchcrepe tiny"], label='Pitch extraction', value='dio', interactive=True, info='Default: dio. dio and pm are faster, harvest is slower but good. Crepe is good but uses GPU.')
+                import webui.modules.implementations.rvc.pitch_extraction as pitch_extraction
+                pitch_extract = gradio.Radio(choices=pitch_extraction.choices(), label='Pitch extraction', value='dio', interactive=True, info=f'Default: dio. {pitch_extraction.describe()}.')
                 crepe_hop_length = gradio.Slider(visible=False, minimum=64, maximum=512, step=64, value=128, label='torchcrepe hop length', info='The length of the hops used for torchcrepe\'s crepe implementation')
 
                 def update_crepe_hop_length_visible(pitch_mode: str):
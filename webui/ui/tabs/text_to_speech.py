@@ -58,14 +58,15 @@ def text_to_speech():
             audio_out = gradio.Audio()
             video_out = gradio.Video()
             file_out = gradio.File()
+            info_out = gradio.Textbox(label='Info', show_label=False)
 
     def _generate(inputs, values):
         global loader
         inputs = [values[i] for i in range(len(inputs)) if
                   inputs[i] in all_components_dict[loader.model]]  # Filter and convert inputs
-        response, file = loader.get_response(*inputs)
-        return response, gradio.make_waveform(response), file
+        response, file, *info = loader.get_response(*inputs)  # Loaders can return extra info, like the used seed
+        return response, gradio.make_waveform(response), file, '\n'.join(info)
 
     filtered_components = filter_components(all_components)
     generate.click(fn=lambda *values: _generate(filtered_components, values), inputs=filtered_components,
-                   outputs=[audio_out, video_out, file_out], show_progress=True)
+                   outputs=[audio_out, video_out, file_out, info_out], show_progress=True)
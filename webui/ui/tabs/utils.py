@@ -1,21 +1,51 @@
+import os.path
+
 import gradio
 import torch
 import webui.ui.tabs.rvc as rvc
+from webui.args import args
+from webui.modules.audio_ingest import ingest
 
 
 def denoise_tab():
+    from webui.modules.implementations import denoising
+    method = gradio.Radio(denoising.methods, value=args.denoise_method, label='Method',
+                          info='noisereduce works on any audio, the dns models (facebookresearch/denoiser) are made for speech and output 16 kHz')
     with gradio.Row():
         audio_in = gradio.Audio(label='Input audio')
         audio_out = gradio.Audio(label='Denoised audio')
     denoise_button = gradio.Button('Denoise', variant='primary')
 
-    def denoise_func(audio):
-        sr, wav = audio
-        import noisereduce.noisereduce as noisereduce
-        wav = noisereduce.reduce_noise(y=wav, sr=sr)
-        return sr, wav
-
-    denoise_button.click(fn=denoise_func, inputs=audio_in, outputs=audio_out)
+    gradio.Markdown('## Batch')
+    with gradio.Row():
+        files_in = gradio.Files(label='Audio files')
+        files_out = gradio.Files(label='Denoised files')
+    denoise_files_button = gradio.Button('Denoise files', variant='primary')
+    throughput = gradio.Textbox(label='Throughput')
+
+    def denoise_func(audio, method):
+        record = {}
+        sr, wav = denoising.denoise(audio[0], audio[1], method, record=record)
+        return (sr, wav.numpy()), denoising.describe(record)
+
+    def denoise_files_func(files, method):
+        import tempfile
+        import torchaudio
+        items = []
+        for file in files or []:
+            wav, sr = torchaudio.load(file.name)
+            items.append((sr, wav))
+        out_dir = tempfile.mkdtemp()
+        out_files = []
+        record = {}
+        for file, (sr, wav) in zip(files or [], denoising.denoise_batch(items, method, record=record)):
+            out_file = os.path.join(out_dir, os.path.splitext(os.path.basename(file.name))[0] + '.wav')
+            torchaudio.save(out_file, wav.unsqueeze(0), sr)
+            out_files.append(out_file)
+        return out_files, denoising.describe(record)
+
+    denoise_button.click(fn=denoise_func, inputs=[audio_in, method], outputs=[audio_out, throughput])
+    denoise_files_button.click(fn=denoise_files_func, inputs=[files_in, method], outputs=[files_out, throughput])
 
 
 def music_split_tab():
@@ -24,14 +54,13 @@ def music_split_tab():
         with gradio.Column():
             audio_vocal = gradio.Audio(label='Vocals')
             audio_background = gradio.Audio(label='Other audio')
+    backend = gradio.Radio(['demucs', 'repet'], value=args.separation_backend, label='Backend',
+                           info='demucs is better, repet (REPET-SIM) is much faster on cpu but rougher')
 
-    def music_split_func(audio):
-        sr, wav = audio
-        wav = torch.tensor(wav).float() / 32767.0
-        if wav.shape[0] == 2:
-            wav = wav.mean(0)
+    def music_split_func(audio, backend):
+        sr, wav = ingest(audio[1], audio[0])
         import webui.modules.implementations.rvc.split_audio as split_audio
-        vocal, background, sr = split_audio.split(sr, wav)
+        vocal, background, sr = split_audio.split(sr, wav, backend=backend)
         if vocal.shape[0] == 2:
             vocal = vocal.mean(0)
         if background.shape[0] == 2:
@@ -39,7 +68,7 @@ def music_split_tab():
         return [(sr, vocal.squeeze().detach().numpy()), (sr, background.squeeze().detach().numpy())]
 
     split_button = gradio.Button('Split', variant='primary')
-    split_button.click(fn=music_split_func, inputs=audio_in, outputs=[audio_vocal, audio_background])
+    split_button.click(fn=music_split_func, inputs=[audio_in, backend], outputs=[audio_vocal, audio_background])
 
     with gradio.Row():
         with gradio.Column():
@@ -92,6 +121,53 @@ def audio_download_tab():
     download_button.click(fn=ad.download_audio, inputs=[url_type, url], outputs=file_out)
 
 
+def bark_clone_tab():
+    from webui.modules.implementations.patches.bark_speaker_library import library
+    with gradio.Row():
+        files_in = gradio.Files(label='Reference audio files', file_types=['audio'])
+        result = gradio.Textbox(label='Created speakers', lines=10)
+    clone_button = gradio.Button('Clone all', variant='primary')
+
+    def clone_func(files):
+        if not files:
+            return 'No files given.'
+        from webui.modules.implementations.ttsmodels import BarkTTS
+        names = BarkTTS.create_voices(files)
+        return f'Added {len(names)} speakers to the speaker library:\n' + '\n'.join(names)
+
+    clone_button.click(fn=clone_func, inputs=files_in, outputs=result)
+
+    gradio.Markdown('## Speaker library')
+    with gradio.Row():
+        with gradio.Column():
+            npz_in = gradio.Files(label='Speaker files to import (.npz or .zip)', file_types=['.npz', '.zip'])
+            with gradio.Row():
+                import_button = gradio.Button('Import', variant='primary')
+                migrate_button = gradio.Button('Import data/bark_custom_speakers', variant='secondary')
+        with gradio.Column():
+            export_names = gradio.Dropdown(library.names(), multiselect=True, label='Speakers to export', info='Exports all speakers if empty.')
+            export_button = gradio.Button('Export', variant='primary')
+            export_out = gradio.File(label='Exported speakers')
+    library_status = gradio.Textbox(label='Result', lines=5)
+
+    def import_func(files):
+        names = library.import_npz([file.name for file in files or []])
+        return f'Imported {len(names)} speakers.', gradio.update(choices=library.names())
+
+    def migrate_func():
+        names = library.migrate()
+        return f'Imported {len(names)} speakers.', gradio.update(choices=library.names())
+
+    def export_func(names):
+        import tempfile
+        out_file = os.path.join(tempfile.mkdtemp(), 'speakers.zip')
+        return library.export(names or library.names(), out_file)
+
+    import_button.click(fn=import_func, inputs=npz_in, outputs=[library_status, export_names])
+    migrate_button.click(fn=migrate_func, outputs=[library_status, export_names])
+    export_button.click(fn=export_func, inputs=export_names, outputs=export_out)
+
+
 def utils_tab():
     with gradio.Tabs():
         with gradio.Tab('denoise'):
@@ -100,3 +176,5 @@ def utils_tab():
             music_split_tab()
         with gradio.Tab('audio downloads'):
             audio_download_tab()
+        with gradio.Tab('bark voice cloning'):
+            bark_clone_tab()
@@ -14,6 +14,10 @@ def whisper():
                 def load_model(model):
                     return w.load(model)
             audio = gradio.Audio(label='Audio to transcribe')
+            with gradio.Accordion('Live transcription', open=False):
+                stream_audio = gradio.Audio(source='microphone', streaming=True, label='Microphone')
+                stream_finish = gradio.Button('Finish', variant='secondary')
+                stream_state = gradio.State()
         with gradio.Column():
             transcribe = gradio.Button('Transcribe', variant='primary')
             output = gradio.TextArea(label='Transcript')
@@ -22,3 +26,6 @@ def whisper():
         load.click(fn=load_model, inputs=selected, outputs=output, show_progress=True)
 
         transcribe.click(fn=w.transcribe, inputs=audio, outputs=output)
+        stream_audio.stream(fn=w.transcribe_stream, inputs=[stream_audio, stream_state], outputs=[output, stream_state],
+                            api_name='transcribe_stream')
+        stream_finish.click(fn=w.finish_stream, inputs=stream_state, outputs=[output, stream_state])
@@ -2,9 +2,24 @@ from webui.ui.ui import create_ui
 from .args import args
 
 
+def add_metrics_route(app):
+    from fastapi.responses import PlainTextResponse
+    from webui.modules.implementations.patches import bark_profiler
+
+    def metrics():
+        return PlainTextResponse(bark_profiler.prometheus(), media_type='text/plain; version=0.0.4')
+
+    app.add_api_route('/metrics', metrics, methods=['GET'])
+
+
 def launch_webui():
     auth = (args.username, args.password) if args.username else None
-    create_ui(args.theme).queue().launch(share=args.share,
-                                         auth=auth,
-                                         server_name='0.0.0.0' if args.listen else None,
-                                         server_port=args.port)
+    webui = create_ui(args.theme).queue()
+    webui.launch(share=args.share,
+                 auth=auth,
+                 server_name='0.0.0.0' if args.listen else None,
+                 server_port=args.port,
+                 prevent_thread_lock=args.metrics)
+    if args.metrics:
+        add_metrics_route(webui.server_app)
+        webui.block_thread()